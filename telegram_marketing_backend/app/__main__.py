@@ -0,0 +1,65 @@
+"""Run one process role of the backend.
+
+    python -m app [api|worker|scheduler|all]
+
+The role defaults to APP_ROLE, then "all". Each role imports only what it
+runs: "api" serves HTTP without loading telethon, the scheduler or the
+consumer; "worker" consumes the event streams; "scheduler" runs the
+elected scheduler; "all" is the API with both embedded (a single-process
+setup). The schema is created by the scheduler and all roles.
+"""
+import asyncio
+import os
+import signal
+import sys
+
+ROLES = ("api", "worker", "scheduler", "all")
+
+async def run_until_terminated(role):
+    """Run role() and turn SIGTERM (docker stop) into a cancellation, so its cleanup runs.
+
+    The worker flushes its buffered send logs on the way out; without this the
+    process is killed with them still in memory.
+    """
+    task = asyncio.current_task()
+    loop = asyncio.get_running_loop()
+    try:
+        loop.add_signal_handler(signal.SIGTERM, task.cancel)
+    except NotImplementedError:
+        pass # No loop signal handlers on Windows
+    try:
+        await role()
+    except asyncio.CancelledError:
+        print("Terminated, shut down cleanly")
+    finally:
+        try:
+            loop.remove_signal_handler(signal.SIGTERM)
+        except NotImplementedError:
+            pass
+
+def main(argv=None):
+    argv = sys.argv[1:] if argv is None else argv
+    role = argv[0] if argv else os.getenv("APP_ROLE", "all")
+    if role not in ROLES:
+        sys.exit(f"Unknown role {role!r}, expected one of: {', '.join(ROLES)}")
+    # Read by app.main when uvicorn imports it
+    os.environ["APP_ROLE"] = role
+
+    if role in ("api", "all"):
+        import uvicorn
+        uvicorn.run(
+            "app.main:app",
+            host=os.getenv("HOST", "0.0.0.0"),
+            port=int(os.getenv("PORT", "8000")),
+            workers=int(os.getenv("WEB_CONCURRENCY", "1")),
+            reload=os.getenv("RELOAD", "0") == "1",
+        )
+    elif role == "worker":
+        from .events.consumer import run_worker
+        asyncio.run(run_until_terminated(run_worker))
+    else:
+        from .scheduler_service import run_scheduler
+        asyncio.run(run_until_terminated(run_scheduler))
+
+if __name__ == "__main__":
+    main()
@@ -17,3 +17,9 @@ Base = declarative_base()
 async def get_db():
     async with AsyncSessionLocal() as session:
         yield session
+
+async def create_tables():
+    """Create missing tables. Only the roles that own the schema (scheduler, all) run this at startup."""
+    from . import models
+    async with engine.begin() as conn:
+        await conn.run_sync(models.Base.metadata.create_all)
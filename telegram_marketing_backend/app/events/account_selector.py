@@ -0,0 +1,162 @@
+import os
+import random
+import time
+import zlib
+from datetime import datetime
+from sqlalchemy.future import select
+from ..models import Account
+
+ACCOUNT_SELECTION_STRATEGY = os.getenv("ACCOUNT_SELECTION_STRATEGY", "weighted_health")
+ACCOUNT_STATE_REFRESH_INTERVAL = float(os.getenv("ACCOUNT_STATE_REFRESH_INTERVAL", "15"))
+# account_sent:<YYYY-MM-DD> = {account_id: messages sent that day}
+SENT_KEY_PREFIX = "account_sent"
+# {account_id: last measured proxy latency in ms}, written by the proxy check
+PROXY_LATENCY_KEY = "account_proxy_latency"
+
+# Accounts in these states are never chosen
+EXCLUDED_HEALTH = {"banned", "restricted", "spam_block"}
+HEALTH_WEIGHTS = {
+    "alive": 1.0,
+    "unknown": 0.6,
+    "error": 0.3,
+    "connection_error": 0.2,
+    "flood_wait": 0.1,
+}
+
+def sent_key(day: str = None) -> str:
+    return f"{SENT_KEY_PREFIX}:{day or datetime.utcnow().strftime('%Y-%m-%d')}"
+
+class AccountState:
+    __slots__ = ("is_active", "health_status", "sent_today", "proxy_latency_ms")
+
+    def __init__(self, is_active: bool = True, health_status: str = "unknown", sent_today: int = 0, proxy_latency_ms: float = 0):
+        self.is_active = is_active
+        self.health_status = health_status
+        self.sent_today = sent_today
+        self.proxy_latency_ms = proxy_latency_ms
+
+class AccountStateView:
+    """In-memory snapshot of per-account state used to choose senders.
+
+    refresh() reloads it with one small query and two Redis reads; between
+    refreshes, sends made by this worker are counted locally.
+    """
+
+    def __init__(self, redis_client=None, session_factory=None, cooldowns=None):
+        self.redis = redis_client
+        self.session_factory = session_factory
+        self.cooldowns = cooldowns
+        self.states = {} # {account_id: AccountState}
+        self.pending_sends = {} # Sends not yet added to the shared daily counter
+        self.refreshed_at = 0.0
+
+    def state(self, account_id: int) -> AccountState:
+        state = self.states.get(account_id)
+        if state is None:
+            # Accounts created since the last refresh
+            state = self.states[account_id] = AccountState()
+        return state
+
+    def record_send(self, account_id: int):
+        self.state(account_id).sent_today += 1
+        self.pending_sends[account_id] = self.pending_sends.get(account_id, 0) + 1
+
+    def usable(self, account_ids) -> list:
+        now = time.time()
+        result = []
+        for account_id in account_ids:
+            state = self.state(account_id)
+            if not state.is_active or state.health_status in EXCLUDED_HEALTH:
+                continue
+            if self.cooldowns is not None and self.cooldowns.is_parked(account_id, now):
+                continue
+            result.append(account_id)
+        return result
+
+    async def refresh(self):
+        key = sent_key()
+        pipe = self.redis.pipeline(transaction=False)
+        for account_id, count in self.pending_sends.items():
+            pipe.hincrby(key, account_id, count)
+        pipe.expire(key, 2 * 24 * 3600)
+        pipe.hgetall(key)
+        pipe.hgetall(PROXY_LATENCY_KEY)
+        results = await pipe.execute()
+        self.pending_sends = {}
+        sent, latency = results[-2], results[-1]
+
+        async with self.session_factory() as db:
+            rows = (await db.execute(select(Account.id, Account.is_active, Account.health_status))).all()
+
+        states = {}
+        for account_id, is_active, health_status in rows:
+            states[account_id] = AccountState(
+                is_active=is_active is not False,
+                health_status=health_status or "unknown",
+                sent_today=int(sent.get(str(account_id).encode(), 0)),
+                proxy_latency_ms=float(latency.get(str(account_id).encode(), 0)),
+            )
+        self.states = states
+        self.refreshed_at = time.time()
+
+class RandomStrategy:
+    def choose(self, candidates: list, data: dict, view: AccountStateView):
+        return random.choice(candidates)
+
+class LeastLoadedStrategy:
+    """The account that sent the fewest messages today (ties broken randomly)."""
+
+    def choose(self, candidates: list, data: dict, view: AccountStateView):
+        lowest = min(view.state(a).sent_today for a in candidates)
+        return random.choice([a for a in candidates if view.state(a).sent_today == lowest])
+
+class WeightedHealthStrategy:
+    """Random choice weighted by health, proxy latency and today's load."""
+
+    def weight(self, state: AccountState) -> float:
+        weight = HEALTH_WEIGHTS.get(state.health_status, 0.3)
+        weight /= 1 + state.proxy_latency_ms / 1000
+        weight /= 1 + state.sent_today / 100
+        return weight
+
+    def choose(self, candidates: list, data: dict, view: AccountStateView):
+        weights = [self.weight(view.state(a)) for a in candidates]
+        return random.choices(candidates, weights=weights)[0]
+
+class StickyStrategy:
+    """Always the same account for the same recipient while it stays usable.
+
+    Rendezvous hashing: when an account drops out, only its recipients move.
+    """
+
+    def choose(self, candidates: list, data: dict, view: AccountStateView):
+        recipient = str(data.get("recipient", ""))
+        return max(candidates, key=lambda a: zlib.crc32(f"{recipient}:{a}".encode()))
+
+STRATEGIES = {
+    "random": RandomStrategy,
+    "least_loaded": LeastLoadedStrategy,
+    "weighted_health": WeightedHealthStrategy,
+    "sticky": StickyStrategy,
+}
+
+class AccountSelector:
+    def __init__(self, view: AccountStateView, strategy: str = ACCOUNT_SELECTION_STRATEGY):
+        if strategy not in STRATEGIES:
+            raise ValueError(f"Unknown account selection strategy: {strategy}")
+        self.view = view
+        self.strategy = STRATEGIES[strategy]()
+
+    def select(self, data: dict):
+        """Pick the sending account for a task (None if the task has no accounts).
+
+        Falls back to any account of the task when none is usable, so the
+        failure gets logged instead of the task disappearing.
+        """
+        account_ids = data.get("account_ids")
+        if not account_ids:
+            return None
+        candidates = self.view.usable(account_ids)
+        if not candidates:
+            return random.choice(account_ids)
+        return self.strategy.choose(candidates, data, self.view)
@@ -1,47 +1,489 @@
 import asyncio
+import itertools
 import json
+import msgpack
+import random
 import redis.asyncio as redis
 import os
-from telethon import TelegramClient, errors
-from telethon.sessions import StringSession
+import socket
+import time
+import uuid
+from telethon import errors
 from sqlalchemy.ext.asyncio import create_async_engine, AsyncSession
 from sqlalchemy.orm import sessionmaker
-from sqlalchemy.future import select
-from ..models import Account, MessageTemplate, SendLog, Campaign
 from ..database import DATABASE_URL
+from .log_writer import SendLogWriter
+from .templates import TemplateCache, TEMPLATE_CHANNEL
+from ..services.entity_cache import entity_cache
+from ..services.client_pool import client_pool, ClientUnavailable
+from ..services.cooldowns import AccountCooldowns
+from ..services.suppression import SuppressionIndex
+from ..services.campaign_state import CompletionCounters, parked_key, load_halted, parse_halted_update, CAMPAIGN_CHANNEL
+from .deferred import DeferredQueue
+from .account_selector import AccountSelector, AccountStateView, ACCOUNT_STATE_REFRESH_INTERVAL
+from .rate_limiter import AccountRateLimiter, ACCOUNT_SEND_RATE
+from .producer import STREAM_KEY, PRIORITY_STREAMS, stream_for
+from .payloads import encode_event, decode_event, CampaignContextCache
+from .retry import classify_error, RETRY_POLICIES, RETRY_MAX_ATTEMPTS, RETRY_COUNTS_KEY
+from ..services.runtime_settings import RuntimeSettings, SETTINGS_CHANNEL, FILTERS_KEY, DELAY_SETTINGS_KEY
+from ..services.worker_stats import WORKER_STATS_KEY
 
 REDIS_URL = os.getenv("REDIS_URL", "redis://localhost:6379")
-STREAM_KEY = "telegram_events"
 GROUP_NAME = "campaign_workers"
-CONSUMER_NAME = "worker_1"
+# Every worker process needs its own identity within the group; set CONSUMER_NAME
+# only when a worker should pick up its own pending entries again after a restart.
+CONSUMER_NAME = os.getenv("CONSUMER_NAME") or f"{socket.gethostname()}-{os.getpid()}-{uuid.uuid4().hex[:6]}"
+
+# Pending-entry reclaim
+# Entries idle longer than CLAIM_IDLE_MS belong to a dead worker and are claimed
+# by a live one. Entries delivered more than MAX_DELIVERIES times go to DEAD_LETTER_KEY.
+CLAIM_IDLE_MS = int(os.getenv("CONSUMER_CLAIM_IDLE_MS", "120000"))
+CLAIM_INTERVAL = float(os.getenv("CONSUMER_CLAIM_INTERVAL", "30"))
+MAX_DELIVERIES = int(os.getenv("CONSUMER_MAX_DELIVERIES", "5"))
+DEAD_LETTER_KEY = f"{STREAM_KEY}:dead"
+DEAD_LETTER_MAXLEN = int(os.getenv("CONSUMER_DEAD_LETTER_MAXLEN", "10000"))
+
+# Acknowledged entries are trimmed from the stream every TRIM_INTERVAL seconds
+TRIM_INTERVAL = float(os.getenv("CONSUMER_TRIM_INTERVAL", "60"))
+
+# How often each worker publishes its counters to WORKER_STATS_KEY
+STATS_INTERVAL = float(os.getenv("CONSUMER_STATS_INTERVAL", "10"))
+
+# How often the shared FloodWait cooldowns are re-read and due deferred events promoted
+COOLDOWN_REFRESH_INTERVAL = float(os.getenv("CONSUMER_COOLDOWN_REFRESH_INTERVAL", "2"))
+DEFERRED_POLL_INTERVAL = float(os.getenv("CONSUMER_DEFERRED_POLL_INTERVAL", "1"))
+DEFERRED_BATCH_SIZE = int(os.getenv("CONSUMER_DEFERRED_BATCH_SIZE", "200"))
+
+# Dispatch tuning
+# "concurrent" gives every account its own lane so delays and FloodWaits only
+# throttle that account; "sequential" processes one message at a time.
+DISPATCH_MODE = os.getenv("CONSUMER_DISPATCH_MODE", "concurrent")
+READ_COUNT = int(os.getenv("CONSUMER_READ_COUNT", "50"))
+LANES_PER_ACCOUNT = int(os.getenv("CONSUMER_LANES_PER_ACCOUNT", "1"))
+LANE_QUEUE_SIZE = int(os.getenv("CONSUMER_LANE_QUEUE_SIZE", "20"))
+# A task for an account whose lane is full waits this long in the deferred
+# queue, so one slow account never holds up reading for the others
+LANE_FULL_DELAY = float(os.getenv("CONSUMER_LANE_FULL_DELAY", "5"))
+
+# Share of each read reserved for every priority, "priority:weight,...". Higher
+# priorities may take the whole read when lower ones are idle, but never the
+# share reserved for the lower ones, so bulk work is not starved.
+READ_WEIGHTS = dict(
+    (name, float(weight))
+    for name, weight in (item.split(":") for item in os.getenv("CONSUMER_READ_WEIGHTS", "high:8,bulk:1").split(","))
+)
+# Event types that send a message (drips are the same task on a faster stream)
+SEND_EVENTS = ("send_message", "send_drip")
 
 # Database setup for worker
 engine = create_async_engine(DATABASE_URL, echo=False)
 AsyncSessionLocal = sessionmaker(engine, class_=AsyncSession, expire_on_commit=False)
 
+class AccountLane:
+    """Bounded local queue of stream entries for one account, drained by its own tasks.
+
+    Entries are taken by rank (0 = highest priority stream), then in arrival
+    order, so a drip queued behind a campaign's bulk tasks goes out first.
+    """
+
+    def __init__(self, account_id, handler, workers: int = LANES_PER_ACCOUNT, maxsize: int = LANE_QUEUE_SIZE):
+        self.account_id = account_id
+        self.handler = handler
+        self.queue = asyncio.PriorityQueue(maxsize=maxsize)
+        self.counter = itertools.count() # Keeps equal ranks in arrival order
+        self.tasks = [asyncio.create_task(self._run()) for _ in range(max(1, workers))]
+
+    def submit(self, entry, data: dict, rank: int = 0) -> bool:
+        """Queue an entry without waiting. Returns False when the lane is full."""
+        try:
+            self.queue.put_nowait((rank, next(self.counter), entry, data))
+        except asyncio.QueueFull:
+            return False
+        return True
+
+    async def _run(self):
+        while True:
+            _, _, entry, data = await self.queue.get()
+            try:
+                await self.handler(self.account_id, entry, data)
+            except Exception as e:
+                print(f"Error in lane for account {self.account_id}: {e}")
+            finally:
+                self.queue.task_done()
+
+    def stop(self):
+        for task in self.tasks:
+            task.cancel()
+
+def deliveries_key(stream) -> str:
+    """Delivery counts of reclaimed entries: {message_id: deliveries}."""
+    if isinstance(stream, bytes):
+        stream = stream.decode("utf-8")
+    return f"{stream}:deliveries"
+
+def read_counts(read_count: int, weights: dict = READ_WEIGHTS) -> list:
+    """[(priority, reserved entries per read)], highest priority first."""
+    total = sum(weights.get(p, 1.0) for p in PRIORITY_STREAMS) or 1.0
+    return [(p, max(1, int(read_count * weights.get(p, 1.0) / total))) for p in PRIORITY_STREAMS]
+
 class EventConsumer:
-    def __init__(self):
-        self.redis = redis.from_url(REDIS_URL)
-        self.clients = {} # Cache for TelegramClients: {account_id: client}
-
-    async def get_client(self, account_id: int, db: AsyncSession):
-        if account_id in self.clients:
-            client = self.clients[account_id]
-            if client.is_connected():
-                return client
-        
-        # Load account from DB
-        result = await db.execute(select(Account).where(Account.id == account_id))
-        account = result.scalars().first()
-        if not account or not account.session_string:
+    def __init__(self, redis_client=None):
+        self.redis = redis_client or redis.from_url(REDIS_URL)
+        self.lanes = {} # Per-account send lanes: {account_id: AccountLane}
+        self.held = {} # Entries dispatched but not yet acknowledged: {(stream, message_id): delivery_count}
+        self.log_writer = SendLogWriter(AsyncSessionLocal)
+        self.templates = TemplateCache()
+        self.contexts = CampaignContextCache(self.redis)
+        self.suppression = SuppressionIndex(self.redis)
+        self.settings = RuntimeSettings(self.redis)
+        self.cooldowns = AccountCooldowns(self.redis)
+        self.completion = CompletionCounters(self.redis)
+        self.deferred = DeferredQueue(self.redis, stream_for)
+        self.rate_limiter = AccountRateLimiter(self.redis)
+        self.account_states = AccountStateView(self.redis, AsyncSessionLocal, self.cooldowns)
+        self.selector = AccountSelector(self.account_states)
+        self.halted = {} # Stopped and paused campaigns: {campaign_id: state}
+        self.requeued = 0
+        self.retries = 0
+        self.dropped = 0
+        self.parked = 0
+        self.lane_full = 0
+        # Time from publishing to sending, per priority: {priority: [count, ewma_ms, max_ms]}
+        self.latency = {p: [0, 0.0, 0.0] for p in PRIORITY_STREAMS}
+        self.stream_priority = {stream.encode(): p for p, stream in PRIORITY_STREAMS.items()}
+        # Lane order of each stream, highest priority first
+        self.stream_rank = {stream.encode(): rank for rank, stream in enumerate(PRIORITY_STREAMS.values())}
+        # Smooth weighted round robin over the priorities, for reads too small to share
+        self.turns = {p: 0.0 for p in PRIORITY_STREAMS}
+
+    async def get_client(self, account_id: int):
+        """Borrow a pooled client for the account (None if it cannot be used).
+
+        Every client returned here must be handed back with client_pool.release().
+        """
+        try:
+            return await client_pool.get(account_id)
+        except ClientUnavailable as e:
+            print(e)
             return None
-        
-        client = TelegramClient(StringSession(account.session_string), int(account.api_id), account.api_hash)
-        await client.connect()
-        self.clients[account_id] = client
-        return client
 
-    async def process_message(self, data: dict):
+    def select_account(self, data: dict):
+        """Pick the sending account for a task (None if the task has no accounts).
+
+        Banned, inactive and flood-waited accounts are skipped by the selector.
+        """
+        return self.selector.select(data)
+
+    def all_parked(self, data: dict) -> bool:
+        account_ids = data.get("account_ids")
+        return bool(account_ids) and not self.cooldowns.available(account_ids)
+
+    async def requeue(self, data: dict):
+        """Put a task back for another account, or hold it until one of its accounts unblocks."""
+        self.requeued += 1
+        event_type = data.get("event", "send_message")
+        if self.all_parked(data):
+            await self.deferred.schedule(event_type, data, self.cooldowns.next_unblock(data["account_ids"]))
+        else:
+            await self.redis.xadd(stream_for(event_type), encode_event(event_type, data))
+
+    def get_lane(self, account_id) -> AccountLane:
+        lane = self.lanes.get(account_id)
+        if lane is None:
+            lane = AccountLane(account_id, self.handle_lane_message)
+            self.lanes[account_id] = lane
+        return lane
+
+    def send_interval(self, delay: float) -> float:
+        """Seconds between two sends of one account, from the global delay settings.
+
+        A "random" global setting overrides the campaign delay with a random
+        interval; otherwise the campaign's own delay is used.
+        """
+        delay_settings = self.settings.get(DELAY_SETTINGS_KEY)
+        if delay_settings and delay_settings.get("type") == "random":
+            min_d = float(delay_settings.get("min_delay", 1.0))
+            max_d = float(delay_settings.get("max_delay", 5.0))
+            return random.uniform(min_d, max_d)
+        return float(delay or 0)
+
+    async def wait_for_send_token(self, account_id: int, delay: float):
+        if ACCOUNT_SEND_RATE > 0:
+            rate = ACCOUNT_SEND_RATE
+        else:
+            interval = self.send_interval(delay)
+            rate = 1.0 / interval if interval > 0 else 0
+        while True:
+            wait = await self.rate_limiter.try_acquire(account_id, rate)
+            if wait <= 0:
+                return
+            await asyncio.sleep(wait)
+
+    async def schedule_retry(self, data: dict, exc: Exception) -> bool:
+        """Schedule a transient failure for a delayed retry. Returns False if the failure is final."""
+        policy = classify_error(exc)
+        attempt = data.get("attempt", 0) + 1
+        if policy is None or attempt >= RETRY_MAX_ATTEMPTS:
+            return False
+
+        delay = RETRY_POLICIES[policy].delay(attempt)
+        print(f"Retrying {data.get('recipient')} in {delay:.0f}s (attempt {attempt}, {policy}): {exc}")
+        await self.deferred.schedule(data.get("event", "send_message"), {**data, "attempt": attempt}, time.time() + delay)
+        self.retries += 1
+        campaign_id = data.get("campaign_id")
+        if campaign_id is not None:
+            await self.redis.hincrby(RETRY_COUNTS_KEY, campaign_id, 1)
+        return True
+
+    async def hold_if_halted(self, data: dict) -> bool:
+        """Drop tasks of stopped campaigns and set aside tasks of paused ones.
+
+        Costs no database or Telegram call. Returns True if the task was taken care of.
+        """
+        campaign_id = data.get("campaign_id")
+        state = self.halted.get(campaign_id) if isinstance(campaign_id, int) else None
+        if state is None:
+            return False
+        if state == "paused":
+            # Put back on the stream when the campaign is resumed; keeps its credit
+            fields = encode_event(data.get("event", "send_message"), data)
+            await self.redis.rpush(parked_key(campaign_id), msgpack.packb(fields, use_bin_type=True))
+            self.parked += 1
+        else:
+            await self.completion.finish_task(data)
+            self.dropped += 1
+        return True
+
+    async def handle_lane_message(self, account_id, entry, data: dict):
+        try:
+            if await self.hold_if_halted(data):
+                return
+            if account_id is not None and self.cooldowns.is_parked(account_id):
+                # The account hit a FloodWait after this task was queued to it
+                await self.requeue(data)
+            else:
+                await self.process_message(data, account_id=account_id, entry=entry)
+        finally:
+            await self.ack(entry)
+
+    async def ack(self, entry):
+        stream, message_id = entry
+        deliveries = self.held.pop(entry, 1)
+        if deliveries > 1:
+            pipe = self.redis.pipeline(transaction=False)
+            pipe.xack(stream, GROUP_NAME, message_id)
+            pipe.hdel(deliveries_key(stream), message_id)
+            await pipe.execute()
+        else:
+            await self.redis.xack(stream, GROUP_NAME, message_id)
+
+    def record_latency(self, stream, message_id):
+        """Time between XADD (the entry id) and the send, per priority."""
+        priority = self.stream_priority.get(stream)
+        if priority is None:
+            return
+        added_ms = int(message_id.split(b"-")[0])
+        waited = max(0.0, time.time() * 1000 - added_ms)
+        stats = self.latency[priority]
+        stats[0] += 1
+        stats[1] = waited if stats[0] == 1 else stats[1] * 0.9 + waited * 0.1
+        stats[2] = max(stats[2], waited)
+
+    async def dispatch(self, entry, message_data: dict, deliveries: int = 1):
+        """Route one stream entry (stream, message_id) to its lane, or process it inline in sequential mode."""
+        self.held[entry] = deliveries
+        try:
+            event_type, data = decode_event(message_data)
+        except (ValueError, KeyError, TypeError) as e:
+            # Unknown payload version or a corrupt payload: no delivery will ever succeed
+            await self.dead_letter(entry, message_data, deliveries, f"Cannot decode entry: {e}")
+            return
+        if event_type in SEND_EVENTS:
+            data["event"] = event_type
+            try:
+                data = await self.contexts.expand(data)
+            except Exception as e:
+                # Left pending without a holder, so reclaim delivers it again later
+                self.held.pop(entry, None)
+                print(f"Error loading campaign context for entry {entry[1]}: {e}")
+                return
+
+        if event_type in SEND_EVENTS and data.get("campaign_id") in self.halted:
+            try:
+                await self.hold_if_halted(data)
+            finally:
+                await self.ack(entry)
+            return
+
+        if event_type in SEND_EVENTS and "account_ids" not in data and isinstance(data.get("campaign_id"), int):
+            # Compact task without a campaign context: the campaign was deleted
+            print(f"Dropping task of campaign {data['campaign_id']}: no campaign context")
+            try:
+                await self.completion.finish_task(data)
+                self.dropped += 1
+            finally:
+                await self.ack(entry)
+            return
+
+        if event_type in SEND_EVENTS and self.all_parked(data):
+            # Every account of the task is in FloodWait: wait in the deferred queue, not in a lane
+            try:
+                await self.deferred.schedule(event_type, data, self.cooldowns.next_unblock(data["account_ids"]))
+            finally:
+                await self.ack(entry)
+            return
+
+        if event_type in SEND_EVENTS and DISPATCH_MODE == "concurrent":
+            # Hand off to the account's lane; the lane acknowledges when done
+            account_id = self.select_account(data)
+            rank = self.stream_rank.get(entry[0], len(self.stream_rank))
+            if not self.get_lane(account_id).submit(entry, data, rank):
+                # Lane full: try again later rather than stop reading for every other account
+                self.lane_full += 1
+                try:
+                    await self.deferred.schedule(event_type, data, time.time() + LANE_FULL_DELAY)
+                finally:
+                    await self.ack(entry)
+            return
+
+        try:
+            if event_type in SEND_EVENTS:
+                await self.process_message(data, entry=entry)
+        finally:
+            await self.ack(entry)
+
+    async def dead_letter(self, entry, message_data: dict, deliveries: int, reason: str):
+        """Move an entry that will never be processed to DEAD_LETTER_KEY and acknowledge it."""
+        stream, message_id = entry
+        self.held.pop(entry, None)
+        print(f"Moving entry {message_id} to {DEAD_LETTER_KEY}: {reason}")
+        pipe = self.redis.pipeline(transaction=False)
+        dead = {**message_data, b"deliveries": deliveries, b"stream": stream, b"error": reason}
+        pipe.xadd(DEAD_LETTER_KEY, dead, maxlen=DEAD_LETTER_MAXLEN, approximate=True)
+        pipe.xack(stream, GROUP_NAME, message_id)
+        pipe.hdel(deliveries_key(stream), message_id)
+        await pipe.execute()
+        try:
+            event_type, data = decode_event(message_data)
+        except (ValueError, KeyError, TypeError):
+            return
+        if event_type in SEND_EVENTS and data.get("recipient"):
+            # The task will not finish: log it as failed and count it, or its
+            # campaign could never complete
+            self.log_writer.add(
+                campaign_id=data.get("campaign_id"),
+                account_id=None,
+                recipient=data["recipient"],
+                status="failed",
+                error_message=f"Dead-lettered: {reason}",
+            )
+            await self.completion.finish_task(data)
+
+    async def refresh_held(self):
+        """Reset the idle time of entries still waiting in our lanes.
+
+        Re-claiming with JUSTID does not count as a delivery, it only tells other
+        workers that these entries are alive and must not be reclaimed.
+        """
+        by_stream = {}
+        for stream, message_id in self.held:
+            by_stream.setdefault(stream, []).append(message_id)
+        for stream, message_ids in by_stream.items():
+            await self.redis.xclaim(stream, GROUP_NAME, CONSUMER_NAME, 0, message_ids, justid=True)
+
+    async def reclaim_pending(self):
+        """Claim entries left pending by dead workers, highest priority first."""
+        for stream in PRIORITY_STREAMS.values():
+            await self.reclaim_stream(stream.encode())
+
+    async def reclaim_stream(self, stream: bytes):
+        start_id = "0-0"
+        while True:
+            response = await self.redis.xautoclaim(
+                stream, GROUP_NAME, CONSUMER_NAME, CLAIM_IDLE_MS, start_id=start_id, count=READ_COUNT
+            )
+            start_id, messages = response[0], response[1]
+            for message_id, message_data in messages:
+                if message_data is None or (stream, message_id) in self.held:
+                    continue
+                deliveries = await self.redis.hincrby(deliveries_key(stream), message_id, 1) + 1
+                if deliveries > MAX_DELIVERIES:
+                    await self.dead_letter((stream, message_id), message_data, deliveries, f"Exceeded {MAX_DELIVERIES} deliveries")
+                    continue
+                print(f"Reclaimed stale entry {message_id} (delivery {deliveries})")
+                await self.dispatch((stream, message_id), message_data, deliveries)
+            if start_id in (b"0-0", "0-0"):
+                break
+
+    async def trim_stream(self, stream: str):
+        """Drop entries every consumer group has acknowledged.
+
+        Everything older than the oldest pending entry (or, with nothing
+        pending, the last delivered entry) of every group is safe to remove.
+        """
+        safe_id = None
+        for group in await self.redis.xinfo_groups(stream):
+            pending = await self.redis.xpending(stream, group["name"])
+            group_id = pending["min"] if pending["pending"] else group["last-delivered-id"]
+            group_id = group_id.decode() if isinstance(group_id, bytes) else group_id
+            ms, seq = group_id.split("-")
+            if safe_id is None or (int(ms), int(seq)) < safe_id:
+                safe_id = (int(ms), int(seq))
+        if safe_id is not None and safe_id > (0, 0):
+            await self.redis.xtrim(stream, minid=f"{safe_id[0]}-{safe_id[1]}", approximate=True)
+
+    async def trim_loop(self):
+        while True:
+            await asyncio.sleep(TRIM_INTERVAL)
+            for stream in PRIORITY_STREAMS.values():
+                try:
+                    await self.trim_stream(stream)
+                except Exception as e:
+                    print(f"Error trimming stream {stream}: {e}")
+
+    async def cooldown_loop(self):
+        while True:
+            try:
+                await self.cooldowns.refresh()
+            except Exception as e:
+                print(f"Error refreshing account cooldowns: {e}")
+            await asyncio.sleep(COOLDOWN_REFRESH_INTERVAL)
+
+    async def account_state_loop(self):
+        while True:
+            try:
+                await self.account_states.refresh()
+            except Exception as e:
+                print(f"Error refreshing account states: {e}")
+            await asyncio.sleep(ACCOUNT_STATE_REFRESH_INTERVAL)
+
+    async def deferred_loop(self):
+        """Move due retries and parked tasks back onto the stream, in batches."""
+        while True:
+            try:
+                while await self.deferred.promote_due(DEFERRED_BATCH_SIZE) == DEFERRED_BATCH_SIZE:
+                    pass
+            except Exception as e:
+                print(f"Error promoting deferred events: {e}")
+            await asyncio.sleep(DEFERRED_POLL_INTERVAL)
+
+    async def heartbeat_loop(self):
+        while True:
+            await asyncio.sleep(CLAIM_INTERVAL)
+            try:
+                await self.refresh_held()
+            except Exception as e:
+                print(f"Error refreshing pending entries: {e}")
+
+    async def reclaim_loop(self):
+        while True:
+            try:
+                await self.reclaim_pending()
+            except Exception as e:
+                print(f"Error reclaiming pending entries: {e}")
+            await asyncio.sleep(CLAIM_INTERVAL)
+
+    async def process_message(self, data: dict, account_id: int = None, entry=None):
         async with AsyncSessionLocal() as db:
             campaign_id = data.get("campaign_id")
             recipient = data.get("recipient")
@@ -52,92 +494,85 @@ class EventConsumer:
             
             status = "failed"
             error_message = "Unknown error"
-            account_id = None
+            client = None
 
             try:
-                # 1. Select an account
+                # 1. Select an account (already chosen by the dispatcher in concurrent mode)
                 if not account_ids:
                     raise ValueError("No account_ids provided in task")
                 
-                import random
-                account_id = random.choice(account_ids)
+                if account_id is None:
+                    account_id = self.select_account(data)
                 
-                # 2. Get Template
-                result = await db.execute(select(MessageTemplate).where(MessageTemplate.id == template_id))
-                template = result.scalars().first()
+                # 2. Get Template (compiled and cached per worker)
+                template = await self.templates.get(template_id, db)
                 if not template:
                     raise ValueError(f"Template {template_id} not found")
 
                 # 3. Prepare content
-                content = template.content
-                for key, value in variables.items():
-                    if isinstance(value, str):
-                        content = content.replace(f"{{{key}}}", value)
+                content = template.render(variables)
                 
                 # 4. Send Message
-                client = await self.get_client(account_id, db)
+                client = await self.get_client(account_id)
                 if client:
-                    # Resolve entity first
-                    entity = recipient
-                    if not recipient.startswith('+') and not recipient.isdigit():
-                        try:
-                            entity = await client.get_entity(recipient)
-                        except Exception:
-                            pass
+                    # Resolve entity first (cached per account, including failed lookups).
+                    # Only errors about the recipient mean "unresolvable"; connection and
+                    # flood errors go to classify_error and are retried.
+                    try:
+                        peer = await entity_cache.resolve(client, account_id, recipient)
+                    except (ValueError, TypeError, errors.BadRequestError) as e:
+                        print(f"Error resolving {recipient}: {e}")
+                        peer = None
+
+                    if peer is None and not recipient.startswith('+') and not recipient.isdigit():
+                        raise ValueError(f"Could not resolve recipient {recipient}")
+                    entity = peer.input_peer() if peer else recipient
                     
                     # --- FILTERS CHECK ---
-                    try:
-                        filter_settings_json = await self.redis.get("filter_settings")
-                        if filter_settings_json:
-                            filters = json.loads(filter_settings_json)
-                            
-                            if isinstance(entity, str): 
-                                try:
-                                    entity_obj = await client.get_entity(entity)
-                                except:
-                                    entity_obj = None
-                            else:
-                                entity_obj = entity
-
-                            if entity_obj:
-                                # 1. Skip Bots
-                                if filters.get("skip_bots", True):
-                                    if hasattr(entity_obj, 'bot') and entity_obj.bot:
-                                        status = "skipped"
-                                        error_message = "Filter: User is a bot"
-                                        raise ValueError("Filter: User is a bot")
-
-                                # 2. Skip No Photo
-                                if filters.get("skip_no_photo", False):
-                                    if hasattr(entity_obj, 'photo') and not entity_obj.photo:
-                                        status = "skipped"
-                                        error_message = "Filter: User has no photo"
-                                        raise ValueError("Filter: User has no photo")
-                    except ValueError as ve:
-                        # Re-raise to be caught by outer try/except
-                        raise ve
-                    except Exception as e:
-                        print(f"Error checking filters: {e}")
+                    filters = self.settings.get(FILTERS_KEY)
+                    if filters and peer:
+                        # 1. Skip Bots
+                        if filters.get("skip_bots", True) and peer.bot:
+                            status = "skipped"
+                            error_message = "Filter: User is a bot"
+                            raise ValueError("Filter: User is a bot")
+
+                        # 2. Skip No Photo
+                        if filters.get("skip_no_photo", False) and not peer.has_photo:
+                            status = "skipped"
+                            error_message = "Filter: User has no photo"
+                            raise ValueError("Filter: User has no photo")
                     
                     # --- END FILTERS ---
 
+                    # Pace the account cluster-wide; only this account's lane waits
+                    await self.wait_for_send_token(account_id, delay)
+
                     # Send
                     await client.send_message(entity, content)
                     status = "sent"
                     error_message = None
+                    self.account_states.record_send(account_id)
+                    if entry is not None and self.held.get(entry) == 1:
+                        # Reclaimed entries would count the time their dead worker held them
+                        self.record_latency(*entry)
                     print(f"Sent to {recipient} via account {account_id}")
                 else:
                     error_message = f"Could not initialize client for account {account_id}"
                     raise ValueError(error_message)
             
             except errors.FloodWaitError as e:
+                # Park only this account and hand the task to another one; nothing is logged
+                # because the recipient has not been processed yet
                 wait_time = e.seconds
-                error_message = f"FloodWait: Need to wait {wait_time}s"
-                print(f"Rate limit hit. Waiting {wait_time}s...")
-                await asyncio.sleep(wait_time)
-                status = "skipped" 
+                print(f"Rate limit hit on account {account_id}. Parking it for {wait_time}s")
+                await self.cooldowns.park(account_id, wait_time)
+                await self.requeue(data)
+                return
 
             except errors.RPCError as e:
+                if await self.schedule_retry(data, e):
+                    return
                 error_message = f"RPCError {e.code}: {e.message}"
                 print(f"Telegram Error: {error_message}")
 
@@ -148,84 +583,214 @@ class EventConsumer:
                      pass # keep failed
             
             except Exception as e:
+                if await self.schedule_retry(data, e):
+                    return
                 error_message = str(e)
                 print(f"Failed to send to {recipient}: {e}")
+
+            finally:
+                if client:
+                    await client_pool.release(account_id, client)
                 
-            # 5. Log result
+            # 5. Log result (buffered, written in bulk by the log writer)
+            self.log_writer.add(
+                campaign_id=campaign_id,
+                account_id=account_id,
+                recipient=recipient,
+                status=status,
+                error_message=error_message
+            )
+            await self.completion.finish_task(data)
+            if status == "sent":
+                await self.suppression.add("messaged", [recipient])
+
+    async def invalidation_loop(self):
+        """Apply template, settings and campaign changes as soon as the API publishes them.
+
+        Session changes are applied by the client pool itself.
+        """
+        while True:
+            pubsub = self.redis.pubsub()
             try:
-                log = SendLog(
-                    campaign_id=campaign_id,
-                    account_id=account_id,
-                    recipient=recipient,
-                    status=status,
-                    error_message=error_message
-                )
-                db.add(log)
-                await db.commit()
-            except Exception as log_error:
-                print(f"Failed to save log: {log_error}")
-            
-            # 6. Delay
-            # Fetch global delay settings from Redis
+                await pubsub.subscribe(TEMPLATE_CHANNEL, SETTINGS_CHANNEL, CAMPAIGN_CHANNEL)
+                # Updates may have been missed while we were not subscribed
+                self.templates.clear()
+                await self.settings.refresh()
+                self.halted = await load_halted(self.redis)
+                async for message in pubsub.listen():
+                    if message["type"] != "message":
+                        continue
+                    channel = message["channel"].decode("utf-8")
+                    if channel == TEMPLATE_CHANNEL:
+                        self.templates.invalidate(int(message["data"]))
+                    elif channel == SETTINGS_CHANNEL:
+                        await self.settings.refresh(message["data"].decode("utf-8"))
+                    elif channel == CAMPAIGN_CHANNEL:
+                        campaign_id, state = parse_halted_update(message["data"])
+                        if state is None:
+                            self.halted.pop(campaign_id, None)
+                        else:
+                            self.halted[campaign_id] = state
+                        # A deleted campaign's context is gone from Redis, drop our copy too
+                        self.contexts.invalidate(campaign_id)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                print(f"Error in invalidation listener: {e}")
+                await asyncio.sleep(5)
+            finally:
+                await pubsub.close()
+
+    def stats(self) -> dict:
+        return {
+            "consumer": CONSUMER_NAME,
+            "updated_at": time.time(),
+            "lanes": len(self.lanes),
+            "held": len(self.held),
+            "parked_accounts": len(self.cooldowns.until),
+            "requeued": self.requeued,
+            "retries": self.retries,
+            "dropped": self.dropped,
+            "parked": self.parked,
+            "lane_full": self.lane_full,
+            "throttled": self.rate_limiter.throttled,
+            # Time from XADD to send; max_ms is since the previous report
+            "queue_latency_ms": {
+                p: {"count": count, "avg": round(avg, 1), "max": round(peak, 1)}
+                for p, (count, avg, peak) in self.latency.items()
+            },
+            "send_log": self.log_writer.stats(),
+            "templates": self.templates.stats(),
+            "campaign_contexts": self.contexts.stats(),
+            "entities": entity_cache.stats(),
+            "clients": client_pool.stats(),
+        }
+
+    async def stats_loop(self):
+        while True:
             try:
-                delay_settings_json = await self.redis.get("delay_settings")
-                if delay_settings_json:
-                    delay_settings = json.loads(delay_settings_json)
-                    if delay_settings.get("type") == "random":
-                        import random
-                        min_d = float(delay_settings.get("min_delay", 1.0))
-                        max_d = float(delay_settings.get("max_delay", 5.0))
-                        actual_delay = random.uniform(min_d, max_d)
-                        print(f"Sleeping for random delay: {actual_delay:.2f}s")
-                        await asyncio.sleep(actual_delay)
-                    else:
-                        # Fixed delay from settings or campaign override? 
-                        # Let's prefer global fixed setting if set, otherwise campaign delay
-                        # Actually, usually campaign delay is the specific one. 
-                        # But if "Fixed" is set in global Delay module, maybe we should enforce it?
-                        # For now, let's say if Global is "Fixed", we use the Campaign's delay (which is passed as `delay`).
-                        # If Global is "Random", we override with random.
-                        await asyncio.sleep(delay)
-                else:
-                    await asyncio.sleep(delay)
+                await self.redis.hset(WORKER_STATS_KEY, CONSUMER_NAME, json.dumps(self.stats()))
+                for stats in self.latency.values():
+                    stats[2] = 0.0
             except Exception as e:
-                print(f"Error applying delay: {e}")
-                await asyncio.sleep(delay)
+                print(f"Error publishing worker stats: {e}")
+            await asyncio.sleep(STATS_INTERVAL)
+
+    def next_turn(self) -> str:
+        """The priority served first by the next read, in proportion to READ_WEIGHTS."""
+        total = 0.0
+        for priority in self.turns:
+            weight = READ_WEIGHTS.get(priority, 1.0)
+            self.turns[priority] += weight
+            total += weight
+        priority = max(self.turns, key=self.turns.get)
+        self.turns[priority] -= total
+        return priority
+
+    async def read_entries(self, read_count: int) -> list:
+        """Read up to read_count new entries as [(stream, message_id, fields)], highest priority first.
+
+        Each priority gets its share of the read (READ_WEIGHTS) and may use the
+        shares of higher priorities that had nothing queued. A read too small
+        to give every priority a share (sequential mode reads one entry) goes
+        to the priorities in turn instead. Only when every stream is empty
+        does the read block.
+        """
+        if read_count < len(PRIORITY_STREAMS):
+            first = self.next_turn()
+            # The whole read for the priority whose turn it is, the rest only if it is idle
+            quotas = [(first, read_count)] + [(p, 0) for p in PRIORITY_STREAMS if p != first]
+        else:
+            quotas = read_counts(read_count)
+        remaining = read_count
+        entries = []
+        for i, (priority, quota) in enumerate(quotas):
+            reserved = sum(q for _, q in quotas[i + 1:])
+            count = min(remaining, max(quota, remaining - reserved))
+            if count <= 0:
+                continue
+            streams = await self.redis.xreadgroup(GROUP_NAME, CONSUMER_NAME, {PRIORITY_STREAMS[priority]: ">"}, count=count)
+            for stream, messages in streams or []:
+                entries.extend((stream, message_id, message_data) for message_id, message_data in messages)
+                remaining -= len(messages)
+        if entries:
+            return entries
+
+        streams = await self.redis.xreadgroup(
+            GROUP_NAME, CONSUMER_NAME, {stream: ">" for stream in PRIORITY_STREAMS.values()}, count=read_count, block=5000
+        )
+        for stream, messages in streams or []:
+            entries.extend((stream, message_id, message_data) for message_id, message_data in messages)
+        return entries
 
     async def start(self):
-        # Create consumer group if not exists
-        try:
-            await self.redis.xgroup_create(STREAM_KEY, GROUP_NAME, id="0", mkstream=True)
-        except redis.ResponseError as e:
-            if "BUSYGROUP" not in str(e):
-                raise
+        # Create consumer groups if not exists
+        for stream in PRIORITY_STREAMS.values():
+            try:
+                await self.redis.xgroup_create(stream, GROUP_NAME, id="0", mkstream=True)
+            except redis.ResponseError as e:
+                if "BUSYGROUP" not in str(e):
+                    raise
 
-        print(f"Worker started, listening to {STREAM_KEY}...")
+        print(f"Worker {CONSUMER_NAME} started, listening to {', '.join(PRIORITY_STREAMS.values())}...")
+        await self.settings.refresh()
+        self.halted = await load_halted(self.redis)
+        self.log_writer.start()
+        background = [
+            asyncio.create_task(self.heartbeat_loop()),
+            asyncio.create_task(self.reclaim_loop()),
+            asyncio.create_task(self.trim_loop()),
+            asyncio.create_task(self.stats_loop()),
+            asyncio.create_task(self.invalidation_loop()),
+            asyncio.create_task(self.cooldown_loop()),
+            asyncio.create_task(self.deferred_loop()),
+            asyncio.create_task(self.account_state_loop()),
+        ]
         
         while True:
             try:
                 # Read new messages
-                streams = await self.redis.xreadgroup(GROUP_NAME, CONSUMER_NAME, {STREAM_KEY: ">"}, count=1, block=5000)
-                
-                if not streams:
-                    continue
-                
-                for stream, messages in streams:
-                    for message_id, message_data in messages:
-                        event_type = message_data.get(b"type", b"").decode("utf-8")
-                        data_json = message_data.get(b"data", b"{}").decode("utf-8")
-                        data = json.loads(data_json)
-                        
-                        if event_type == "send_message":
-                            await self.process_message(data)
-                        
-                        # Acknowledge
-                        await self.redis.xack(STREAM_KEY, GROUP_NAME, message_id)
+                read_count = READ_COUNT if DISPATCH_MODE == "concurrent" else 1
+                for stream, message_id, message_data in await self.read_entries(read_count):
+                    await self.dispatch((stream, message_id), message_data)
                         
+            except asyncio.CancelledError:
+                for task in background:
+                    task.cancel()
+                self.stop()
+                raise
             except Exception as e:
                 print(f"Error in worker loop: {e}")
                 await asyncio.sleep(5)
 
-if __name__ == "__main__":
+    def stop(self):
+        """Cancel all account lanes. Unacknowledged entries stay pending in the stream.
+
+        They are no longer held either, so a restarted start() (the embedded
+        consumer after losing and regaining its lease) reclaims them instead of
+        keeping them alive.
+        """
+        for lane in self.lanes.values():
+            lane.stop()
+        self.lanes.clear()
+        self.held.clear()
+
+    async def close(self):
+        """Stop the lanes, flush buffered send logs and disconnect the clients."""
+        self.stop()
+        await self.log_writer.close()
+        await client_pool.close()
+        try:
+            await self.redis.hdel(WORKER_STATS_KEY, CONSUMER_NAME)
+        except Exception:
+            pass
+
+async def run_worker():
     consumer = EventConsumer()
-    asyncio.run(consumer.start())
+    try:
+        await consumer.start()
+    finally:
+        await consumer.close()
+
+if __name__ == "__main__":
+    asyncio.run(run_worker())
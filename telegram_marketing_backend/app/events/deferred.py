@@ -0,0 +1,44 @@
+import time
+import uuid
+import msgpack
+from .payloads import encode_event
+
+# Sorted set of stream events waiting for a due time: score = unix time
+DEFERRED_KEY = "telegram_events:deferred"
+
+# Atomically take up to ARGV[2] members that are due at ARGV[1], so that two
+# workers promoting at the same time never get the same event.
+POP_DUE_SCRIPT = """
+local items = redis.call('ZRANGEBYSCORE', KEYS[1], '-inf', ARGV[1], 'LIMIT', 0, tonumber(ARGV[2]))
+if #items > 0 then
+    redis.call('ZREM', KEYS[1], unpack(items))
+end
+return items
+"""
+
+class DeferredQueue:
+    """Holds events that must not be processed before a given time and
+    moves them back onto the stream once they are due."""
+
+    def __init__(self, redis_client, stream_for):
+        self.redis = redis_client
+        self.stream_for = stream_for # event type -> stream key
+        self.pop_due = self.redis.register_script(POP_DUE_SCRIPT)
+
+    async def schedule(self, event_type: str, data: dict, due_at: float):
+        member = msgpack.packb({"id": uuid.uuid4().hex, "e": encode_event(event_type, data)}, use_bin_type=True)
+        await self.redis.zadd(DEFERRED_KEY, {member: due_at})
+
+    async def promote_due(self, limit: int = 100) -> int:
+        items = await self.pop_due(keys=[DEFERRED_KEY], args=[time.time(), limit])
+        if not items:
+            return 0
+        pipe = self.redis.pipeline(transaction=False)
+        for raw in items:
+            fields = msgpack.unpackb(raw, raw=False)["e"]
+            pipe.xadd(self.stream_for(fields["type"]), fields)
+        await pipe.execute()
+        return len(items)
+
+    async def size(self) -> int:
+        return await self.redis.zcard(DEFERRED_KEY)
@@ -0,0 +1,183 @@
+import asyncio
+import os
+import time
+from datetime import datetime
+from sqlalchemy import insert
+from sqlalchemy.exc import IntegrityError, DataError
+from ..models import SendLog
+
+LOG_BATCH_SIZE = int(os.getenv("SEND_LOG_BATCH_SIZE", "500"))
+LOG_FLUSH_INTERVAL = float(os.getenv("SEND_LOG_FLUSH_INTERVAL", "1.0"))
+# Hard cap on buffered rows while the database is unreachable
+LOG_MAX_BUFFER = int(os.getenv("SEND_LOG_MAX_BUFFER", "50000"))
+
+COLUMNS = ["campaign_id", "account_id", "recipient", "status", "error_message", "timestamp"]
+
+# Errors caused by the rows themselves: retrying the batch cannot succeed.
+# COPY raises asyncpg's own exceptions rather than SQLAlchemy's.
+ROW_ERRORS = (IntegrityError, DataError)
+try:
+    import asyncpg
+    ROW_ERRORS += (asyncpg.exceptions.IntegrityConstraintViolationError, asyncpg.exceptions.DataError)
+except ImportError:
+    pass
+
+class SendLogWriter:
+    """Buffers SendLog rows in memory and writes them in bulk.
+
+    A flush happens when LOG_BATCH_SIZE rows are buffered or every
+    LOG_FLUSH_INTERVAL seconds, whichever comes first. On Postgres (asyncpg)
+    rows are written with COPY, otherwise with a single multi-row INSERT.
+
+    A batch that fails on a connection or timeout error is kept for the
+    next flush. A batch the database rejects because of its rows
+    (constraint or data errors) is split in halves until the offending
+    rows are isolated; those are dropped and the rest is written.
+    """
+
+    def __init__(self, session_factory, batch_size: int = LOG_BATCH_SIZE, flush_interval: float = LOG_FLUSH_INTERVAL):
+        self.session_factory = session_factory
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.buffer = []
+        self.flush_requested = asyncio.Event()
+        self.lock = asyncio.Lock()
+        self.task = None
+        # Counters
+        self.flushes = 0
+        self.failures = 0
+        self.rows_written = 0
+        self.rows_dropped = 0
+        self.rows_rejected = 0
+        self.last_flush_ms = 0.0
+        self.max_flush_ms = 0.0
+        self.total_flush_ms = 0.0
+
+    def add(self, campaign_id, account_id, recipient, status, error_message=None):
+        # Drip tasks carry ids like "drip_3_17" that cannot go into the campaigns FK;
+        # one such row would otherwise fail the whole batch.
+        if not isinstance(campaign_id, int):
+            campaign_id = None
+        self.buffer.append({
+            "campaign_id": campaign_id,
+            "account_id": account_id,
+            "recipient": recipient,
+            "status": status,
+            "error_message": error_message,
+            "timestamp": datetime.utcnow(),
+        })
+        if len(self.buffer) >= self.batch_size:
+            self.flush_requested.set()
+
+    async def write(self, rows):
+        async with self.session_factory() as db:
+            if db.get_bind().dialect.driver == "asyncpg":
+                conn = await db.connection()
+                raw = await conn.get_raw_connection()
+                await raw.driver_connection.copy_records_to_table(
+                    SendLog.__tablename__,
+                    records=[tuple(row[c] for c in COLUMNS) for row in rows],
+                    columns=COLUMNS,
+                )
+            else:
+                await db.execute(insert(SendLog), rows)
+            await db.commit()
+
+    def requeue(self, rows):
+        """Keep rows for the next attempt, dropping the oldest beyond the cap."""
+        self.buffer = rows + self.buffer
+        overflow = len(self.buffer) - LOG_MAX_BUFFER
+        if overflow > 0:
+            del self.buffer[:overflow]
+            self.rows_dropped += overflow
+
+    async def write_valid(self, rows) -> int:
+        """Write rows in bisected halves, dropping the ones the database rejects.
+
+        Returns the number of rows written. If the database becomes
+        unreachable midway, the rows not yet written are requeued.
+        """
+        written = 0
+        pending = [rows] # Stack of chunks, next one last
+        while pending:
+            chunk = pending.pop()
+            try:
+                await self.write(chunk)
+                written += len(chunk)
+            except ROW_ERRORS as e:
+                if len(chunk) == 1:
+                    self.rows_rejected += 1
+                    print(f"Dropping send log for {chunk[0]['recipient']} (campaign {chunk[0]['campaign_id']}): {e}")
+                else:
+                    middle = len(chunk) // 2
+                    pending += [chunk[middle:], chunk[:middle]]
+            except Exception as e:
+                self.failures += 1
+                remaining = [row for part in [chunk] + pending[::-1] for row in part]
+                self.requeue(remaining)
+                print(f"Failed to flush {len(remaining)} send logs: {e}")
+                break
+        return written
+
+    async def flush(self):
+        async with self.lock:
+            if not self.buffer:
+                return 0
+            rows, self.buffer = self.buffer, []
+            started = time.perf_counter()
+            try:
+                await self.write(rows)
+                written = len(rows)
+            except ROW_ERRORS as e:
+                print(f"Send log batch of {len(rows)} rejected, isolating the bad rows: {e}")
+                written = await self.write_valid(rows)
+            except Exception as e:
+                self.failures += 1
+                self.requeue(rows)
+                print(f"Failed to flush {len(rows)} send logs: {e}")
+                return 0
+
+            elapsed_ms = (time.perf_counter() - started) * 1000
+            self.flushes += 1
+            self.rows_written += written
+            self.last_flush_ms = elapsed_ms
+            self.max_flush_ms = max(self.max_flush_ms, elapsed_ms)
+            self.total_flush_ms += elapsed_ms
+            return written
+
+    async def run(self):
+        while True:
+            try:
+                await asyncio.wait_for(self.flush_requested.wait(), timeout=self.flush_interval)
+            except asyncio.TimeoutError:
+                pass
+            self.flush_requested.clear()
+            await self.flush()
+
+    def start(self):
+        if self.task is None:
+            self.task = asyncio.create_task(self.run())
+
+    async def close(self):
+        """Stop the periodic flush and write out whatever is still buffered."""
+        if self.task is not None:
+            self.task.cancel()
+            try:
+                await self.task
+            except asyncio.CancelledError:
+                pass
+            self.task = None
+        await self.flush()
+
+    def stats(self) -> dict:
+        return {
+            "buffer_depth": len(self.buffer),
+            "flushes": self.flushes,
+            "flush_failures": self.failures,
+            "rows_written": self.rows_written,
+            "rows_dropped": self.rows_dropped,
+            "rows_rejected": self.rows_rejected,
+            "last_flush_ms": round(self.last_flush_ms, 2),
+            "max_flush_ms": round(self.max_flush_ms, 2),
+            "avg_flush_ms": round(self.total_flush_ms / self.flushes, 2) if self.flushes else 0.0,
+        }
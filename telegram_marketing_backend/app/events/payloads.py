@@ -0,0 +1,131 @@
+import json
+import os
+from collections import OrderedDict
+import msgpack
+
+# Version of the compact encoding, stored in the "v" field of every stream entry.
+# Entries without "v" are legacy {"type", "data": json} events.
+PAYLOAD_VERSION = 1
+
+# Campaign-level task data, stored once per campaign instead of in every task:
+# campaign_ctx:<campaign_id> = msgpack {"account_ids", "delay", "ab_test_id"}
+CAMPAIGN_CTX_PREFIX = "campaign_ctx"
+CAMPAIGN_CTX_TTL = int(os.getenv("CAMPAIGN_CTX_TTL", str(30 * 24 * 3600)))
+CAMPAIGN_CTX_CACHE_SIZE = int(os.getenv("CAMPAIGN_CTX_CACHE_SIZE", "1000"))
+CONTEXT_FIELDS = ("account_ids", "delay", "ab_test_id")
+
+# Short payload keys for the common task fields; other fields keep their name
+FIELD_KEYS = {
+    "campaign_id": "c",
+    "index": "i",
+    "recipient": "r",
+    "template_id": "t",
+    "variables": "x",
+    "attempt": "n",
+    "account_ids": "a",
+    "delay": "d",
+    "ab_test_id": "b",
+}
+KEY_FIELDS = {v: k for k, v in FIELD_KEYS.items()}
+# Set by the worker on decoded tasks, never encoded: "ctx" (context merged in), "event" (event type)
+INTERNAL_FIELDS = ("ctx", "event")
+
+def campaign_ctx_key(campaign_id) -> str:
+    return f"{CAMPAIGN_CTX_PREFIX}:{campaign_id}"
+
+def task_variables(user: dict, placeholders) -> dict:
+    """The part of a recipient's row the template actually references."""
+    if placeholders is None:
+        return user
+    return {key: user[key] for key in placeholders if key in user}
+
+def campaign_tasks(campaign_id: int, users: list, selector, placeholders: dict, start: int = 0, stop: int = None):
+    """Yield ("send_message", task) for the recipients users[start:stop] of a campaign list.
+
+    Rows without a phone or username are skipped but keep their index.
+    """
+    stop = len(users) if stop is None else min(stop, len(users))
+    for index in range(start, stop):
+        user = users[index]
+        recipient = user.get("phone") or user.get("username")
+        if not recipient:
+            continue
+        template_id = selector.select(index)
+        yield "send_message", {
+            "campaign_id": campaign_id,
+            "index": index,
+            "recipient": recipient,
+            "template_id": template_id,
+            # Only the fields the template uses; accounts, delay and A/B id are in the campaign context
+            "variables": task_variables(user, placeholders.get(template_id)),
+        }
+
+def encode_event(event_type: str, data: dict) -> dict:
+    """Stream entry fields for an event: type, payload version and msgpack payload.
+
+    Tasks whose campaign fields were filled in from the campaign context
+    (data["ctx"]) leave those fields out again.
+    """
+    skip = CONTEXT_FIELDS if data.get("ctx") else ()
+    payload = {
+        FIELD_KEYS.get(field, field): value
+        for field, value in data.items()
+        if value is not None and field not in INTERNAL_FIELDS and field not in skip
+    }
+    return {"type": event_type, "v": PAYLOAD_VERSION, "p": msgpack.packb(payload, use_bin_type=True)}
+
+def decode_event(fields: dict):
+    """Return (event_type, data) for a stream entry in the compact or the legacy JSON format."""
+    event_type = fields.get(b"type", b"").decode("utf-8")
+    version = int(fields.get(b"v", 0))
+    if version == 0:
+        return event_type, json.loads(fields.get(b"data", b"{}").decode("utf-8"))
+    if version != PAYLOAD_VERSION:
+        raise ValueError(f"Unsupported payload version {version}")
+    payload = msgpack.unpackb(fields[b"p"], raw=False)
+    return event_type, {KEY_FIELDS.get(key, key): value for key, value in payload.items()}
+
+class CampaignContextCache:
+    """Per-worker LRU of campaign contexts, read from Redis on a miss."""
+
+    def __init__(self, redis_client, max_size: int = CAMPAIGN_CTX_CACHE_SIZE):
+        self.redis = redis_client
+        self.max_size = max_size
+        self.contexts = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    async def get(self, campaign_id):
+        """Return the context dict, or None if the campaign has none (deleted, expired, legacy)."""
+        context = self.contexts.get(campaign_id)
+        if context is not None:
+            self.hits += 1
+            self.contexts.move_to_end(campaign_id)
+            return context
+
+        self.misses += 1
+        raw = await self.redis.get(campaign_ctx_key(campaign_id))
+        if raw is None:
+            return None
+        context = msgpack.unpackb(raw, raw=False)
+        self.contexts[campaign_id] = context
+        while len(self.contexts) > self.max_size:
+            self.contexts.popitem(last=False)
+        return context
+
+    async def expand(self, data: dict) -> dict:
+        """Fill in the campaign-level fields of a compact task."""
+        campaign_id = data.get("campaign_id")
+        if "account_ids" in data or not isinstance(campaign_id, int):
+            return data
+        context = await self.get(campaign_id)
+        if context is not None:
+            data.update(context)
+            data["ctx"] = True
+        return data
+
+    def invalidate(self, campaign_id):
+        self.contexts.pop(campaign_id, None)
+
+    def stats(self) -> dict:
+        return {"size": len(self.contexts), "hits": self.hits, "misses": self.misses}
@@ -1,20 +1,82 @@
-import json
+import asyncio
+import msgpack
 import redis.asyncio as redis
 import os
+from .payloads import encode_event, campaign_ctx_key, CAMPAIGN_CTX_TTL
 
 REDIS_URL = os.getenv("REDIS_URL", "redis://localhost:6379")
 STREAM_KEY = "telegram_events"
+# Priority streams, highest first: {priority: stream key}. Bulk broadcast
+# work stays on the original stream.
+PRIORITY_STREAMS = {
+    "high": f"{STREAM_KEY}:high",
+    "bulk": STREAM_KEY,
+}
+# Event types published above bulk priority
+EVENT_PRIORITIES = {
+    "send_drip": "high",
+}
+# publish_many: XADDs per pipeline, and pipelines awaited at the same time
+PUBLISH_BATCH_SIZE = int(os.getenv("PUBLISH_BATCH_SIZE", "1000"))
+PUBLISH_MAX_IN_FLIGHT = int(os.getenv("PUBLISH_MAX_IN_FLIGHT", "4"))
+
+def event_priority(event_type: str) -> str:
+    return EVENT_PRIORITIES.get(event_type, "bulk")
+
+def stream_for(event_type: str) -> str:
+    return PRIORITY_STREAMS[event_priority(event_type)]
 
 class EventProducer:
     def __init__(self):
         self.redis = redis.from_url(REDIS_URL)
 
     async def publish(self, event_type: str, data: dict):
-        """Publish an event to the Redis stream."""
-        event = {
-            "type": event_type,
-            "data": json.dumps(data)
-        }
-        await self.redis.xadd(STREAM_KEY, event)
+        """Publish an event to the Redis stream of its priority."""
+        await self.redis.xadd(stream_for(event_type), encode_event(event_type, data))
+
+    async def publish_many(self, events, batch_size: int = PUBLISH_BATCH_SIZE) -> int:
+        """Publish (event_type, data) pairs with pipelined XADDs. Returns the number published.
+
+        events may be any iterable, including a generator: at most
+        PUBLISH_MAX_IN_FLIGHT batches are encoded and in flight at once.
+        """
+        in_flight = set()
+        batch = []
+        published = 0
+        try:
+            for event_type, data in events:
+                batch.append((stream_for(event_type), encode_event(event_type, data)))
+                if len(batch) < batch_size:
+                    continue
+                if len(in_flight) >= PUBLISH_MAX_IN_FLIGHT:
+                    done, in_flight = await asyncio.wait(in_flight, return_when=asyncio.FIRST_COMPLETED)
+                    for task in done:
+                        task.result()
+                in_flight.add(asyncio.create_task(self._send_batch(batch)))
+                published += len(batch)
+                batch = []
+            if batch:
+                in_flight.add(asyncio.create_task(self._send_batch(batch)))
+                published += len(batch)
+            await asyncio.gather(*in_flight)
+        except BaseException:
+            for task in in_flight:
+                task.cancel()
+            raise
+        return published
+
+    async def _send_batch(self, batch: list):
+        pipe = self.redis.pipeline(transaction=False)
+        for stream, fields in batch:
+            pipe.xadd(stream, fields)
+        await pipe.execute()
+
+    async def save_context(self, campaign_id: int, context: dict):
+        """Store the campaign-level task fields once; workers merge them into each task."""
+        await self.redis.set(campaign_ctx_key(campaign_id), msgpack.packb(context, use_bin_type=True), ex=CAMPAIGN_CTX_TTL)
+
+    async def notify(self, channel: str, message):
+        """Broadcast a cache invalidation (or similar) message to all workers."""
+        await self.redis.publish(channel, message)
 
 producer = EventProducer()
@@ -0,0 +1,51 @@
+import os
+
+ACCOUNT_SEND_RATE = float(os.getenv("ACCOUNT_SEND_RATE", "0")) # messages/second, 0 = derive from the delay settings
+ACCOUNT_SEND_BURST = float(os.getenv("ACCOUNT_SEND_BURST", "1"))
+RATE_KEY_PREFIX = "rate:account"
+
+# Token bucket kept in a Redis hash {tokens, ts}. Uses the Redis clock so
+# workers with skewed clocks still agree. Returns the number of seconds to
+# wait before a token is available (as a string, Lua numbers are truncated
+# to integers on the way out); 0 means the token was taken.
+TOKEN_BUCKET_SCRIPT = """
+local rate = tonumber(ARGV[1])
+local burst = tonumber(ARGV[2])
+local t = redis.call('TIME')
+local now = tonumber(t[1]) + tonumber(t[2]) / 1000000
+local state = redis.call('HMGET', KEYS[1], 'tokens', 'ts')
+local tokens = tonumber(state[1])
+local ts = tonumber(state[2])
+if tokens == nil then
+    tokens = burst
+    ts = now
+end
+tokens = math.min(burst, tokens + math.max(0, now - ts) * rate)
+local wait = 0
+if tokens >= 1 then
+    tokens = tokens - 1
+else
+    wait = (1 - tokens) / rate
+end
+redis.call('HSET', KEYS[1], 'tokens', tokens, 'ts', now)
+redis.call('PEXPIRE', KEYS[1], math.ceil(burst / rate * 1000) + 1000)
+return tostring(wait)
+"""
+
+class AccountRateLimiter:
+    """Cluster-wide per-account token bucket, shared by every worker through Redis."""
+
+    def __init__(self, redis_client, burst: float = ACCOUNT_SEND_BURST):
+        self.redis = redis_client
+        self.burst = burst
+        self.script = self.redis.register_script(TOKEN_BUCKET_SCRIPT)
+        self.throttled = 0
+
+    async def try_acquire(self, account_id: int, rate: float) -> float:
+        """Take one send token for the account. Returns 0 on success, else seconds to wait."""
+        if rate <= 0:
+            return 0.0
+        wait = float(await self.script(keys=[f"{RATE_KEY_PREFIX}:{account_id}"], args=[rate, self.burst]))
+        if wait > 0:
+            self.throttled += 1
+        return wait
@@ -0,0 +1,49 @@
+import asyncio
+import os
+import random
+from redis import exceptions as redis_errors
+
+RETRY_MAX_ATTEMPTS = int(os.getenv("RETRY_MAX_ATTEMPTS", "5"))
+# {campaign_id: number of retries scheduled}
+RETRY_COUNTS_KEY = "campaign_retries"
+
+class RetryPolicy:
+    """Exponential backoff: base * factor ** (attempt - 1), capped at max_delay, with +/- jitter."""
+
+    __slots__ = ("base", "factor", "max_delay", "jitter")
+
+    def __init__(self, base: float, factor: float = 2.0, max_delay: float = 600.0, jitter: float = 0.2):
+        self.base = base
+        self.factor = factor
+        self.max_delay = max_delay
+        self.jitter = jitter
+
+    def delay(self, attempt: int) -> float:
+        delay = min(self.max_delay, self.base * self.factor ** (attempt - 1))
+        return delay * random.uniform(1 - self.jitter, 1 + self.jitter)
+
+RETRY_POLICIES = {
+    # Connection resets, proxy failures, DNS
+    "network": RetryPolicy(base=5, max_delay=300),
+    # Requests that did not complete in time (including Telegram's -503 "Timeout")
+    "timeout": RetryPolicy(base=10, max_delay=600),
+    # Telegram internal errors (5xx)
+    "server": RetryPolicy(base=30, max_delay=1800),
+}
+
+def classify_error(exc: BaseException):
+    """Return the name of the retry policy for a transient error, or None if retrying is pointless."""
+    # Imported here so the API can read RETRY_COUNTS_KEY without loading telethon
+    from telethon import errors
+    if isinstance(exc, (asyncio.TimeoutError, errors.TimedOutError)):
+        return "timeout"
+    if isinstance(exc, errors.ServerError):
+        return "server"
+    if isinstance(exc, errors.RPCError):
+        # Every other RPC error is about the request itself (privacy, invalid peer, ...)
+        return None
+    if isinstance(exc, (ConnectionError, OSError, redis_errors.ConnectionError)):
+        return "network"
+    if isinstance(exc, redis_errors.TimeoutError):
+        return "timeout"
+    return None
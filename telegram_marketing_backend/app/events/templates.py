@@ -0,0 +1,96 @@
+import os
+import re
+from collections import OrderedDict
+from sqlalchemy.future import select
+from ..models import MessageTemplate
+
+TEMPLATE_CACHE_SIZE = int(os.getenv("TEMPLATE_CACHE_SIZE", "1000"))
+# Routers publish a template id here whenever a template changes or is deleted
+TEMPLATE_CHANNEL = "template_invalidations"
+
+PLACEHOLDER_RE = re.compile(r"\{([^{}]+)\}")
+
+class CompiledTemplate:
+    """Message template with its {placeholder} positions resolved once.
+
+    The content is split into literal chunks around the placeholders, so
+    rendering is a single join instead of one str.replace per variable.
+    """
+
+    __slots__ = ("template_id", "content", "literals", "keys")
+
+    def __init__(self, template_id: int, content: str):
+        self.template_id = template_id
+        self.content = content
+        self.literals = []
+        self.keys = []
+        position = 0
+        for match in PLACEHOLDER_RE.finditer(content):
+            self.literals.append(content[position:match.start()])
+            self.keys.append(match.group(1))
+            position = match.end()
+        self.literals.append(content[position:])
+
+    @property
+    def placeholders(self) -> set:
+        return set(self.keys)
+
+    def render(self, variables: dict) -> str:
+        if not self.keys:
+            return self.content
+        parts = [self.literals[0]]
+        for key, literal in zip(self.keys, self.literals[1:]):
+            value = variables.get(key)
+            # Only string values are substituted, anything else leaves the placeholder as is
+            parts.append(value if isinstance(value, str) else "{" + key + "}")
+            parts.append(literal)
+        return "".join(parts)
+
+async def load_placeholders(db, template_ids) -> dict:
+    """{template_id: set of placeholder names} for the given templates."""
+    ids = [t for t in template_ids if t is not None]
+    if not ids:
+        return {}
+    result = await db.execute(select(MessageTemplate.id, MessageTemplate.content).where(MessageTemplate.id.in_(ids)))
+    return {template_id: CompiledTemplate(template_id, content or "").placeholders for template_id, content in result.all()}
+
+class TemplateCache:
+    """Bounded LRU of compiled templates, loaded from the database on a miss."""
+
+    def __init__(self, max_size: int = TEMPLATE_CACHE_SIZE):
+        self.max_size = max_size
+        self.templates = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def put(self, template_id: int, content: str) -> CompiledTemplate:
+        compiled = CompiledTemplate(template_id, content)
+        self.templates[template_id] = compiled
+        self.templates.move_to_end(template_id)
+        while len(self.templates) > self.max_size:
+            self.templates.popitem(last=False)
+        return compiled
+
+    async def get(self, template_id: int, db):
+        """Return the compiled template, or None if it does not exist."""
+        compiled = self.templates.get(template_id)
+        if compiled is not None:
+            self.hits += 1
+            self.templates.move_to_end(template_id)
+            return compiled
+
+        self.misses += 1
+        result = await db.execute(select(MessageTemplate.content).where(MessageTemplate.id == template_id))
+        content = result.scalar()
+        if content is None:
+            return None
+        return self.put(template_id, content)
+
+    def invalidate(self, template_id: int):
+        self.templates.pop(template_id, None)
+
+    def clear(self):
+        self.templates.clear()
+
+    def stats(self) -> dict:
+        return {"size": len(self.templates), "hits": self.hits, "misses": self.misses}
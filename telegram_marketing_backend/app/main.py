@@ -2,32 +2,50 @@ from fastapi import FastAPI
 from contextlib import asynccontextmanager
 from fastapi.middleware.cors import CORSMiddleware
 
-from .routers import accounts, lists, messages, campaigns, logs, analytics, ab_test, scheduler, api, scraper, inbox, drip, filters, delay
-from .database import engine
-from .models import Base
-from .scheduler_service import scheduler_loop
+from .routers import accounts, lists, messages, campaigns, logs, analytics, ab_test, scheduler, api, scraper, inbox, drip, filters, delay, workers, suppression
+from .database import engine, create_tables
+from .services.client_pool import client_pool
+from .services.leader import LeaderLease
 import asyncio
+import os
 import sys
 
+# Process role, see app/__main__.py: "api" only serves HTTP, "all" also runs
+# the scheduler and an embedded consumer (the default, for a single process).
+APP_ROLE = os.getenv("APP_ROLE", "all")
+
 if sys.platform == 'win32':
     asyncio.set_event_loop_policy(asyncio.WindowsSelectorEventLoopPolicy())
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):
-    # Startup: Create tables
-    async with engine.begin() as conn:
-        await conn.run_sync(Base.metadata.create_all)
-    
-    # Start scheduler loop in background
-    asyncio.create_task(scheduler_loop())
+    background = []
+    consumer = None
+    if APP_ROLE == "all":
+        # Startup: Create tables
+        await create_tables()
+
+        # Singleton jobs run in the one API process holding their lease, so
+        # uvicorn --workers N or several replicas do not multiply them.
+        # Imported here: the api role never loads the scheduler, consumer or telethon.
+        from .scheduler_service import scheduler_loop
+        scheduler_lease = LeaderLease("scheduler")
+        background.append(asyncio.create_task(scheduler_lease.run(lambda: scheduler_loop(scheduler_lease))))
 
-    # Start event consumer (worker) in background
-    from .events.consumer import EventConsumer
-    consumer = EventConsumer()
-    asyncio.create_task(consumer.start())
+        # Embedded event consumer (worker); dedicated workers are not elected
+        from .events.consumer import EventConsumer
+        consumer = EventConsumer()
+        consumer_lease = LeaderLease("embedded_consumer")
+        background.append(asyncio.create_task(consumer_lease.run(consumer.start)))
     
     yield
     # Shutdown
+    for task in background:
+        task.cancel()
+    await asyncio.gather(*background, return_exceptions=True)
+    if consumer is not None:
+        await consumer.close()
+    await client_pool.close()
     await engine.dispose()
 
 app = FastAPI(title="Telegram Marketing Platform Backend", lifespan=lifespan)
@@ -60,3 +78,5 @@ app.include_router(inbox.router)
 app.include_router(drip.router)
 app.include_router(filters.router, prefix="/filters", tags=["Filters"])
 app.include_router(delay.router, prefix="/delay", tags=["Delay"])
+app.include_router(workers.router, prefix="/workers", tags=["Workers"])
+app.include_router(suppression.router, prefix="/suppression", tags=["Suppression"])
@@ -1,8 +1,5 @@
 from fastapi import APIRouter, HTTPException, Depends
-from telethon.errors import PhoneCodeInvalidError, PhoneCodeExpiredError, SessionPasswordNeededError
 from pydantic import BaseModel
-from telethon import TelegramClient
-from telethon.sessions import StringSession
 from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.future import select
 from typing import List, Optional
@@ -12,6 +9,9 @@ from datetime import datetime
 
 from ..models import Account, WarmupLog
 from ..database import get_db
+from ..services.client_pool import client_pool, ClientUnavailable, CLIENT_CHANNEL
+from ..events.producer import producer
+from ..events.account_selector import PROXY_LATENCY_KEY
 
 router = APIRouter()
 
@@ -61,6 +61,8 @@ async def request_code(request: RequestCodeRequest, db: AsyncSession = Depends(g
     """Initiate Telegram login flow and send code to phone.
     Returns phone_code_hash and temporary session string for later sign-in.
     """
+    from telethon import TelegramClient
+    from telethon.sessions import StringSession
     # Create a temporary client with a new StringSession
     client = TelegramClient(StringSession(), int(request.api_id), request.api_hash)
     try:
@@ -83,6 +85,9 @@ async def sign_in(request: SignInRequest, db: AsyncSession = Depends(get_db)):
     """Complete Telegram sign-in using the code (and password if needed).
     Creates or updates an Account record in the database.
     """
+    from telethon import TelegramClient
+    from telethon.sessions import StringSession
+    from telethon.errors import PhoneCodeInvalidError, PhoneCodeExpiredError, SessionPasswordNeededError
     # Retrieve stored phone_code_hash if not provided explicitly
     phone_code_hash = request.phone_code_hash or auth_states.get(request.phone)
     if not phone_code_hash:
@@ -122,6 +127,10 @@ async def sign_in(request: SignInRequest, db: AsyncSession = Depends(get_db)):
             )
             db.add(new_account)
         await db.commit()
+        if account:
+            # Pooled clients (here and in the workers) still use the old session
+            await client_pool.invalidate(account.id)
+            await producer.notify(CLIENT_CHANNEL, account.id)
         return {"detail": "Account signed in successfully", "session_string": session_str}
     except PhoneCodeInvalidError:
         raise HTTPException(status_code=400, detail="Invalid verification code")
@@ -134,6 +143,11 @@ async def sign_in(request: SignInRequest, db: AsyncSession = Depends(get_db)):
 
 
 
+@router.get("/client-pool/stats")
+async def get_client_pool_stats():
+    """Connection reuse metrics of this process's Telegram client pool."""
+    return client_pool.stats()
+
 @router.get("/", response_model=List[AccountResponse])
 async def get_accounts(db: AsyncSession = Depends(get_db)):
     """List all accounts."""
@@ -150,6 +164,8 @@ async def delete_account(account_id: int, db: AsyncSession = Depends(get_db)):
         raise HTTPException(status_code=404, detail="Account not found")
     await db.delete(account)
     await db.commit()
+    await client_pool.invalidate(account_id)
+    await producer.notify(CLIENT_CHANNEL, account_id)
     return {"detail": "Account deleted"}
 
 @router.post("/{account_id}/check-health")
@@ -165,40 +181,40 @@ async def check_health(account_id: int, db: AsyncSession = Depends(get_db)):
     
     status = "unknown"
     try:
-        client = TelegramClient(StringSession(account.session_string), int(account.api_id), account.api_hash)
-        await client.connect()
-        
-        if not await client.is_user_authorized():
-            status = "banned" # Or unauthorized
-        else:
-            try:
-                # GetStateRequest is a lightweight call to check if user is active
-                await client(GetStateRequest())
-                status = "alive"
-                
-                # Optional: Check for restrictions (Spam Block)
-                # This is harder to check definitively without trying to send a message,
-                # but we can check if the user is restricted.
-                me = await client.get_me()
-                if me.restricted:
-                    status = "restricted"
-                    
-            except FloodWaitError:
-                status = "flood_wait"
-            except UserDeactivatedError:
-                status = "banned"
-            except UserRestrictedError:
-                status = "restricted"
-            except Exception as e:
-                print(f"Health check error for {account.phone_number}: {e}")
-                status = "error"
-                
-        await client.disconnect()
-        
+        client = await client_pool.get(account.id)
+    except ClientUnavailable:
+        client = None
+        status = "banned" # Or unauthorized
     except Exception as e:
         print(f"Connection error during health check: {e}")
+        client = None
         status = "connection_error"
 
+    if client:
+        try:
+            # GetStateRequest is a lightweight call to check if user is active
+            await client(GetStateRequest())
+            status = "alive"
+            
+            # Optional: Check for restrictions (Spam Block)
+            # This is harder to check definitively without trying to send a message,
+            # but we can check if the user is restricted.
+            me = await client.get_me()
+            if me.restricted:
+                status = "restricted"
+                
+        except FloodWaitError:
+            status = "flood_wait"
+        except UserDeactivatedError:
+            status = "banned"
+        except UserRestrictedError:
+            status = "restricted"
+        except Exception as e:
+            print(f"Health check error for {account.phone_number}: {e}")
+            status = "error"
+        finally:
+            await client_pool.release(account.id, client)
+
     # Update DB
     account.health_status = status
     account.last_health_check = datetime.utcnow()
@@ -222,6 +238,8 @@ async def check_proxy(account_id: int, db: AsyncSession = Depends(get_db)):
         return {"status": "invalid_proxy_format", "latency_ms": 0}
 
     import time
+    from telethon import TelegramClient
+    from telethon.sessions import StringSession
     start_time = time.time()
     
     try:
@@ -236,6 +254,9 @@ async def check_proxy(account_id: int, db: AsyncSession = Depends(get_db)):
         # If we reached here, connection via proxy was successful
         latency = (time.time() - start_time) * 1000
         await client.disconnect()
+
+        # Feeds the workers' account selection
+        await producer.redis.hset(PROXY_LATENCY_KEY, account_id, int(latency))
         
         return {"status": "success", "latency_ms": int(latency)}
     except Exception as e:
@@ -254,7 +275,7 @@ async def toggle_warmup(account_id: int, request: WarmupToggleRequest, db: Async
         account.warmup_last_run = None
     
     await db.commit()
-    return {"detail": f"Warm-up {'enabled' if request.enabled else 'disabled'}", "warmup_enabled": account.warmup_enabled}
+    return {"detail": f"Warm-up {'enabled' if request.enabled else 'disabled'}", "warmup_enabled": request.enabled}
 
 @router.get("/{account_id}/warmup-logs")
 async def get_warmup_logs(account_id: int, db: AsyncSession = Depends(get_db)):
@@ -1,4 +1,4 @@
-from fastapi import APIRouter, HTTPException, Depends, BackgroundTasks
+from fastapi import APIRouter, HTTPException, Depends
 from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.future import select
 from pydantic import BaseModel
@@ -6,8 +6,13 @@ from typing import List, Optional
 from datetime import datetime
 from ..models import Campaign, UserList, MessageTemplate, Account, ABTest
 from ..database import get_db
-from ..events.producer import producer
-import json
+from ..events.producer import producer, STREAM_KEY
+from ..events.retry import RETRY_COUNTS_KEY
+from ..events.payloads import campaign_ctx_key
+from ..services.scheduler_timers import wake_scheduler, utc_timestamp
+from ..services.campaign_state import COMPLETED_KEY, inflight_key, parked_key, set_halted, unpark_tasks, drop_parked_tasks
+from ..services.suppression import SUPPRESSION_REASONS, seen_key
+from ..tasks.campaign_runner import request_campaign_fanout, resume_campaign_fanout, fanout_progress, fanout_key, completion
 
 router = APIRouter(
     tags=["campaign"]
@@ -26,20 +31,19 @@ class CampaignStartRequest(BaseModel):
     account_ids: List[int]
     delay: float = 1.0
     scheduled_for: Optional[datetime] = None
+    # Suppression reasons applied at fan-out (None = all); duplicates within the list are always dropped
+    suppression_reasons: Optional[List[str]] = None
 
 @router.post("/start")
 async def start_campaign(request: CampaignStartRequest, db: AsyncSession = Depends(get_db)):
     """Start a new campaign."""
     # 1. Verify resources exist
-    list_res = await db.execute(select(UserList).where(UserList.id == request.list_id))
-    user_list = list_res.scalars().first()
-    if not user_list:
+    # Only the id: the recipients themselves are read by the background fan-out
+    list_res = await db.execute(select(UserList.id).where(UserList.id == request.list_id))
+    if list_res.scalar() is None:
         raise HTTPException(status_code=404, detail="User list not found")
 
     # Verify Template OR A/B Test OR Rotation
-    ab_test_variants = []
-    rotation_sequence = [] # List of template_ids expanded by count
-    
     if request.rotation_steps:
         # Verify all templates in rotation exist
         template_ids = [step.template_id for step in request.rotation_steps]
@@ -48,12 +52,7 @@ async def start_campaign(request: CampaignStartRequest, db: AsyncSession = Depen
         if len(found_templates) != len(set(template_ids)):
              raise HTTPException(status_code=404, detail="One or more templates in rotation not found")
         
-        # Build rotation sequence for easy iteration
-        # e.g. A(2), B(1) -> [A, A, B]
-        for step in request.rotation_steps:
-            rotation_sequence.extend([step.template_id] * step.count)
-            
-        if not rotation_sequence:
+        if sum(max(step.count, 0) for step in request.rotation_steps) == 0:
              raise HTTPException(status_code=400, detail="Rotation steps cannot be empty")
 
     elif request.ab_test_id:
@@ -61,7 +60,6 @@ async def start_campaign(request: CampaignStartRequest, db: AsyncSession = Depen
         ab_test = ab_test_res.scalars().first()
         if not ab_test:
             raise HTTPException(status_code=404, detail="A/B Test not found")
-        ab_test_variants = ab_test.variants # List of {"template_id": X, "weight": Y}
     elif request.template_id:
         template_res = await db.execute(select(MessageTemplate).where(MessageTemplate.id == request.template_id))
         template = template_res.scalars().first()
@@ -70,6 +68,9 @@ async def start_campaign(request: CampaignStartRequest, db: AsyncSession = Depen
     else:
         raise HTTPException(status_code=400, detail="Must provide template_id, ab_test_id, or rotation_steps")
 
+    if request.suppression_reasons and not set(request.suppression_reasons) <= set(SUPPRESSION_REASONS):
+        raise HTTPException(status_code=400, detail=f"Unknown suppression reason. Use any of: {', '.join(SUPPRESSION_REASONS)}")
+
     # Verify accounts
     accounts_res = await db.execute(select(Account).where(Account.id.in_(request.account_ids)))
     accounts = accounts_res.scalars().all()
@@ -87,7 +88,8 @@ async def start_campaign(request: CampaignStartRequest, db: AsyncSession = Depen
         "ab_test_id": request.ab_test_id,
         "rotation_steps": [step.dict() for step in request.rotation_steps] if request.rotation_steps else None,
         "account_ids": request.account_ids,
-        "delay": request.delay
+        "delay": request.delay,
+        "suppression_reasons": request.suppression_reasons
     }
     
     new_campaign = Campaign(
@@ -100,50 +102,11 @@ async def start_campaign(request: CampaignStartRequest, db: AsyncSession = Depen
     await db.commit()
     await db.refresh(new_campaign)
 
-    # 3. Publish tasks to Redis (ONLY IF NOT SCHEDULED)
+    # 3. The scheduler publishes the tasks in the background (ONLY IF NOT SCHEDULED)
     if status == "running":
-        users = user_list.users
-        if not isinstance(users, list):
-            users = []
-
-        import random
-        
-        rotation_index = 0
-        
-        for i, user in enumerate(users):
-            # Determine template for this user
-            selected_template_id = None
-            
-            if request.rotation_steps:
-                # Rotation logic
-                selected_template_id = rotation_sequence[rotation_index % len(rotation_sequence)]
-                rotation_index += 1
-            elif request.ab_test_id and ab_test_variants:
-                # Simple weighted random selection
-                # variants: [{"template_id": 1, "weight": 50}, ...]
-                total_weight = sum(v.get("weight", 0) for v in ab_test_variants)
-                r = random.uniform(0, total_weight)
-                upto = 0
-                for v in ab_test_variants:
-                    if upto + v.get("weight", 0) >= r:
-                        selected_template_id = v.get("template_id")
-                        break
-                    upto += v.get("weight", 0)
-            else:
-                selected_template_id = request.template_id
-            
-            task_data = {
-                "campaign_id": new_campaign.id,
-                "recipient": user.get("phone") or user.get("username"),
-                "template_id": selected_template_id,
-                "account_ids": request.account_ids,
-                "delay": request.delay,
-                "variables": user,
-                "ab_test_id": request.ab_test_id # Pass this to track results later
-            }
-            
-            if task_data["recipient"]:
-                 await producer.publish("send_message", task_data)
+        await request_campaign_fanout(new_campaign.id)
+    else:
+        await wake_scheduler(producer.redis, "scheduled_campaigns", utc_timestamp(new_campaign.scheduled_for))
 
     return {"status": status, "campaign_id": new_campaign.id}
 
@@ -155,10 +118,51 @@ async def stop_campaign(campaign_id: int, db: AsyncSession = Depends(get_db)):
     if not campaign:
         raise HTTPException(status_code=404, detail="Campaign not found")
     
+    was_scheduled = campaign.status == "scheduled"
     campaign.status = "stopped"
     await db.commit()
+    if not was_scheduled:
+        # Workers drop whatever is still queued for it, including tasks set aside during a pause
+        await set_halted(producer.redis, campaign_id, "stopped")
+        await drop_parked_tasks(producer.redis, completion, campaign_id)
     return {"status": "stopped", "campaign_id": campaign_id}
 
+@router.post("/pause/{campaign_id}")
+async def pause_campaign(campaign_id: int, db: AsyncSession = Depends(get_db)):
+    """Pause a running campaign. Dispatch stops at the saved cursor; tasks already in flight still finish."""
+    result = await db.execute(select(Campaign).where(Campaign.id == campaign_id))
+    campaign = result.scalars().first()
+    if not campaign:
+        raise HTTPException(status_code=404, detail="Campaign not found")
+    if campaign.status != "running":
+        raise HTTPException(status_code=400, detail=f"Only running campaigns can be paused (status: {campaign.status})")
+
+    campaign.status = "paused"
+    await db.commit()
+    # Workers set aside whatever is still queued for it
+    await set_halted(producer.redis, campaign_id, "paused")
+    return {"status": "paused", "campaign_id": campaign_id, "fanout": await fanout_progress(campaign_id)}
+
+@router.post("/resume/{campaign_id}")
+async def resume_campaign(campaign_id: int, db: AsyncSession = Depends(get_db)):
+    """Resume a paused campaign from where dispatch left off."""
+    result = await db.execute(select(Campaign).where(Campaign.id == campaign_id))
+    campaign = result.scalars().first()
+    if not campaign:
+        raise HTTPException(status_code=404, detail="Campaign not found")
+    if campaign.status != "paused":
+        raise HTTPException(status_code=400, detail=f"Only paused campaigns can be resumed (status: {campaign.status})")
+
+    campaign.status = "running"
+    await db.commit()
+    await set_halted(producer.redis, campaign_id, None)
+    await unpark_tasks(producer.redis, STREAM_KEY, campaign_id)
+    await resume_campaign_fanout(campaign_id)
+    if await producer.redis.sismember(COMPLETED_KEY, campaign_id):
+        # Every task was processed while paused; the completion check skipped it until now
+        await wake_scheduler(producer.redis, "completion")
+    return {"status": "running", "campaign_id": campaign_id, "fanout": await fanout_progress(campaign_id)}
+
 @router.get("/status/{campaign_id}")
 async def campaign_status(campaign_id: int, db: AsyncSession = Depends(get_db)):
     """Get current status of a campaign."""
@@ -166,7 +170,15 @@ async def campaign_status(campaign_id: int, db: AsyncSession = Depends(get_db)):
     campaign = result.scalars().first()
     if not campaign:
         raise HTTPException(status_code=404, detail="Campaign not found")
-    return {"campaign_id": campaign.id, "status": campaign.status, "name": campaign.name}
+    retries = await producer.redis.hget(RETRY_COUNTS_KEY, campaign_id)
+    return {
+        "campaign_id": campaign.id,
+        "status": campaign.status,
+        "name": campaign.name,
+        "retries": int(retries or 0),
+        # {total, enqueued, cursor, rate, in_flight, done} while tasks are being published
+        "fanout": await fanout_progress(campaign_id)
+    }
 
 @router.get("/")
 async def list_campaigns(db: AsyncSession = Depends(get_db)):
@@ -187,6 +199,12 @@ async def delete_campaign(campaign_id: int, db: AsyncSession = Depends(get_db)):
     from sqlalchemy import delete
     from ..models import SendLog
     await db.execute(delete(SendLog).where(SendLog.campaign_id == campaign_id))
+    await producer.redis.hdel(RETRY_COUNTS_KEY, campaign_id)
+    await producer.redis.delete(
+        campaign_ctx_key(campaign_id), fanout_key(campaign_id), inflight_key(campaign_id), seen_key(campaign_id), parked_key(campaign_id)
+    )
+    # Without its context, workers drop whatever is still queued for it
+    await set_halted(producer.redis, campaign_id, None)
     
     await db.delete(campaign)
     await db.commit()
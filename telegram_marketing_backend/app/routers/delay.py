@@ -1,16 +1,11 @@
-from fastapi import APIRouter, HTTPException
-import redis.asyncio as redis
-import json
-import os
+from fastapi import APIRouter
 from pydantic import BaseModel
+from ..services.runtime_settings import DELAY_SETTINGS_KEY, load_settings, save_settings
 
 router = APIRouter(
     tags=["delay"]
 )
 
-REDIS_URL = os.getenv("REDIS_URL", "redis://localhost:6379")
-DELAY_SETTINGS_KEY = "delay_settings"
-
 class DelaySettings(BaseModel):
     type: str = "fixed"  # "fixed" or "random"
     value: float = 1.0   # Used for fixed
@@ -20,18 +15,14 @@ class DelaySettings(BaseModel):
 @router.get("/")
 async def get_delay_settings():
     """Return current delay configuration."""
-    r = redis.from_url(REDIS_URL)
-    data = await r.get(DELAY_SETTINGS_KEY)
-    await r.close()
+    data = await load_settings(DELAY_SETTINGS_KEY)
     
     if data:
-        return json.loads(data)
+        return data
     return DelaySettings().dict()
 
 @router.post("/")
 async def set_delay_settings(settings: DelaySettings):
     """Update delay configuration."""
-    r = redis.from_url(REDIS_URL)
-    await r.set(DELAY_SETTINGS_KEY, json.dumps(settings.dict()))
-    await r.close()
+    await save_settings(DELAY_SETTINGS_KEY, settings.dict())
     return {"status": "updated", "settings": settings}
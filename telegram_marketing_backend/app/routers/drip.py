@@ -7,6 +7,8 @@ from sqlalchemy.orm import selectinload
 from datetime import datetime, timedelta
 from ..models import DripCampaign, DripStep, DripProgress, UserList, MessageTemplate
 from ..database import get_db
+from ..events.producer import producer
+from ..services.scheduler_timers import wake_scheduler
 
 router = APIRouter(
     prefix="/drip",
@@ -138,6 +140,8 @@ async def start_drip_campaign(id: int, db: AsyncSession = Depends(get_db)):
     
     campaign.status = "active"
     await db.commit()
+    # The scheduler picks up the next due step from the database
+    await wake_scheduler(producer.redis, "drips")
     
     return {"status": "started", "enrolled_users": count}
 
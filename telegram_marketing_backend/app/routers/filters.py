@@ -1,16 +1,11 @@
-from fastapi import APIRouter, HTTPException
-import redis.asyncio as redis
-import json
-import os
+from fastapi import APIRouter
 from pydantic import BaseModel
+from ..services.runtime_settings import FILTERS_KEY, load_settings, save_settings
 
 router = APIRouter(
     tags=["filters"]
 )
 
-REDIS_URL = os.getenv("REDIS_URL", "redis://localhost:6379")
-FILTERS_KEY = "filter_settings"
-
 class FilterSettings(BaseModel):
     skip_no_photo: bool = False
     skip_bots: bool = True
@@ -18,18 +13,14 @@ class FilterSettings(BaseModel):
 @router.get("/")
 async def get_filters():
     """Return current filter configuration."""
-    r = redis.from_url(REDIS_URL)
-    data = await r.get(FILTERS_KEY)
-    await r.close()
+    data = await load_settings(FILTERS_KEY)
     
     if data:
-        return json.loads(data)
+        return data
     return FilterSettings().dict()
 
 @router.post("/")
 async def update_filters(settings: FilterSettings):
     """Update filter configuration."""
-    r = redis.from_url(REDIS_URL)
-    await r.set(FILTERS_KEY, json.dumps(settings.dict()))
-    await r.close()
+    await save_settings(FILTERS_KEY, settings.dict())
     return {"status": "updated", "filters": settings}
@@ -6,6 +6,8 @@ from pydantic import BaseModel
 from typing import Optional
 from ..models import MessageTemplate
 from ..database import get_db
+from ..events.producer import producer
+from ..events.templates import TEMPLATE_CHANNEL
 
 router = APIRouter(
     tags=["messages"]
@@ -68,6 +70,7 @@ async def update_template(template_id: int, update_data: MessageTemplateUpdate,
         
     await db.commit()
     await db.refresh(template)
+    await producer.notify(TEMPLATE_CHANNEL, template_id)
     return template
 
 @router.delete("/{template_id}")
@@ -88,4 +91,5 @@ async def delete_template(template_id: int, db: AsyncSession = Depends(get_db)):
             detail="Cannot delete template because it is being used in a campaign or A/B test."
         )
     
+    await producer.notify(TEMPLATE_CHANNEL, template_id)
     return {"status": "deleted", "template_id": template_id}
@@ -7,6 +7,9 @@ from sqlalchemy.future import select
 from fastapi import Depends
 from ..database import get_db
 from ..models import Campaign
+from ..events.producer import producer
+from ..services.scheduler_timers import SCHEDULER_JOBS_KEY
+import json
 
 @router.get("/")
 async def list_schedules(db: AsyncSession = Depends(get_db)):
@@ -16,6 +19,13 @@ async def list_schedules(db: AsyncSession = Depends(get_db)):
     )
     return result.scalars().all()
 
+@router.get("/jobs")
+async def list_scheduler_jobs():
+    """Return the supervision settings and last-run stats of each scheduler job."""
+    data = await producer.redis.hgetall(SCHEDULER_JOBS_KEY)
+    jobs = [json.loads(raw) for raw in data.values()]
+    return {"jobs": sorted(jobs, key=lambda job: job["name"])}
+
 @router.post("/")
 async def create_schedule(schedule_data: dict):
     """Schedule a campaign.
@@ -34,6 +44,7 @@ async def delete_schedule(campaign_id: int, db: AsyncSession = Depends(get_db)):
     if campaign.status != "scheduled":
         raise HTTPException(status_code=400, detail="Campaign is not scheduled")
 
+    # Never fanned out, so no worker has anything of it to drop
     campaign.status = "stopped"
     await db.commit()
     return {"status": "cancelled", "campaign_id": campaign_id}
@@ -7,8 +7,7 @@ import time
 from ..database import get_db
 from ..models import Account, ScraperLog
 from ..services.scraper import scrape_group_members
-from telethon import TelegramClient
-from telethon.sessions import StringSession
+from ..services.client_pool import client_pool, ClientUnavailable
 import logging
 
 router = APIRouter(
@@ -36,18 +35,18 @@ async def scrape_group(request: ScrapeRequest, db: AsyncSession = Depends(get_db
         raise HTTPException(status_code=400, detail="Account not logged in")
         
     try:
-        client = TelegramClient(StringSession(account.session_string), int(account.api_id), account.api_hash)
-        await client.connect()
-        
-        if not await client.is_user_authorized():
+        try:
+            client = await client_pool.get(account.id)
+        except ClientUnavailable:
             raise HTTPException(status_code=401, detail="Session expired")
             
-        start_time = time.time()
-        members = await scrape_group_members(client, request.group_link, request.limit, request.only_usernames, request.active_only)
-        end_time = time.time()
-        duration = end_time - start_time
-        
-        await client.disconnect()
+        try:
+            start_time = time.time()
+            members = await scrape_group_members(client, request.group_link, request.limit, request.only_usernames, request.active_only)
+            end_time = time.time()
+            duration = end_time - start_time
+        finally:
+            await client_pool.release(account.id, client)
 
         # Log success
         log_entry = ScraperLog(
@@ -98,23 +97,22 @@ async def get_dialogs(account_id: int, db: AsyncSession = Depends(get_db)):
         raise HTTPException(status_code=400, detail="Account not logged in")
         
     try:
-        client = TelegramClient(StringSession(account.session_string), int(account.api_id), account.api_hash)
-        await client.connect()
-        
-        if not await client.is_user_authorized():
-            await client.disconnect()
+        try:
+            client = await client_pool.get(account.id)
+        except ClientUnavailable:
             raise HTTPException(status_code=401, detail="Session expired")
             
-        dialogs = []
-        async for dialog in client.iter_dialogs():
-            if dialog.is_group or dialog.is_channel:
-                dialogs.append({
-                    "id": str(dialog.id), # Return as string to avoid JS precision issues
-                    "title": dialog.title,
-                    "type": "channel" if dialog.is_channel else "group"
-                })
-                
-        await client.disconnect()
+        try:
+            dialogs = []
+            async for dialog in client.iter_dialogs():
+                if dialog.is_group or dialog.is_channel:
+                    dialogs.append({
+                        "id": str(dialog.id), # Return as string to avoid JS precision issues
+                        "title": dialog.title,
+                        "type": "channel" if dialog.is_channel else "group"
+                    })
+        finally:
+            await client_pool.release(account.id, client)
         return dialogs
         
     except Exception as e:
@@ -0,0 +1,41 @@
+from fastapi import APIRouter, HTTPException, BackgroundTasks
+from pydantic import BaseModel
+from typing import List
+from ..database import AsyncSessionLocal
+from ..services.suppression import suppression_index, SUPPRESSION_REASONS
+
+router = APIRouter(
+    tags=["suppression"]
+)
+
+class RecipientsRequest(BaseModel):
+    recipients: List[str]
+
+def check_reason(reason: str):
+    if reason not in SUPPRESSION_REASONS:
+        raise HTTPException(status_code=400, detail=f"Unknown suppression reason. Use one of: {', '.join(SUPPRESSION_REASONS)}")
+
+@router.get("/")
+async def get_suppression_counts():
+    """Number of suppressed recipients per reason."""
+    return await suppression_index.counts()
+
+@router.post("/rebuild")
+async def rebuild_suppression(background_tasks: BackgroundTasks):
+    """Recompute the "messaged" and "replied" sets from the send logs and drip progress."""
+    background_tasks.add_task(suppression_index.rebuild, AsyncSessionLocal)
+    return {"status": "rebuilding"}
+
+@router.post("/{reason}")
+async def add_suppressed(reason: str, request: RecipientsRequest):
+    """Suppress recipients (e.g. opt-outs) for all future campaigns."""
+    check_reason(reason)
+    added = await suppression_index.add(reason, request.recipients)
+    return {"status": "added", "reason": reason, "added": added}
+
+@router.post("/{reason}/remove")
+async def remove_suppressed(reason: str, request: RecipientsRequest):
+    """Allow previously suppressed recipients to be messaged again."""
+    check_reason(reason)
+    removed = await suppression_index.remove(reason, request.recipients)
+    return {"status": "removed", "reason": reason, "removed": removed}
@@ -0,0 +1,12 @@
+from fastapi import APIRouter
+from ..events.producer import producer
+from ..services.worker_stats import live_worker_stats
+
+router = APIRouter(
+    tags=["workers"]
+)
+
+@router.get("/stats")
+async def get_worker_stats():
+    """Return the counters last reported by each live worker."""
+    return {"workers": await live_worker_stats(producer.redis)}
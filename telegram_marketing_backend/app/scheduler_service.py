@@ -1,58 +1,134 @@
 import asyncio
+import os
+import time
 from datetime import datetime
 from sqlalchemy.future import select
 from sqlalchemy.ext.asyncio import AsyncSession
-from .models import Campaign, UserList, MessageTemplate, ABTest, Account, SendLog
-from .database import AsyncSessionLocal
+from .models import Campaign, UserList, SendLog, DripCampaign, DripProgress
+from .database import AsyncSessionLocal, engine, create_tables
 from .events.producer import producer
 import json
 import logging
-from .tasks.campaign_runner import run_pending_campaigns
+from .tasks.campaign_runner import run_pending_campaigns, start_campaign_fanout, fanout_progress, fanout_lock_key, completion
+from .services.campaign_state import COMPLETED_KEY, fanout_key, set_halted, load_halted, drop_parked_tasks
+from .services.client_pool import client_pool
+from .services.leader import LeaderLease
+from .services.scheduler_timers import TimerHeap, SCHEDULER_CHANNEL, SCHEDULER_JOBS_KEY, parse_wakeup, utc_timestamp
 from .tasks.warmup import run_warmup_cycle
 from .tasks.drip_processor import process_drip_campaigns
 from sqlalchemy import func
 
 logger = logging.getLogger(__name__)
 
+# Completion normally follows the workers' counters; the send_logs recount is a safety net
+COMPLETION_RECONCILE_INTERVAL = float(os.getenv("COMPLETION_RECONCILE_INTERVAL", "3600"))
+# How often stopped campaigns whose tasks have all drained are forgotten by the workers
+HALTED_PRUNE_INTERVAL = float(os.getenv("HALTED_PRUNE_INTERVAL", "600"))
+# Fan-outs interrupted in another process are resumed after this long at the latest
+FANOUT_RECOVERY_INTERVAL = float(os.getenv("FANOUT_RECOVERY_INTERVAL", "300"))
+WARMUP_INTERVAL = float(os.getenv("WARMUP_INTERVAL", "60"))
+WARMUP_TIMEOUT = float(os.getenv("WARMUP_TIMEOUT", "3600"))
+# A failed or timed out job is tried again after this many seconds
+SCHEDULER_RETRY_DELAY = float(os.getenv("SCHEDULER_RETRY_DELAY", "60"))
+# Least time between two drip runs, even when steps are still due
+DRIP_MIN_INTERVAL = float(os.getenv("DRIP_MIN_INTERVAL", "1"))
+
 async def check_running_campaigns_completion():
-    """Check if running campaigns have finished sending all messages."""
-    # logger.info("Checking for completed campaigns...") # Too verbose for every minute
+    """Mark campaigns completed once their workers processed every published task.
+
+    Workers count processed tasks in the campaign's fan-out record and flag
+    the campaign in COMPLETED_KEY when the count reaches the number of tasks
+    published, so this only looks at flagged campaigns.
+    """
+    campaign_ids = [int(c) for c in await producer.redis.smembers(COMPLETED_KEY)]
+    if not campaign_ids:
+        return
     async with AsyncSessionLocal() as db:
-        # Get running campaigns
-        result = await db.execute(select(Campaign).where(Campaign.status == "running"))
+        result = await db.execute(select(Campaign).where(Campaign.id.in_(campaign_ids)))
         campaigns = result.scalars().all()
-
+        settled = set(campaign_ids)
         for campaign in campaigns:
-            # Get total users
-            if not campaign.config:
-                continue
-                
-            list_id = campaign.config.get("list_id")
-            if not list_id:
-                continue
-            
-            list_res = await db.execute(select(UserList).where(UserList.id == list_id))
-            user_list = list_res.scalars().first()
-            if not user_list:
-                continue
-            
-            total_users = len(user_list.users) if isinstance(user_list.users, list) else 0
-            
-            if total_users == 0:
+            if campaign.status == "running":
+                logger.info(f"Campaign {campaign.id} completed")
                 campaign.status = "completed"
-                await db.commit()
-                continue
+            elif campaign.status == "paused":
+                # Checked again once resumed
+                settled.discard(campaign.id)
+        await db.commit()
+    if settled:
+        await producer.redis.srem(COMPLETED_KEY, *settled)
+        # Every task was processed, so no worker needs to hold any back
+        for campaign_id in settled:
+            await set_halted(producer.redis, campaign_id, None)
 
-            # Get processed count
-            log_count_res = await db.execute(
-                select(func.count(SendLog.id)).where(SendLog.campaign_id == campaign.id)
-            )
-            processed_count = log_count_res.scalar()
+async def prune_halted_campaigns():
+    """Remove stopped campaigns from HALTED_KEY once none of their tasks can still be queued.
+
+    That is when no feeder is publishing and the workers processed (or
+    dropped) every task that was published. Campaigns published before
+    fan-out tracking existed keep their entry.
+    """
+    stopped = [c for c, state in (await load_halted(producer.redis)).items() if state == "stopped"]
+    if not stopped:
+        return
+    for campaign_id in stopped:
+        # Set aside by a worker that had not seen the stop yet
+        await drop_parked_tasks(producer.redis, completion, campaign_id)
+    pipe = producer.redis.pipeline(transaction=False)
+    for campaign_id in stopped:
+        pipe.hmget(fanout_key(campaign_id), "processed", "enqueued")
+        pipe.exists(fanout_lock_key(campaign_id))
+    results = await pipe.execute()
+    for campaign_id, (processed, enqueued), locked in zip(stopped, results[::2], results[1::2]):
+        if locked or enqueued is None:
+            continue
+        if int(processed or 0) >= int(enqueued):
+            await set_halted(producer.redis, campaign_id, None)
+
+async def reconcile_campaign_completion():
+    """Compare running campaigns with their send logs and complete the ones the counters missed.
 
-            if processed_count >= total_users:
-                logger.info(f"Campaign {campaign.id} completed ({processed_count}/{total_users})")
+    Covers campaigns published before fan-out tracking existed and counters
+    that fell behind the logs (e.g. a worker died between the two). One
+    grouped COUNT over the running campaigns, so it runs rarely.
+    """
+    async with AsyncSessionLocal() as db:
+        result = await db.execute(select(Campaign).where(Campaign.status == "running"))
+        campaigns = result.scalars().all()
+        if not campaigns:
+            return
+
+        counts_res = await db.execute(
+            select(SendLog.campaign_id, func.count(SendLog.id))
+            .where(SendLog.campaign_id.in_([c.id for c in campaigns]))
+            .group_by(SendLog.campaign_id)
+        )
+        logged_counts = dict(counts_res.all())
+
+        for campaign in campaigns:
+            logged = logged_counts.get(campaign.id, 0)
+            progress = await fanout_progress(campaign.id)
+            if progress is not None:
+                if not progress["done"]:
+                    continue
+                total = progress["enqueued"]
+                if progress["processed"] < logged:
+                    await producer.redis.hset(fanout_key(campaign.id), "processed", logged)
+            else:
+                # Published before fan-out tracking: one log per list row
+                list_id = (campaign.config or {}).get("list_id")
+                if not list_id:
+                    continue
+                list_res = await db.execute(select(UserList).where(UserList.id == list_id))
+                user_list = list_res.scalars().first()
+                if not user_list:
+                    continue
+                total = len(user_list.users) if isinstance(user_list.users, list) else 0
+
+            if logged >= total:
+                logger.info(f"Campaign {campaign.id} completed on reconciliation ({logged}/{total})")
                 campaign.status = "completed"
-                await db.commit()
+        await db.commit()
 
 async def check_scheduled_campaigns():
     """Check for scheduled campaigns that need to be started."""
@@ -79,117 +155,247 @@ async def start_scheduled_campaign(campaign: Campaign, db: AsyncSession):
         campaign.status = "running"
         await db.commit()
         
-        # Load config
-        config = campaign.config
-        list_id = config.get("list_id")
-        template_id = config.get("template_id")
-        ab_test_id = config.get("ab_test_id")
-        account_ids = config.get("account_ids", [])
-        delay = config.get("delay", 1.0)
-        
-        # Fetch list
-        list_res = await db.execute(select(UserList).where(UserList.id == list_id))
-        user_list = list_res.scalars().first()
-        if not user_list:
-            logger.error(f"User list {list_id} not found for campaign {campaign.id}")
-            campaign.status = "failed" # Or stopped
-            await db.commit()
-            return
-
-        # Fetch AB Test variants if applicable
-        ab_test_variants = []
-        if ab_test_id:
-            ab_test_res = await db.execute(select(ABTest).where(ABTest.id == ab_test_id))
-            ab_test = ab_test_res.scalars().first()
-            if ab_test:
-                ab_test_variants = ab_test.variants
-
-        # Rotation Config
-        rotation_steps = config.get("rotation_steps", [])
-        auto_rotation_config = config.get("auto_rotation_config", {})
-
-        # Publish tasks
-        users = user_list.users
-        if not isinstance(users, list):
-            users = []
-
-        import random
-        
-        # Prepare rotation sequence if needed
-        rotation_sequence = []
-        if rotation_steps:
-            for step in rotation_steps:
-                t_id = step.get("template_id")
-                count = step.get("count", 1)
-                if t_id:
-                    rotation_sequence.extend([t_id] * count)
-        elif auto_rotation_config:
-            t_ids = auto_rotation_config.get("template_ids", [])
-            rotate_every = auto_rotation_config.get("rotate_every", 1)
-            if t_ids:
-                # Create a sequence that we can cycle through
-                # Actually, for auto-rotation we can just use modulo math
-                pass
-
-        for i, user in enumerate(users):
-            selected_template_id = template_id
-            
-            # 1. A/B Test Logic
-            if ab_test_id and ab_test_variants:
-                total_weight = sum(v.get("weight", 0) for v in ab_test_variants)
-                r = random.uniform(0, total_weight)
-                upto = 0
-                for v in ab_test_variants:
-                    if upto + v.get("weight", 0) >= r:
-                        selected_template_id = v.get("template_id")
-                        break
-                    upto += v.get("weight", 0)
-            
-            # 2. Rotation Logic
-            elif rotation_steps and rotation_sequence:
-                # Use modulo to cycle through the sequence
-                selected_template_id = rotation_sequence[i % len(rotation_sequence)]
-            
-            # 3. Auto Rotation Logic
-            elif auto_rotation_config:
-                t_ids = auto_rotation_config.get("template_ids", [])
-                rotate_every = auto_rotation_config.get("rotate_every", 1)
-                if t_ids:
-                    # Index in t_ids changes every 'rotate_every' users
-                    group_index = i // rotate_every
-                    selected_template_id = t_ids[group_index % len(t_ids)]
-
-            task_data = {
-                "campaign_id": campaign.id,
-                "recipient": user.get("phone") or user.get("username"),
-                "template_id": selected_template_id,
-                "account_ids": account_ids,
-                "delay": delay,
-                "variables": user,
-                "ab_test_id": ab_test_id
-            }
-            
-            if task_data["recipient"]:
-                 await producer.publish("send_message", task_data)
-                 
-        logger.info(f"Campaign {campaign.id} started successfully with {len(users)} tasks.")
+        # Tasks are published in the background, resumable from a saved cursor
+        await start_campaign_fanout(campaign.id)
+        logger.info(f"Campaign {campaign.id} started, fan-out running in the background")
         
     except Exception as e:
         logger.error(f"Failed to start scheduled campaign {campaign.id}: {e}")
         campaign.status = "failed"
         await db.commit()
 
-async def scheduler_loop():
-    logger.info("Scheduler started")
-    while True:
+async def next_scheduled_time():
+    """Unix time the next scheduled campaign is due, or None."""
+    async with AsyncSessionLocal() as db:
+        result = await db.execute(select(func.min(Campaign.scheduled_for)).where(Campaign.status == "scheduled"))
+        value = result.scalar()
+    return utc_timestamp(value) if value else None
+
+async def next_drip_time():
+    """Unix time the next pending drip step of an active drip campaign is due, or None."""
+    async with AsyncSessionLocal() as db:
+        result = await db.execute(
+            select(func.min(DripProgress.next_execution_time))
+            .join(DripCampaign, DripProgress.drip_campaign_id == DripCampaign.id)
+            .where(DripProgress.status == "pending", DripCampaign.status == "active")
+        )
+        value = result.scalar()
+    return utc_timestamp(value) if value else None
+
+class Job:
+    """A scheduler job and how it is supervised.
+
+    run returns the unix time the job is due next, or None. interval caps
+    the wait until the next run (None: only when due or woken up). A run
+    longer than timeout is cancelled. overlap decides what happens when the
+    job comes due while it is still running: "queue" runs it again right
+    after, "skip" drops that run.
+    """
+
+    __slots__ = ("name", "run", "interval", "timeout", "overlap")
+
+    def __init__(self, name: str, run, interval: float = None, timeout: float = 300, overlap: str = "skip"):
+        self.name = name
+        self.run = run
+        self.interval = interval
+        self.timeout = timeout
+        self.overlap = overlap
+
+class JobStats:
+    __slots__ = ("runs", "failures", "timeouts", "skipped", "last_started", "last_finished", "last_duration", "last_status", "last_error")
+
+    def __init__(self):
+        self.runs = 0
+        self.failures = 0
+        self.timeouts = 0
+        self.skipped = 0
+        self.last_started = None
+        self.last_finished = None
+        self.last_duration = None
+        self.last_status = None
+        self.last_error = None
+
+    def to_dict(self) -> dict:
+        return {name: getattr(self, name) for name in self.__slots__}
+
+class Scheduler:
+    """Runs each job when it is due instead of polling everything every minute.
+
+    Due times are kept in a TimerHeap: scheduled campaigns and drip steps
+    from the database, completion when a worker flags a campaign, and the
+    periodic jobs on their interval. The loop sleeps until the earliest due
+    time or until a wakeup arrives on SCHEDULER_CHANNEL. Every job runs in
+    its own task under its own timeout, so a slow job (a warmup cycle
+    sleeps between accounts) never delays another. Per-job stats are
+    published to SCHEDULER_JOBS_KEY after each run.
+    """
+
+    def __init__(self, lease=None):
+        self.lease = lease # LeaderLease when elected among several processes
+        self.timers = TimerHeap()
+        self.wakeup = asyncio.Event()
+        self.running = {} # {job: asyncio.Task}
+        self.rerun = set() # "queue" jobs that came due again while running
+        self.jobs = {job.name: job for job in (
+            Job("scheduled_campaigns", self.run_scheduled_campaigns, timeout=120, overlap="queue"),
+            Job("drips", self.run_drips, timeout=300, overlap="queue"),
+            Job("completion", self.run_completion, timeout=60, overlap="queue"),
+            Job("reconcile", reconcile_campaign_completion, interval=COMPLETION_RECONCILE_INTERVAL, timeout=600),
+            Job("halted", prune_halted_campaigns, interval=HALTED_PRUNE_INTERVAL, timeout=60),
+            # Woken up by the API when a campaign is started or resumed
+            Job("pending_campaigns", run_pending_campaigns, interval=FANOUT_RECOVERY_INTERVAL, timeout=120, overlap="queue"),
+            # Sleeps between accounts, so a cycle may take a while
+            Job("warmup", run_warmup_cycle, interval=WARMUP_INTERVAL, timeout=WARMUP_TIMEOUT),
+        )}
+        self.stats = {name: JobStats() for name in self.jobs}
+
+    async def run_scheduled_campaigns(self):
+        await check_scheduled_campaigns()
+        return await next_scheduled_time()
+
+    async def run_drips(self):
+        await process_drip_campaigns()
+        due_at = await next_drip_time()
+        if due_at is None:
+            return None
+        # Steps left due (a batch over the limit, a row that keeps failing) wait a little
+        return max(due_at, time.time() + DRIP_MIN_INTERVAL)
+
+    async def run_completion(self):
+        # Woken up by the workers when a campaign is flagged
+        await check_running_campaigns_completion()
+        return None
+
+    def schedule(self, name: str, due_at: float):
+        if name not in self.jobs:
+            logger.warning(f"Ignoring wakeup for unknown scheduler job {name}")
+            return
+        self.timers.push(name, due_at)
+        self.wakeup.set()
+
+    def start_job(self, name: str):
+        if name in self.running:
+            if self.jobs[name].overlap == "queue":
+                self.rerun.add(name)
+            else:
+                self.stats[name].skipped += 1
+            return
+        self.running[name] = asyncio.create_task(self.run_job(name))
+
+    async def run_job(self, name: str):
+        job = self.jobs[name]
+        stats = self.stats[name]
+        if self.lease is not None and not await self.lease.check_fence():
+            # A newer leader was elected; this instance is about to be stopped
+            self.running.pop(name, None)
+            stats.skipped += 1
+            logger.warning(f"Not running scheduler job {name}: no longer the leader")
+            return
+        stats.runs += 1
+        stats.last_started = time.time()
+        await self.publish_stats(name)
+        due_at = None
         try:
-            await run_pending_campaigns()
-            await check_scheduled_campaigns()
-            await check_running_campaigns_completion()
-            await process_drip_campaigns()
-            # Run warmup cycle (it handles its own checks and sleeps)
-            await run_warmup_cycle()
+            due_at = await asyncio.wait_for(job.run(), job.timeout)
+            stats.last_status = "ok"
+            stats.last_error = None
+        except asyncio.TimeoutError:
+            stats.timeouts += 1
+            stats.last_status = "timeout"
+            stats.last_error = f"Cancelled after {job.timeout}s"
+            logger.error(f"Scheduler job {name} timed out after {job.timeout}s")
+            due_at = time.time() + SCHEDULER_RETRY_DELAY
         except Exception as e:
-            logger.error(f"Scheduler error: {e}")
-        
-        await asyncio.sleep(60)  # Check every minute
+            stats.failures += 1
+            stats.last_status = "failed"
+            stats.last_error = str(e)
+            logger.error(f"Scheduler job {name} failed: {e}")
+            due_at = time.time() + SCHEDULER_RETRY_DELAY
+        finally:
+            self.running.pop(name, None)
+            stats.last_finished = time.time()
+            stats.last_duration = round(stats.last_finished - stats.last_started, 3)
+
+        if job.interval is not None:
+            due_at = min(due_at or float("inf"), time.time() + job.interval)
+        if name in self.rerun:
+            self.rerun.discard(name)
+            due_at = time.time()
+        if due_at is not None:
+            self.schedule(name, due_at)
+        await self.publish_stats(name)
+
+    async def publish_stats(self, name: str):
+        data = self.stats[name].to_dict()
+        data.update({
+            "name": name,
+            "interval": self.jobs[name].interval,
+            "timeout": self.jobs[name].timeout,
+            "overlap": self.jobs[name].overlap,
+            "running": name in self.running,
+            "next_due": self.timers.due.get(name),
+        })
+        try:
+            await producer.redis.hset(SCHEDULER_JOBS_KEY, name, json.dumps(data))
+        except Exception as e:
+            logger.warning(f"Could not publish stats of scheduler job {name}: {e}")
+
+    async def listen(self):
+        """Schedule jobs announced on SCHEDULER_CHANNEL."""
+        while True:
+            pubsub = producer.redis.pubsub()
+            try:
+                await pubsub.subscribe(SCHEDULER_CHANNEL)
+                # Anything announced while we were not subscribed is picked up from the database
+                for name in ("scheduled_campaigns", "drips", "completion"):
+                    self.schedule(name, time.time())
+                async for message in pubsub.listen():
+                    if message["type"] != "message":
+                        continue
+                    name, due_at = parse_wakeup(message["data"])
+                    self.schedule(name, due_at)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"Error in scheduler wakeup listener: {e}")
+                await asyncio.sleep(5)
+            finally:
+                await pubsub.close()
+
+    async def run(self):
+        logger.info("Scheduler started")
+        # The jobs driven by the database and wakeups are scheduled once the listener is subscribed
+        now = time.time()
+        for name, job in self.jobs.items():
+            if job.interval is not None:
+                self.schedule(name, now)
+        listener = asyncio.create_task(self.listen())
+        try:
+            while True:
+                due_at = self.timers.next_due()
+                timeout = None if due_at is None else max(0.0, due_at - time.time())
+                try:
+                    await asyncio.wait_for(self.wakeup.wait(), timeout)
+                except asyncio.TimeoutError:
+                    pass
+                self.wakeup.clear()
+
+                for name in self.timers.pop_due(time.time()):
+                    self.start_job(name)
+        finally:
+            listener.cancel()
+            for task in self.running.values():
+                task.cancel()
+
+async def scheduler_loop(lease=None):
+    await Scheduler(lease).run()
+
+async def run_scheduler():
+    """Scheduler role: create the tables, then run the scheduler whenever this process is elected."""
+    await create_tables()
+    lease = LeaderLease("scheduler")
+    try:
+        await lease.run(lambda: scheduler_loop(lease))
+    finally:
+        await client_pool.close()
+        await engine.dispose()
@@ -0,0 +1,160 @@
+import os
+import msgpack
+from ..events.payloads import decode_event
+from .scheduler_timers import SCHEDULER_CHANNEL, wakeup_message
+
+# Fan-out record of a campaign: campaign_fanout:<id> =
+# {total, cursor, enqueued, started_at, updated_at, rate, done, windowed, processed, skipped:<reason>}
+FANOUT_KEY_PREFIX = "campaign_fanout"
+# Campaigns whose processed counter reached the number of published tasks,
+# waiting for the scheduler to mark them completed: {campaign_id}. The
+# scheduler is woken with a "completion" wakeup when one is added.
+COMPLETED_KEY = "campaigns_completed"
+
+# Recipients of a campaign that were published to the stream and have not
+# reached a final state yet: campaign_inflight:<campaign_id> = {recipient index}
+INFLIGHT_PREFIX = "campaign_inflight"
+
+# Credits: at most this many tasks per usable account are in flight for one
+# campaign; 0 publishes the whole list up front.
+CAMPAIGN_WINDOW_PER_ACCOUNT = int(os.getenv("CAMPAIGN_WINDOW_PER_ACCOUNT", "20"))
+CAMPAIGN_WINDOW_MAX = int(os.getenv("CAMPAIGN_WINDOW_MAX", "2000"))
+
+def fanout_key(campaign_id) -> str:
+    return f"{FANOUT_KEY_PREFIX}:{campaign_id}"
+
+def inflight_key(campaign_id) -> str:
+    return f"{INFLIGHT_PREFIX}:{campaign_id}"
+
+def task_ref(data: dict):
+    """(campaign_id, index) of a broadcast campaign task, None for drips and legacy tasks."""
+    campaign_id = data.get("campaign_id")
+    index = data.get("index")
+    if isinstance(campaign_id, int) and index is not None:
+        return campaign_id, index
+    return None
+
+def campaign_window(available_accounts: int):
+    """Number of tasks a campaign may have in flight, or None when unlimited."""
+    if CAMPAIGN_WINDOW_PER_ACCOUNT <= 0:
+        return None
+    return min(CAMPAIGN_WINDOW_MAX, CAMPAIGN_WINDOW_PER_ACCOUNT * available_accounts)
+
+# Return the credit and count the task as processed. With credits in use
+# (windowed) a task is only counted the first time, so a redelivered entry
+# cannot complete the campaign early.
+FINISH_TASK_SCRIPT = """
+local removed = redis.call('SREM', KEYS[1], ARGV[1])
+if redis.call('EXISTS', KEYS[2]) == 0 then
+    return 0
+end
+if removed == 0 and redis.call('HGET', KEYS[2], 'windowed') == '1' then
+    return 0
+end
+local processed = redis.call('HINCRBY', KEYS[2], 'processed', 1)
+local state = redis.call('HMGET', KEYS[2], 'done', 'enqueued')
+if state[1] == '1' and processed >= tonumber(state[2] or '0') then
+    redis.call('SADD', KEYS[3], ARGV[2])
+    redis.call('PUBLISH', ARGV[3], ARGV[4])
+end
+return 1
+"""
+
+# Flag the fan-out as finished; the campaign is complete already if its
+# workers were faster than the feeder's last checkpoint.
+FANOUT_DONE_SCRIPT = """
+redis.call('HSET', KEYS[1], 'done', 1)
+local state = redis.call('HMGET', KEYS[1], 'processed', 'enqueued')
+if tonumber(state[1] or '0') >= tonumber(state[2] or '0') then
+    redis.call('SADD', KEYS[2], ARGV[1])
+    redis.call('PUBLISH', ARGV[2], ARGV[3])
+    return 1
+end
+return 0
+"""
+
+class CompletionCounters:
+    """Processed-task counters of campaign fan-outs (FINISH_TASK_SCRIPT, FANOUT_DONE_SCRIPT)."""
+
+    def __init__(self, redis_client):
+        self.redis = redis_client
+        self.finish_script = self.redis.register_script(FINISH_TASK_SCRIPT)
+        self.done_script = self.redis.register_script(FANOUT_DONE_SCRIPT)
+
+    async def finish_task(self, data: dict):
+        """Return the task's credit to its campaign once it is sent, skipped or failed for good."""
+        ref = task_ref(data)
+        if ref is not None:
+            await self.finish_script(
+                keys=[inflight_key(ref[0]), fanout_key(ref[0]), COMPLETED_KEY],
+                args=[ref[1], ref[0], SCHEDULER_CHANNEL, wakeup_message("completion")],
+            )
+
+    async def mark_fanout_done(self, campaign_id: int) -> bool:
+        """Record that every task of the campaign was published. Returns True if all were already processed."""
+        return bool(await self.done_script(
+            keys=[fanout_key(campaign_id), COMPLETED_KEY],
+            args=[campaign_id, SCHEDULER_CHANNEL, wakeup_message("completion")],
+        ))
+
+# Campaigns whose queued tasks workers must not send: {campaign_id: "stopped" | "paused"}.
+# An entry is removed once the campaign completes, is deleted, or none of its
+# tasks can still be queued.
+HALTED_KEY = "campaigns_halted"
+# "<campaign_id>:<state>" is published here whenever its entry in HALTED_KEY
+# changes; an empty state means the entry was removed
+CAMPAIGN_CHANNEL = "campaign_updates"
+# Tasks of a paused campaign set aside by the workers: campaign_parked:<id> = [msgpack stream entry]
+PARKED_PREFIX = "campaign_parked"
+UNPARK_BATCH_SIZE = 500
+
+def parked_key(campaign_id) -> str:
+    return f"{PARKED_PREFIX}:{campaign_id}"
+
+async def set_halted(redis_client, campaign_id: int, state: str = None):
+    """Mark a campaign "stopped" or "paused" for every worker, or clear the mark."""
+    pipe = redis_client.pipeline(transaction=True)
+    if state:
+        pipe.hset(HALTED_KEY, campaign_id, state)
+    else:
+        pipe.hdel(HALTED_KEY, campaign_id)
+    pipe.publish(CAMPAIGN_CHANNEL, f"{campaign_id}:{state or ''}")
+    await pipe.execute()
+
+def parse_halted_update(raw) -> tuple:
+    """(campaign_id, state or None) of a CAMPAIGN_CHANNEL message."""
+    if isinstance(raw, bytes):
+        raw = raw.decode("utf-8")
+    campaign_id, _, state = raw.partition(":")
+    return int(campaign_id), state or None
+
+async def load_halted(redis_client) -> dict:
+    data = await redis_client.hgetall(HALTED_KEY)
+    return {int(k): v.decode("utf-8") for k, v in data.items()}
+
+async def unpark_tasks(redis_client, stream_key: str, campaign_id: int) -> int:
+    """Put the tasks set aside while the campaign was paused back on the stream."""
+    moved = 0
+    while True:
+        items = await redis_client.lpop(parked_key(campaign_id), UNPARK_BATCH_SIZE)
+        if not items:
+            return moved
+        pipe = redis_client.pipeline(transaction=False)
+        for raw in items:
+            pipe.xadd(stream_key, msgpack.unpackb(raw, raw=False))
+        await pipe.execute()
+        moved += len(items)
+
+async def drop_parked_tasks(redis_client, completion: CompletionCounters, campaign_id: int) -> int:
+    """Discard the tasks set aside while the campaign was paused, counting each one as processed."""
+    dropped = 0
+    while True:
+        items = await redis_client.lpop(parked_key(campaign_id), UNPARK_BATCH_SIZE)
+        if not items:
+            return dropped
+        for raw in items:
+            fields = msgpack.unpackb(raw, raw=False)
+            # Same shape as a stream entry read back from Redis
+            _, data = decode_event({k.encode(): v.encode() if isinstance(v, str) else v for k, v in fields.items()})
+            await completion.finish_task(data)
+        dropped += len(items)
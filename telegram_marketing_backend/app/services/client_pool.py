@@ -0,0 +1,241 @@
+import asyncio
+import logging
+import os
+import time
+from collections import OrderedDict
+from contextlib import asynccontextmanager
+from typing import TYPE_CHECKING
+import redis.asyncio as redis
+from sqlalchemy.future import select
+from ..models import Account
+from ..database import AsyncSessionLocal
+
+if TYPE_CHECKING:
+    # Imported when the first client connects, so processes that never talk to Telegram skip it
+    from telethon import TelegramClient
+
+logger = logging.getLogger(__name__)
+
+REDIS_URL = os.getenv("REDIS_URL", "redis://localhost:6379")
+CLIENT_POOL_MAX_OPEN = int(os.getenv("CLIENT_POOL_MAX_OPEN", "200"))
+CLIENT_POOL_IDLE_TIMEOUT = float(os.getenv("CLIENT_POOL_IDLE_TIMEOUT", "600"))
+CLIENT_POOL_SWEEP_INTERVAL = float(os.getenv("CLIENT_POOL_SWEEP_INTERVAL", "60"))
+# Account ids whose session changed are published here so every process drops its client
+CLIENT_CHANNEL = "client_invalidations"
+
+class ClientUnavailable(Exception):
+    """The account cannot provide a working client.
+
+    reason is one of "not_found", "not_logged_in" or "unauthorized".
+    """
+
+    def __init__(self, account_id: int, reason: str):
+        super().__init__(f"Client for account {account_id} unavailable: {reason}")
+        self.account_id = account_id
+        self.reason = reason
+
+class PooledClient:
+    __slots__ = ("client", "refs", "last_used")
+
+    def __init__(self, client: "TelegramClient"):
+        self.client = client
+        self.refs = 0
+        self.last_used = time.monotonic()
+
+class TelegramClientPool:
+    """Process-wide pool of connected, authorized TelegramClients, one per account.
+
+    Clients are reference counted while in use. At most max_open connections
+    are kept; when the budget is exhausted the least recently used idle
+    client is disconnected, and callers wait if every client is busy. Idle
+    clients are disconnected after idle_timeout seconds. Once in use, the pool
+    listens on CLIENT_CHANNEL and drops the clients of accounts whose session
+    changed in any process.
+    """
+
+    def __init__(self, max_open: int = CLIENT_POOL_MAX_OPEN, idle_timeout: float = CLIENT_POOL_IDLE_TIMEOUT, redis_client=None):
+        self.max_open = max_open
+        self.idle_timeout = idle_timeout
+        self.redis = redis_client or redis.from_url(REDIS_URL)
+        self.entries = OrderedDict() # {account_id: PooledClient}
+        self.retired = {} # Invalidated clients still in use: {client: PooledClient}
+        self.locks = {} # {account_id: asyncio.Lock} serializes connects per account
+        self.released = asyncio.Condition()
+        self.sweeper = None
+        self.listener = None
+        # Metrics
+        self.hits = 0
+        self.misses = 0
+        self.reconnects = 0
+        self.evictions = 0
+
+    @asynccontextmanager
+    async def acquire(self, account_id: int):
+        client = await self.get(account_id)
+        try:
+            yield client
+        finally:
+            await self.release(account_id, client)
+
+    async def get(self, account_id: int) -> "TelegramClient":
+        """Return a connected client for account_id. Pair every call with release()."""
+        self._start_background()
+        lock = self.locks.setdefault(account_id, asyncio.Lock())
+        async with lock:
+            entry = self.entries.get(account_id)
+            if entry is not None:
+                # Take the reference first so the entry cannot be evicted while reconnecting
+                entry.refs += 1
+                if not entry.client.is_connected():
+                    try:
+                        await entry.client.connect()
+                        self.reconnects += 1
+                    except Exception as e:
+                        logger.warning(f"Reconnect failed for account {account_id}, recreating client: {e}")
+                        entry.refs -= 1
+                        await self.invalidate(account_id)
+                        entry = None
+                if entry is not None:
+                    self.hits += 1
+                    entry.last_used = time.monotonic()
+                    self.entries.move_to_end(account_id)
+                    return entry.client
+
+            self.misses += 1
+            await self._reserve_slot()
+            client = await self._connect(account_id)
+            entry = PooledClient(client)
+            entry.refs = 1
+            self.entries[account_id] = entry
+            return client
+
+    async def release(self, account_id: int, client: "TelegramClient"):
+        entry = self.entries.get(account_id)
+        if entry is not None and entry.client is client:
+            entry.refs = max(0, entry.refs - 1)
+            entry.last_used = time.monotonic()
+        else:
+            entry = self.retired.get(client)
+            if entry is None:
+                return
+            entry.refs -= 1
+            if entry.refs <= 0:
+                del self.retired[client]
+                await self._disconnect(account_id, client)
+        async with self.released:
+            self.released.notify_all()
+
+    async def invalidate(self, account_id: int):
+        """Forget the client of an account whose session changed or was deleted."""
+        entry = self.entries.get(account_id)
+        if entry is None:
+            return
+        if entry.refs == 0:
+            await self._discard(account_id)
+        else:
+            # Disconnected by the last release(); new callers get a fresh client
+            del self.entries[account_id]
+            self.retired[entry.client] = entry
+
+    async def _connect(self, account_id: int) -> "TelegramClient":
+        async with AsyncSessionLocal() as db:
+            result = await db.execute(select(Account).where(Account.id == account_id))
+            account = result.scalars().first()
+        if not account:
+            raise ClientUnavailable(account_id, "not_found")
+        if not account.session_string:
+            raise ClientUnavailable(account_id, "not_logged_in")
+
+        from telethon import TelegramClient
+        from telethon.sessions import StringSession
+        client = TelegramClient(StringSession(account.session_string), int(account.api_id), account.api_hash)
+        await client.connect()
+        if not await client.is_user_authorized():
+            await client.disconnect()
+            raise ClientUnavailable(account_id, "unauthorized")
+        return client
+
+    async def _reserve_slot(self):
+        """Wait until opening one more connection stays within max_open."""
+        while len(self.entries) + len(self.retired) >= self.max_open:
+            idle = next((aid for aid, e in self.entries.items() if e.refs == 0), None)
+            if idle is not None:
+                self.evictions += 1
+                await self._discard(idle)
+                continue
+            async with self.released:
+                await self.released.wait()
+
+    async def _discard(self, account_id: int):
+        entry = self.entries.pop(account_id, None)
+        if entry is not None:
+            await self._disconnect(account_id, entry.client)
+
+    async def _disconnect(self, account_id: int, client: "TelegramClient"):
+        try:
+            await client.disconnect()
+        except Exception as e:
+            logger.warning(f"Error disconnecting client for account {account_id}: {e}")
+
+    async def evict_idle(self):
+        now = time.monotonic()
+        for account_id, entry in list(self.entries.items()):
+            if entry.refs == 0 and now - entry.last_used > self.idle_timeout:
+                self.evictions += 1
+                await self._discard(account_id)
+
+    async def _sweep_loop(self):
+        while True:
+            await asyncio.sleep(CLIENT_POOL_SWEEP_INTERVAL)
+            try:
+                await self.evict_idle()
+            except Exception as e:
+                logger.error(f"Client pool sweep error: {e}")
+
+    async def _invalidation_loop(self):
+        """Drop clients whose account was signed in again or deleted, by any process."""
+        while True:
+            pubsub = self.redis.pubsub()
+            try:
+                await pubsub.subscribe(CLIENT_CHANNEL)
+                async for message in pubsub.listen():
+                    if message["type"] == "message":
+                        await self.invalidate(int(message["data"]))
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"Client invalidation listener error: {e}")
+                await asyncio.sleep(5)
+            finally:
+                await pubsub.close()
+
+    def _start_background(self):
+        if self.sweeper is None or self.sweeper.done():
+            self.sweeper = asyncio.create_task(self._sweep_loop())
+        if self.listener is None or self.listener.done():
+            self.listener = asyncio.create_task(self._invalidation_loop())
+
+    async def close(self):
+        for task in (self.sweeper, self.listener):
+            if task is not None:
+                task.cancel()
+        self.sweeper = None
+        self.listener = None
+        for account_id in list(self.entries):
+            await self._discard(account_id)
+        for client, entry in list(self.retired.items()):
+            await self._disconnect(None, client)
+        self.retired.clear()
+
+    def stats(self) -> dict:
+        return {
+            "open": len(self.entries) + len(self.retired),
+            "in_use": sum(1 for e in self.entries.values() if e.refs),
+            "max_open": self.max_open,
+            "hits": self.hits,
+            "misses": self.misses,
+            "reconnects": self.reconnects,
+            "evictions": self.evictions,
+        }
+
+client_pool = TelegramClientPool()
@@ -0,0 +1,40 @@
+import time
+
+# {account_id: unix time until which the account must not send}
+COOLDOWNS_KEY = "account_cooldowns"
+
+class AccountCooldowns:
+    """Accounts parked after a FloodWait, shared by all workers through Redis.
+
+    Lookups are served from a local copy that refresh() keeps in sync, so
+    checking an account on the hot path costs no round trip.
+    """
+
+    def __init__(self, redis_client):
+        self.redis = redis_client
+        self.until = {} # {account_id: unblock timestamp}
+
+    async def park(self, account_id: int, seconds: float):
+        until = time.time() + seconds
+        self.until[account_id] = max(until, self.until.get(account_id, 0))
+        await self.redis.hset(COOLDOWNS_KEY, account_id, self.until[account_id])
+
+    def is_parked(self, account_id, now: float = None) -> bool:
+        return self.until.get(account_id, 0) > (now or time.time())
+
+    def available(self, account_ids) -> list:
+        now = time.time()
+        return [a for a in account_ids if not self.is_parked(a, now)]
+
+    def next_unblock(self, account_ids) -> float:
+        """Earliest time at which one of account_ids can send again."""
+        return min((self.until.get(a, 0) for a in account_ids), default=0)
+
+    async def refresh(self):
+        now = time.time()
+        data = await self.redis.hgetall(COOLDOWNS_KEY)
+        until = {int(k): float(v) for k, v in data.items()}
+        expired = [a for a, t in until.items() if t <= now]
+        if expired:
+            await self.redis.hdel(COOLDOWNS_KEY, *expired)
+        self.until = {a: t for a, t in until.items() if t > now}
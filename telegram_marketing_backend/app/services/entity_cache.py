@@ -0,0 +1,129 @@
+import json
+import os
+import time
+from collections import OrderedDict
+import redis.asyncio as redis
+from telethon import errors
+from telethon.tl.types import User, Chat, Channel, InputPeerUser, InputPeerChat, InputPeerChannel
+
+REDIS_URL = os.getenv("REDIS_URL", "redis://localhost:6379")
+ENTITY_TTL = int(os.getenv("ENTITY_CACHE_TTL", str(7 * 24 * 3600)))
+# Unresolvable names are remembered for a shorter time, they may get registered later
+ENTITY_NEGATIVE_TTL = int(os.getenv("ENTITY_CACHE_NEGATIVE_TTL", "3600"))
+ENTITY_LOCAL_SIZE = int(os.getenv("ENTITY_CACHE_LOCAL_SIZE", "50000"))
+ENTITY_KEY_PREFIX = "entity"
+
+class ResolvedPeer:
+    """The parts of a Telegram entity needed to send to it and to apply the filters.
+
+    access_hash is only valid for the account that resolved the entity, which is
+    why cache keys always include the account id.
+    """
+
+    __slots__ = ("peer_type", "peer_id", "access_hash", "bot", "has_photo")
+
+    def __init__(self, peer_type: str, peer_id: int, access_hash: int = None, bot: bool = False, has_photo: bool = False):
+        self.peer_type = peer_type
+        self.peer_id = peer_id
+        self.access_hash = access_hash
+        self.bot = bot
+        self.has_photo = has_photo
+
+    @classmethod
+    def from_entity(cls, entity):
+        has_photo = bool(getattr(entity, "photo", None))
+        if isinstance(entity, User):
+            return cls("user", entity.id, entity.access_hash, bool(entity.bot), has_photo)
+        if isinstance(entity, Channel):
+            return cls("channel", entity.id, entity.access_hash, False, has_photo)
+        if isinstance(entity, Chat):
+            return cls("chat", entity.id, None, False, has_photo)
+        return None
+
+    def input_peer(self):
+        if self.peer_type == "user":
+            return InputPeerUser(self.peer_id, self.access_hash)
+        if self.peer_type == "channel":
+            return InputPeerChannel(self.peer_id, self.access_hash)
+        return InputPeerChat(self.peer_id)
+
+    def dumps(self) -> str:
+        return json.dumps([self.peer_type, self.peer_id, self.access_hash, self.bot, self.has_photo])
+
+    @classmethod
+    def loads(cls, raw):
+        return cls(*json.loads(raw))
+
+class EntityCache:
+    """Two-level (process memory, then Redis) cache of resolved recipients.
+
+    Keyed by (account_id, recipient). Failed resolutions are cached as well
+    (negative caching) so unknown usernames do not cost a ResolveUsername
+    call on every attempt.
+    """
+
+    def __init__(self, redis_client=None):
+        self.redis = redis_client or redis.from_url(REDIS_URL)
+        self.local = OrderedDict() # {(account_id, recipient): (expires_at, ResolvedPeer or None)}
+        self.local_hits = 0
+        self.redis_hits = 0
+        self.resolved = 0
+        self.unresolved = 0
+
+    def _remember(self, key, peer, ttl: int):
+        self.local[key] = (time.monotonic() + ttl, peer)
+        self.local.move_to_end(key)
+        while len(self.local) > ENTITY_LOCAL_SIZE:
+            self.local.popitem(last=False)
+
+    async def resolve(self, client, account_id: int, recipient: str):
+        """Return the ResolvedPeer for recipient as seen by account_id, or None if unresolvable.
+
+        FloodWaitError is propagated, it says nothing about the recipient.
+        """
+        key = (account_id, recipient)
+        cached = self.local.get(key)
+        if cached is not None and cached[0] > time.monotonic():
+            self.local_hits += 1
+            self.local.move_to_end(key)
+            return cached[1]
+
+        redis_key = f"{ENTITY_KEY_PREFIX}:{account_id}:{recipient}"
+        pipe = self.redis.pipeline(transaction=False)
+        pipe.get(redis_key)
+        pipe.ttl(redis_key)
+        raw, ttl = await pipe.execute()
+        if raw is not None:
+            self.redis_hits += 1
+            peer = ResolvedPeer.loads(raw) if raw else None
+            self._remember(key, peer, ttl if ttl > 0 else ENTITY_NEGATIVE_TTL)
+            return peer
+
+        try:
+            entity = await client.get_entity(recipient)
+            peer = ResolvedPeer.from_entity(entity)
+        except errors.FloodWaitError:
+            raise
+        except (ValueError, TypeError, errors.BadRequestError):
+            peer = None
+
+        if peer is None:
+            self.unresolved += 1
+            await self.redis.set(redis_key, "", ex=ENTITY_NEGATIVE_TTL)
+            self._remember(key, None, ENTITY_NEGATIVE_TTL)
+        else:
+            self.resolved += 1
+            await self.redis.set(redis_key, peer.dumps(), ex=ENTITY_TTL)
+            self._remember(key, peer, ENTITY_TTL)
+        return peer
+
+    def stats(self) -> dict:
+        return {
+            "local_size": len(self.local),
+            "local_hits": self.local_hits,
+            "redis_hits": self.redis_hits,
+            "resolved": self.resolved,
+            "unresolved": self.unresolved,
+        }
+
+entity_cache = EntityCache()
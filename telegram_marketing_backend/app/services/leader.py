@@ -0,0 +1,127 @@
+import asyncio
+import logging
+import os
+import socket
+import time
+import uuid
+import redis.asyncio as redis
+
+logger = logging.getLogger(__name__)
+
+REDIS_URL = os.getenv("REDIS_URL", "redis://localhost:6379")
+# leader:<name> = owner id, expiring after LEADER_LEASE_TTL unless renewed.
+# leader:<name>:token is incremented on every change of owner (fencing token).
+LEADER_PREFIX = "leader"
+LEADER_LEASE_TTL = float(os.getenv("LEADER_LEASE_TTL", "10"))
+LEADER_RENEW_INTERVAL = float(os.getenv("LEADER_RENEW_INTERVAL", str(LEADER_LEASE_TTL / 3)))
+
+# Take the lease if it is free (new token) or already ours (same token).
+# Returns the fencing token, or 0 when another owner holds the lease.
+ACQUIRE_SCRIPT = """
+if redis.call('SET', KEYS[1], ARGV[1], 'NX', 'PX', ARGV[2]) then
+    return redis.call('INCR', KEYS[2])
+end
+if redis.call('GET', KEYS[1]) == ARGV[1] then
+    redis.call('PEXPIRE', KEYS[1], ARGV[2])
+    return tonumber(redis.call('GET', KEYS[2]) or '0')
+end
+return 0
+"""
+
+RELEASE_SCRIPT = """
+if redis.call('GET', KEYS[1]) == ARGV[1] then
+    return redis.call('DEL', KEYS[1])
+end
+return 0
+"""
+
+def leader_key(name: str) -> str:
+    return f"{LEADER_PREFIX}:{name}"
+
+def fence_key(name: str) -> str:
+    return f"{LEADER_PREFIX}:{name}:token"
+
+class LeaderLease:
+    """Runs a singleton job in exactly one process, elected with a Redis lease.
+
+    Every process calls run(); the one holding the lease runs the job and
+    renews the lease, the others retry every LEADER_RENEW_INTERVAL and take
+    over within LEADER_LEASE_TTL when the leader dies. A leader that cannot
+    renew in time cancels its job before the lease can expire.
+
+    Each election hands out a higher fencing token; check_fence() tells a
+    leader whether it is still the latest one before it does something
+    that must not happen twice.
+    """
+
+    def __init__(self, name: str, redis_client=None, ttl: float = LEADER_LEASE_TTL, renew_interval: float = LEADER_RENEW_INTERVAL):
+        self.name = name
+        self.redis = redis_client or redis.from_url(REDIS_URL)
+        self.ttl = ttl
+        self.renew_interval = renew_interval
+        self.owner = f"{socket.gethostname()}-{os.getpid()}-{uuid.uuid4().hex[:6]}"
+        self.token = 0 # Fencing token of the current term, 0 when not leader
+        self.valid_until = 0.0 # monotonic time the lease is known to hold until
+        self.acquire_script = self.redis.register_script(ACQUIRE_SCRIPT)
+        self.release_script = self.redis.register_script(RELEASE_SCRIPT)
+
+    @property
+    def is_leader(self) -> bool:
+        return self.token > 0 and time.monotonic() < self.valid_until
+
+    async def try_acquire(self) -> int:
+        """Take or renew the lease. Returns the fencing token, 0 if another process leads."""
+        started = time.monotonic()
+        token = int(await self.acquire_script(
+            keys=[leader_key(self.name), fence_key(self.name)], args=[self.owner, int(self.ttl * 1000)]
+        ))
+        if token:
+            self.valid_until = started + self.ttl
+        self.token = token
+        return token
+
+    async def check_fence(self) -> bool:
+        """True while this process holds the lease and no newer leader was elected."""
+        if not self.is_leader:
+            return False
+        current = await self.redis.get(fence_key(self.name))
+        return current is not None and int(current) == self.token
+
+    async def release(self):
+        self.token = 0
+        try:
+            await self.release_script(keys=[leader_key(self.name)], args=[self.owner])
+        except Exception as e:
+            logger.warning(f"Could not release {self.name} lease: {e}")
+
+    async def run(self, job):
+        """Run job() whenever this process is the leader, until cancelled."""
+        task = None
+        try:
+            while True:
+                try:
+                    await self.try_acquire()
+                except Exception as e:
+                    logger.error(f"Leader election for {self.name} failed: {e}")
+                    if time.monotonic() >= self.valid_until - self.renew_interval:
+                        # Could not renew in time: stop before another process takes over
+                        self.token = 0
+
+                if self.token and task is None:
+                    logger.info(f"{self.owner} is now leader for {self.name} (token {self.token})")
+                    task = asyncio.create_task(job())
+                elif not self.token and task is not None:
+                    logger.warning(f"{self.owner} lost the {self.name} lease, stopping it")
+                    task.cancel()
+                    task = None
+
+                if task is not None and task.done():
+                    if not task.cancelled() and task.exception():
+                        logger.error(f"{self.name} stopped with an error, restarting: {task.exception()}")
+                    task = None
+                await asyncio.sleep(self.renew_interval)
+        finally:
+            if task is not None:
+                task.cancel()
+            if self.token:
+                await self.release()
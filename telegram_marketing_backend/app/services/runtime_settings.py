@@ -0,0 +1,63 @@
+import json
+import os
+import redis.asyncio as redis
+
+REDIS_URL = os.getenv("REDIS_URL", "redis://localhost:6379")
+FILTERS_KEY = "filter_settings"
+DELAY_SETTINGS_KEY = "delay_settings"
+SETTINGS_KEYS = (FILTERS_KEY, DELAY_SETTINGS_KEY)
+# The name of the changed settings key is published here after every update
+SETTINGS_CHANNEL = "settings_updates"
+
+# Shared connection pool for the API process (routers used to open one per request)
+redis_client = redis.from_url(REDIS_URL)
+
+def version_key(key: str) -> str:
+    return f"{key}:version"
+
+async def load_settings(key: str):
+    """Read one settings document straight from Redis (None if never saved)."""
+    data = await redis_client.get(key)
+    return json.loads(data) if data else None
+
+async def save_settings(key: str, value: dict):
+    """Store a settings document, bump its version and notify the workers."""
+    pipe = redis_client.pipeline(transaction=True)
+    pipe.set(key, json.dumps(value))
+    pipe.incr(version_key(key))
+    pipe.publish(SETTINGS_CHANNEL, key)
+    await pipe.execute()
+
+class RuntimeSettings:
+    """Versioned copy of the runtime settings kept in worker memory.
+
+    The owner calls refresh() once at startup and again for every key
+    announced on SETTINGS_CHANNEL, so the per-message hot path never
+    touches Redis.
+    """
+
+    def __init__(self, redis_client):
+        self.redis = redis_client
+        self.values = {key: None for key in SETTINGS_KEYS}
+        self.versions = {key: -1 for key in SETTINGS_KEYS}
+
+    def get(self, key: str):
+        return self.values.get(key)
+
+    async def refresh(self, *keys):
+        keys = [k for k in (keys or SETTINGS_KEYS) if k in self.values]
+        if not keys:
+            return
+        pipe = self.redis.pipeline(transaction=True)
+        for key in keys:
+            pipe.get(key)
+            pipe.get(version_key(key))
+        results = await pipe.execute()
+        for i, key in enumerate(keys):
+            data, version = results[2 * i], results[2 * i + 1]
+            version = int(version) if version else 0
+            # A slow refresh must not overwrite a newer one
+            if version < self.versions[key]:
+                continue
+            self.values[key] = json.loads(data) if data else None
+            self.versions[key] = version
@@ -0,0 +1,73 @@
+import heapq
+import itertools
+import time
+from datetime import datetime, timezone
+
+# The API and the workers publish "<job>:<due unix time>" here when they
+# create or change something the scheduler has to act on; a due time of 0
+# means now.
+SCHEDULER_CHANNEL = "scheduler_wakeup"
+# Last run of each scheduler job: {job: json}
+SCHEDULER_JOBS_KEY = "scheduler_jobs"
+
+def utc_timestamp(value: datetime) -> float:
+    """Unix time of a naive UTC datetime (the way the models store times)."""
+    return value.replace(tzinfo=timezone.utc).timestamp()
+
+def wakeup_message(job: str, due_at: float = None) -> str:
+    return f"{job}:{due_at or 0}"
+
+def parse_wakeup(raw) -> tuple:
+    """(job, due unix time) of a wakeup message."""
+    if isinstance(raw, bytes):
+        raw = raw.decode("utf-8")
+    job, _, due_at = raw.partition(":")
+    return job, float(due_at or 0) or time.time()
+
+async def wake_scheduler(redis_client, job: str, due_at: float = None):
+    """Ask the scheduler to run a job at due_at (unix time), or now."""
+    await redis_client.publish(SCHEDULER_CHANNEL, wakeup_message(job, due_at))
+
+class TimerHeap:
+    """Next due time of each scheduler job, earliest first.
+
+    A job has at most one pending time: pushing an earlier time replaces
+    it, a later one is ignored. Replaced entries stay in the heap and are
+    skipped when they surface.
+    """
+
+    __slots__ = ("heap", "due", "counter")
+
+    def __init__(self):
+        self.heap = [] # [(due, seq, job)]
+        self.due = {} # {job: due}
+        self.counter = itertools.count()
+
+    def push(self, job: str, due_at: float):
+        current = self.due.get(job)
+        if current is not None and current <= due_at:
+            return
+        self.due[job] = due_at
+        heapq.heappush(self.heap, (due_at, next(self.counter), job))
+
+    def next_due(self):
+        """Earliest pending due time, or None when nothing is scheduled."""
+        while self.heap:
+            due_at, _, job = self.heap[0]
+            if self.due.get(job) == due_at:
+                return due_at
+            heapq.heappop(self.heap)
+        return None
+
+    def pop_due(self, now: float) -> list:
+        """Remove and return the jobs due at now, earliest first."""
+        jobs = []
+        while self.heap and self.heap[0][0] <= now:
+            due_at, _, job = heapq.heappop(self.heap)
+            if self.due.get(job) == due_at:
+                del self.due[job]
+                jobs.append(job)
+        return jobs
+
+    def __len__(self):
+        return len(self.due)
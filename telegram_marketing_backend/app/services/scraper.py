@@ -1,16 +1,19 @@
-from telethon import TelegramClient
-from telethon.tl.functions.channels import JoinChannelRequest
-from telethon.tl.functions.messages import ImportChatInviteRequest, CheckChatInviteRequest
-from telethon.tl.functions.contacts import ResolveUsernameRequest
 import logging
 import re
+from typing import TYPE_CHECKING
+
+if TYPE_CHECKING:
+    from telethon import TelegramClient
 
 logger = logging.getLogger(__name__)
 
-async def scrape_group_members(client: TelegramClient, group_link: str, limit: int = 100, only_usernames: bool = False, active_only: bool = False):
+async def scrape_group_members(client: "TelegramClient", group_link: str, limit: int = 100, only_usernames: bool = False, active_only: bool = False):
     """
     Scrape members from a public group or private invite link.
     """
+    from telethon.tl.functions.channels import JoinChannelRequest
+    from telethon.tl.functions.messages import ImportChatInviteRequest, CheckChatInviteRequest
+    from telethon.tl.functions.contacts import ResolveUsernameRequest
     print(f"DEBUG: Scraping link: {group_link}", flush=True)
     try:
         entity = None
@@ -135,7 +138,7 @@ async def scrape_group_members(client: TelegramClient, group_link: str, limit: i
         print(f"DEBUG: Scraping error: {e}")
         raise e
 
-async def scrape_channel_interactions(client: TelegramClient, entity, limit: int, only_usernames: bool, active_only: bool):
+async def scrape_channel_interactions(client: "TelegramClient", entity, limit: int, only_usernames: bool, active_only: bool):
     """
     Scrape users who interacted with the channel (reactions, comments).
     """
@@ -0,0 +1,122 @@
+import os
+import redis.asyncio as redis
+from sqlalchemy.future import select
+from ..models import SendLog, DripProgress
+
+REDIS_URL = os.getenv("REDIS_URL", "redis://localhost:6379")
+# One Redis set per reason: suppression:<reason> = {normalized recipient}
+SUPPRESSION_PREFIX = "suppression"
+SUPPRESSION_REASONS = ("opted_out", "replied", "messaged")
+# Reasons that can be recomputed from the database; opt-outs only come from the API
+REBUILDABLE_REASONS = ("messaged", "replied")
+SUPPRESSION_BATCH_SIZE = int(os.getenv("SUPPRESSION_BATCH_SIZE", "5000"))
+
+# Recipients a campaign has already handed out: campaign_seen:<id> = {recipient: list index}
+SEEN_PREFIX = "campaign_seen"
+SEEN_TTL = int(os.getenv("CAMPAIGN_SEEN_TTL", str(30 * 24 * 3600)))
+
+def suppression_key(reason: str) -> str:
+    return f"{SUPPRESSION_PREFIX}:{reason}"
+
+def seen_key(campaign_id) -> str:
+    return f"{SEEN_PREFIX}:{campaign_id}"
+
+def normalize_recipient(recipient) -> str:
+    """Canonical form for membership checks: +digits for phones, lower-case username without @."""
+    value = str(recipient).strip()
+    if value.startswith("+"):
+        return "+" + "".join(c for c in value if c.isdigit())
+    return value.lstrip("@").lower()
+
+class SuppressionIndex:
+    """Recipients that must not be messaged again, kept in Redis sets.
+
+    Checks are done in bulk with SMISMEMBER, one pipelined round trip per
+    batch of recipients whatever the number of reasons.
+    """
+
+    def __init__(self, redis_client=None):
+        self.redis = redis_client or redis.from_url(REDIS_URL)
+
+    async def add(self, reason: str, recipients) -> int:
+        keys = {normalize_recipient(r) for r in recipients if r}
+        if not keys:
+            return 0
+        return await self.redis.sadd(suppression_key(reason), *keys)
+
+    async def remove(self, reason: str, recipients) -> int:
+        keys = {normalize_recipient(r) for r in recipients if r}
+        if not keys:
+            return 0
+        return await self.redis.srem(suppression_key(reason), *keys)
+
+    async def counts(self) -> dict:
+        pipe = self.redis.pipeline(transaction=False)
+        for reason in SUPPRESSION_REASONS:
+            pipe.scard(suppression_key(reason))
+        return dict(zip(SUPPRESSION_REASONS, await pipe.execute()))
+
+    async def check(self, campaign_id: int, recipients: list, reasons=SUPPRESSION_REASONS) -> list:
+        """Verdict for each (index, recipient) of a campaign batch: a reason, "duplicate" or None.
+
+        Recipients that pass are remembered for the campaign with their list
+        index, so a later row with the same recipient is a duplicate while a
+        re-check of the same row (resumed fan-out) still passes.
+        """
+        if not recipients:
+            return []
+        keys = [normalize_recipient(r) for _, r in recipients]
+        pipe = self.redis.pipeline(transaction=False)
+        for reason in reasons:
+            pipe.smismember(suppression_key(reason), keys)
+        pipe.hmget(seen_key(campaign_id), keys)
+        results = await pipe.execute()
+        hits, seen = results[:-1], results[-1]
+
+        verdicts = []
+        passed = {}
+        for i, ((index, _), key) in enumerate(zip(recipients, keys)):
+            verdict = next((reason for reason, found in zip(reasons, hits) if found[i]), None)
+            if verdict is None:
+                first = passed.get(key, seen[i])
+                if first is not None and int(first) != index:
+                    verdict = "duplicate"
+                else:
+                    passed[key] = index
+            verdicts.append(verdict)
+
+        if passed:
+            pipe = self.redis.pipeline(transaction=False)
+            pipe.hset(seen_key(campaign_id), mapping=passed)
+            pipe.expire(seen_key(campaign_id), SEEN_TTL)
+            await pipe.execute()
+        return verdicts
+
+    async def rebuild(self, session_factory) -> dict:
+        """Recompute the rebuildable reasons from sent logs and replied drips."""
+        counts = {}
+        async with session_factory() as db:
+            sent = await db.stream_scalars(select(SendLog.recipient).where(SendLog.status == "sent").distinct())
+            counts["messaged"] = await self._replace("messaged", sent)
+
+            replied = await db.stream_scalars(select(DripProgress.user_data).where(DripProgress.status == "replied"))
+            counts["replied"] = await self._replace("replied", replied, lambda u: (u or {}).get("username") or (u or {}).get("phone"))
+        return counts
+
+    async def _replace(self, reason: str, rows, extract=None) -> int:
+        """Load rows into a fresh set and swap it in, so checks never see a half-built index."""
+        target = suppression_key(reason)
+        building = f"{target}:rebuild"
+        await self.redis.delete(building)
+        async for chunk in rows.partitions(SUPPRESSION_BATCH_SIZE):
+            values = [extract(row) for row in chunk] if extract else chunk
+            keys = {normalize_recipient(v) for v in values if v}
+            if keys:
+                await self.redis.sadd(building, *keys)
+        if await self.redis.exists(building):
+            await self.redis.rename(building, target)
+        else:
+            await self.redis.delete(target)
+        return await self.redis.scard(target)
+
+suppression_index = SuppressionIndex()
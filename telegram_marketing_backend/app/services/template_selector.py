@@ -0,0 +1,81 @@
+from bisect import bisect_right
+from itertools import accumulate
+
+MASK64 = (1 << 64) - 1
+
+def _uniform(seed: int, index: int) -> float:
+    """Deterministic uniform [0, 1) for (seed, index) using the splitmix64 finalizer.
+
+    Independent of call order, so a resumed fan-out picks the same variants.
+    """
+    x = (seed * 0x9E3779B97F4A7C15 + index + 1) & MASK64
+    x = ((x ^ (x >> 30)) * 0xBF58476D1CE4E5B9) & MASK64
+    x = ((x ^ (x >> 27)) * 0x94D049BB133111EB) & MASK64
+    x ^= x >> 31
+    return x / 2 ** 64
+
+class TemplateSelector:
+    """Chooses the template for the i-th recipient of a campaign in O(1) memory.
+
+    Precedence: rotation steps, then A/B variants, then auto-rotation, then
+    the single template_id.
+
+    - rotation_steps [{"template_id", "count"}]: A x2, B x1 -> A A B A A B ...
+      resolved with cumulative counts and bisect, never expanded into a list.
+    - variants [(template_id, weight)]: weighted random choice over
+      precomputed cumulative weights, deterministic for a given seed.
+    - auto_rotation {"template_ids", "rotate_every"}: switch template every
+      rotate_every recipients.
+    """
+
+    def __init__(self, template_id: int = None, variants=None, rotation_steps=None, auto_rotation: dict = None, seed: int = 0):
+        self.template_id = template_id
+        self.seed = seed
+        self.mode = "single"
+
+        steps = [(s["template_id"], int(s.get("count", 1))) for s in rotation_steps or [] if s.get("template_id")]
+        steps = [(t, c) for t, c in steps if c > 0]
+        variants = [(t, w) for t, w in variants or [] if t and w and w > 0]
+        auto_ids = list((auto_rotation or {}).get("template_ids") or [])
+
+        if steps:
+            self.mode = "rotation"
+            self.templates = [t for t, _ in steps]
+            self.ends = list(accumulate(c for _, c in steps))
+            self.total = self.ends[-1]
+        elif variants:
+            self.mode = "ab"
+            self.templates = [t for t, _ in variants]
+            self.ends = list(accumulate(w for _, w in variants))
+            self.total = self.ends[-1]
+        elif auto_ids:
+            self.mode = "auto_rotation"
+            self.templates = auto_ids
+            self.rotate_every = max(1, int(auto_rotation.get("rotate_every", 1)))
+
+    @classmethod
+    def from_config(cls, config: dict, variants=None, seed: int = 0):
+        """Build from a Campaign.config dict plus the A/B variants as (template_id, weight) pairs."""
+        return cls(
+            template_id=config.get("template_id"),
+            variants=variants,
+            rotation_steps=config.get("rotation_steps"),
+            auto_rotation=config.get("auto_rotation_config"),
+            seed=seed,
+        )
+
+    @property
+    def template_ids(self) -> set:
+        """Every template this selector can return."""
+        if self.mode == "single":
+            return {self.template_id}
+        return set(self.templates)
+
+    def select(self, index: int) -> int:
+        if self.mode == "rotation":
+            return self.templates[bisect_right(self.ends, index % self.total)]
+        if self.mode == "ab":
+            return self.templates[bisect_right(self.ends, _uniform(self.seed, index) * self.total)]
+        if self.mode == "auto_rotation":
+            return self.templates[(index // self.rotate_every) % len(self.templates)]
+        return self.template_id
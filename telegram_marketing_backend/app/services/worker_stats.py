@@ -0,0 +1,18 @@
+import json
+import time
+
+# Each worker publishes its counters here: {consumer_name: json}
+WORKER_STATS_KEY = "worker_stats"
+# Workers that have not reported for this long are considered gone
+WORKER_STALE_AFTER = 60
+
+async def live_worker_stats(redis_client) -> list:
+    """The counters last reported by each worker that is still reporting."""
+    data = await redis_client.hgetall(WORKER_STATS_KEY)
+    now = time.time()
+    workers = []
+    for raw in data.values():
+        stats = json.loads(raw)
+        if now - stats.get("updated_at", 0) <= WORKER_STALE_AFTER:
+            workers.append(stats)
+    return workers
@@ -1,15 +1,282 @@
+import asyncio
 import logging
+import os
+import time
+import uuid
 from sqlalchemy.future import select
-from ..models import Campaign
+from sqlalchemy.orm import selectinload
+from ..models import Campaign, UserList, ABTest
 from ..database import AsyncSessionLocal
+from ..events.producer import producer, STREAM_KEY
+from ..events.payloads import campaign_tasks
+from ..events.templates import load_placeholders
+from ..services.template_selector import TemplateSelector
+from ..services.campaign_state import (
+    CAMPAIGN_WINDOW_PER_ACCOUNT, CompletionCounters, fanout_key, inflight_key, campaign_window, unpark_tasks
+)
+from ..services.cooldowns import AccountCooldowns
+from ..services.suppression import suppression_index, SUPPRESSION_REASONS
+from ..services.scheduler_timers import wake_scheduler
 
 logger = logging.getLogger(__name__)
 
+FANOUT_CHUNK_SIZE = int(os.getenv("FANOUT_CHUNK_SIZE", "5000"))
+FANOUT_LOCK_TTL = int(os.getenv("FANOUT_LOCK_TTL", "60"))
+# How often a feeder looks at its window for free credits, and how often
+# it re-reads the campaign status
+FEED_INTERVAL = float(os.getenv("FEED_INTERVAL", "1"))
+FEED_STATUS_INTERVAL = float(os.getenv("FEED_STATUS_INTERVAL", "10"))
+# Low-water mark: the window is topped up once this many credits (or half
+# the window, if smaller) are free, not after every finished task
+FEED_MIN_BATCH = int(os.getenv("FEED_MIN_BATCH", "100"))
+# Held by the process currently publishing the campaign
+FANOUT_LOCK_PREFIX = "campaign_fanout_lock"
+
+# Delete the lock only if this process still owns it
+RELEASE_LOCK_SCRIPT = """
+if redis.call('GET', KEYS[1]) == ARGV[1] then
+    return redis.call('DEL', KEYS[1])
+end
+return 0
+"""
+release_lock = producer.redis.register_script(RELEASE_LOCK_SCRIPT)
+completion = CompletionCounters(producer.redis)
+
+# Fan-out tasks of this process, referenced so they are not garbage collected
+_running = {} # {campaign_id: asyncio.Task}
+
+# FloodWaited accounts do not earn credits; shared by every feeder of this process
+cooldowns = AccountCooldowns(producer.redis)
+_cooldowns_refreshed = 0.0
+
+def fanout_lock_key(campaign_id) -> str:
+    return f"{FANOUT_LOCK_PREFIX}:{campaign_id}"
+
+async def fanout_progress(campaign_id: int):
+    """Publishing progress of a campaign, or None if it was never fanned out in the background."""
+    pipe = producer.redis.pipeline(transaction=False)
+    pipe.hgetall(fanout_key(campaign_id))
+    pipe.scard(inflight_key(campaign_id))
+    raw, in_flight = await pipe.execute()
+    if not raw:
+        return None
+    progress = {k.decode(): v.decode() for k, v in raw.items()}
+    # Recipients not published, by reason (no_contact, duplicate, opted_out, replied, messaged)
+    skipped = {k.split(":", 1)[1]: int(v) for k, v in progress.items() if k.startswith("skipped:")}
+    return {
+        "total": int(progress.get("total", 0)),
+        "enqueued": int(progress.get("enqueued", 0)),
+        "processed": int(progress.get("processed", 0)),
+        "cursor": int(progress.get("cursor", 0)),
+        "rate": float(progress.get("rate", 0)),
+        "in_flight": in_flight,
+        "skipped": skipped,
+        "done": progress.get("done") == "1",
+    }
+
+async def start_campaign_fanout(campaign_id: int):
+    """Register a running campaign for fan-out and publish its tasks in the background."""
+    await producer.redis.hsetnx(fanout_key(campaign_id), "cursor", 0)
+    _spawn(campaign_id)
+
+async def request_campaign_fanout(campaign_id: int):
+    """Register a running campaign for fan-out and have the scheduler start its feeder.
+
+    Used by the API: feeders run in the scheduler role, which picks the
+    campaign up in its "pending_campaigns" job.
+    """
+    await producer.redis.hsetnx(fanout_key(campaign_id), "cursor", 0)
+    await wake_scheduler(producer.redis, "pending_campaigns")
+
+def _spawn(campaign_id: int):
+    task = _running.get(campaign_id)
+    if task is None or task.done():
+        _running[campaign_id] = asyncio.create_task(materialize_campaign(campaign_id))
+
+async def materialize_campaign(campaign_id: int):
+    """Feed the tasks of a running campaign to the stream, resuming from the saved cursor.
+
+    Only a window of tasks per campaign is in the stream at any time (see
+    campaign_state); the feeder tops it up as workers finish tasks, so a
+    stopped campaign has at most one window left to drain. Only one process
+    feeds a campaign at a time. The cursor is saved after every batch, so a
+    crash re-publishes at most one batch.
+    """
+    token = uuid.uuid4().hex
+    lock_key = fanout_lock_key(campaign_id)
+    if not await producer.redis.set(lock_key, token, nx=True, ex=FANOUT_LOCK_TTL):
+        return
+    try:
+        await _materialize(campaign_id, lock_key)
+    except Exception as e:
+        logger.error(f"Fan-out of campaign {campaign_id} interrupted, it will be resumed: {e}")
+    finally:
+        _running.pop(campaign_id, None)
+        await release_lock(keys=[lock_key], args=[token])
+
+async def _materialize(campaign_id: int, lock_key: str):
+    key = fanout_key(campaign_id)
+    async with AsyncSessionLocal() as db:
+        result = await db.execute(select(Campaign).where(Campaign.id == campaign_id))
+        campaign = result.scalars().first()
+        if not campaign or campaign.status != "running":
+            return
+        config = campaign.config or {}
+
+        list_res = await db.execute(select(UserList).where(UserList.id == config.get("list_id")))
+        user_list = list_res.scalars().first()
+        if not user_list:
+            logger.error(f"User list {config.get('list_id')} not found for campaign {campaign_id}")
+            campaign.status = "failed"
+            await db.commit()
+            await producer.redis.hset(key, "done", 1)
+            return
+
+        # Fetch AB Test variants if applicable
+        ab_test_variants = [] # [(template_id, weight)]
+        if config.get("ab_test_id"):
+            ab_test_res = await db.execute(
+                select(ABTest).where(ABTest.id == config["ab_test_id"]).options(selectinload(ABTest.variants))
+            )
+            ab_test = ab_test_res.scalars().first()
+            if ab_test:
+                ab_test_variants = [(v.template_id, v.weight) for v in ab_test.variants]
+
+        # A/B, rotation and auto-rotation selection
+        selector = TemplateSelector.from_config(config, ab_test_variants, seed=campaign_id)
+        placeholders = await load_placeholders(db, selector.template_ids)
+
+    users = user_list.users if isinstance(user_list.users, list) else []
+    await producer.save_context(campaign_id, {
+        "account_ids": config.get("account_ids", []),
+        "delay": config.get("delay", 1.0),
+        "ab_test_id": config.get("ab_test_id"),
+    })
+
+    state = await producer.redis.hgetall(key)
+    cursor = int(state.get(b"cursor", 0))
+    enqueued = int(state.get(b"enqueued", 0))
+    started_at = float(state.get(b"started_at", 0)) or time.time()
+    await producer.redis.hset(key, mapping={
+        "total": len(users),
+        "started_at": started_at,
+        # Credits in use: workers count each task once, by its in-flight entry
+        "windowed": int(CAMPAIGN_WINDOW_PER_ACCOUNT > 0),
+    })
+
+    account_ids = config.get("account_ids", [])
+    reasons = SUPPRESSION_REASONS if config.get("suppression_reasons") is None else tuple(config["suppression_reasons"])
+    in_flight_key = inflight_key(campaign_id)
+    status_checked = time.monotonic()
+    while cursor < len(users):
+        # Renew the lock and count the tasks still in flight
+        pipe = producer.redis.pipeline(transaction=False)
+        pipe.expire(lock_key, FANOUT_LOCK_TTL)
+        pipe.scard(in_flight_key)
+        in_flight = (await pipe.execute())[1]
+
+        await _refresh_cooldowns()
+        window = campaign_window(len(cooldowns.available(account_ids)))
+        credits = FANOUT_CHUNK_SIZE if window is None else min(FANOUT_CHUNK_SIZE, window - in_flight)
+
+        if time.monotonic() - status_checked > FEED_STATUS_INTERVAL:
+            if not await _is_running(campaign_id):
+                logger.info(f"Campaign {campaign_id} is no longer running, fan-out stopped at {cursor}/{len(users)}")
+                return
+            # A template edited mid-campaign may use fields it did not use before
+            placeholders = await _load_placeholders(selector.template_ids)
+            status_checked = time.monotonic()
+        if window is not None and credits < min(FEED_MIN_BATCH, max(1, window // 2), len(users) - cursor):
+            # Window (nearly) full: wait for workers to finish some tasks
+            await asyncio.sleep(FEED_INTERVAL)
+            continue
+
+        stop = min(cursor + credits, len(users))
+        tasks = list(campaign_tasks(campaign_id, users, selector, placeholders, cursor, stop))
+        batch, skipped = await _suppress(campaign_id, tasks, reasons)
+        if stop - cursor > len(tasks):
+            skipped["no_contact"] = stop - cursor - len(tasks)
+        if batch and window is not None:
+            # Taken before publishing so a fast worker cannot return the credit first
+            await producer.redis.sadd(in_flight_key, *[data["index"] for _, data in batch])
+        enqueued += await producer.publish_many(batch)
+        cursor = stop
+
+        now = time.time()
+        pipe = producer.redis.pipeline(transaction=False)
+        pipe.hset(key, mapping={
+            "cursor": cursor,
+            "enqueued": enqueued,
+            "updated_at": now,
+            "rate": round(enqueued / max(now - started_at, 0.001), 1),
+        })
+        for reason, count in skipped.items():
+            pipe.hincrby(key, f"skipped:{reason}", count)
+        await pipe.execute()
+        if window is not None and cursor < len(users):
+            # The workers need a while to free a worthwhile batch of credits
+            await asyncio.sleep(FEED_INTERVAL)
+
+    await completion.mark_fanout_done(campaign_id)
+    logger.info(f"Campaign {campaign_id} fan-out finished: {enqueued} tasks for {len(users)} recipients")
+
+async def _suppress(campaign_id: int, batch: list, reasons) -> tuple:
+    """Drop suppressed and duplicate recipients from a batch. Returns (kept, {reason: count})."""
+    verdicts = await suppression_index.check(campaign_id, [(data["index"], data["recipient"]) for _, data in batch], reasons)
+    kept = []
+    skipped = {}
+    for event, verdict in zip(batch, verdicts):
+        if verdict is None:
+            kept.append(event)
+        else:
+            skipped[verdict] = skipped.get(verdict, 0) + 1
+    return kept, skipped
+
+async def _refresh_cooldowns():
+    global _cooldowns_refreshed
+    if time.monotonic() - _cooldowns_refreshed >= FEED_INTERVAL:
+        _cooldowns_refreshed = time.monotonic()
+        await cooldowns.refresh()
+
+async def _load_placeholders(template_ids) -> dict:
+    async with AsyncSessionLocal() as db:
+        return await load_placeholders(db, template_ids)
+
+async def _is_running(campaign_id: int) -> bool:
+    async with AsyncSessionLocal() as db:
+        result = await db.execute(select(Campaign.status).where(Campaign.id == campaign_id))
+        return result.scalar() == "running"
+
 async def run_pending_campaigns():
+    """Feed running campaigns with tasks left to publish.
+
+    Picks up campaigns the API started or resumed as well as fan-outs that
+    were interrupted (crash, restart).
     """
-    Check for campaigns that are stuck in 'running' state or need processing.
-    For now, this is a placeholder to satisfy the import in scheduler_service.
-    In a more complex system, this would check for stalled campaigns and resume them.
+    async with AsyncSessionLocal() as db:
+        result = await db.execute(select(Campaign.id).where(Campaign.status == "running"))
+        campaign_ids = result.scalars().all()
+    if not campaign_ids:
+        return
+
+    pipe = producer.redis.pipeline(transaction=False)
+    for campaign_id in campaign_ids:
+        pipe.hmget(fanout_key(campaign_id), "cursor", "done")
+    for campaign_id, (cursor, done) in zip(campaign_ids, await pipe.execute()):
+        # Tasks a worker set aside after the campaign was already resumed
+        await unpark_tasks(producer.redis, STREAM_KEY, campaign_id)
+        # Campaigns without a fan-out record were published before fan-out tracking existed
+        if cursor is not None and done != b"1":
+            _spawn(campaign_id)
+
+async def resume_campaign_fanout(campaign_id: int) -> bool:
+    """Have the scheduler continue feeding a resumed campaign from its saved cursor.
+
+    Returns False when there is nothing left to feed (already fully
+    published, or published before fan-out tracking existed).
     """
-    # logger.debug("Checking for pending campaigns...")
-    pass
+    cursor, done = await producer.redis.hmget(fanout_key(campaign_id), "cursor", "done")
+    if cursor is None or done == b"1":
+        return False
+    await wake_scheduler(producer.redis, "pending_campaigns")
+    return True
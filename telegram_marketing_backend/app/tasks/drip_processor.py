@@ -1,14 +1,26 @@
 import asyncio
+import os
 from datetime import datetime, timedelta
 from sqlalchemy.future import select
 from sqlalchemy.ext.asyncio import AsyncSession
 from ..models import DripCampaign, DripStep, DripProgress
 from ..database import AsyncSessionLocal
 from ..events.producer import producer
+from ..services.entity_cache import entity_cache
+from ..services.client_pool import client_pool, ClientUnavailable
+from ..services.suppression import suppression_index
 import logging
 
 logger = logging.getLogger(__name__)
 
+# Steps of an account without a usable client are tried again after this many seconds
+DRIP_RETRY_DELAY = float(os.getenv("DRIP_RETRY_DELAY", "300"))
+
+def postpone(account_items, until: datetime):
+    """Move steps that could not be processed out of the due window."""
+    for progress, _ in account_items:
+        progress.next_execution_time = until
+
 async def process_drip_campaigns():
     """Check for pending drip steps and execute them."""
     async with AsyncSessionLocal() as db:
@@ -33,6 +45,8 @@ async def process_drip_campaigns():
 
         logger.info(f"Processing {len(items)} drip items...")
         
+        outgoing = [] # Published in one pipelined batch below, on the high priority stream
+        
         # Group items by account_id to reuse client
         items_by_account = {}
         for progress, campaign in items:
@@ -40,26 +54,19 @@ async def process_drip_campaigns():
                 items_by_account[campaign.account_id] = []
             items_by_account[campaign.account_id].append((progress, campaign))
 
-        from telethon import TelegramClient
-        from telethon.sessions import StringSession
-        from ..models import Account
-
         for account_id, account_items in items_by_account.items():
-            # Get account credentials
-            acc_res = await db.execute(select(Account).where(Account.id == account_id))
-            account = acc_res.scalars().first()
-            
-            if not account or not account.session_string:
-                logger.error(f"Account {account_id} not found or invalid for drip processing")
+            try:
+                client = await client_pool.get(account_id)
+            except ClientUnavailable as e:
+                logger.error(f"Account {account_id} not usable for drip processing: {e.reason}")
+                postpone(account_items, now + timedelta(seconds=DRIP_RETRY_DELAY))
+                continue
+            except Exception as e:
+                logger.error(f"Error with account {account_id} client: {e}")
+                postpone(account_items, now + timedelta(seconds=DRIP_RETRY_DELAY))
                 continue
 
-            client = TelegramClient(StringSession(account.session_string), int(account.api_id), account.api_hash)
             try:
-                await client.connect()
-                if not await client.is_user_authorized():
-                    logger.error(f"Account {account_id} session expired")
-                    continue
-
                 for progress, campaign in account_items:
                     try:
                         user_data = progress.user_data
@@ -72,14 +79,17 @@ async def process_drip_campaigns():
                         # Check for reply (Stop on Reply)
                         # We assume we want to stop if the LAST message is from the user
                         try:
-                            entity = await client.get_entity(recipient)
-                            messages = await client.get_messages(entity, limit=1)
+                            peer = await entity_cache.resolve(client, account_id, recipient)
+                            if peer is None:
+                                raise ValueError(f"Could not resolve {recipient}")
+                            messages = await client.get_messages(peer.input_peer(), limit=1)
                             
                             if messages:
                                 last_msg = messages[0]
                                 if not last_msg.out: # Incoming message = Reply
                                     logger.info(f"User {recipient} replied. Stopping drip.")
                                     progress.status = "replied"
+                                    await suppression_index.add("replied", [recipient])
                                     continue
                         except Exception as e:
                             logger.warning(f"Could not check reply for {recipient}: {e}")
@@ -109,7 +119,7 @@ async def process_drip_campaigns():
                             "variables": user_data
                         }
                         
-                        await producer.publish("send_message", task_data)
+                        outgoing.append(("send_drip", task_data))
                         
                         # Move to next step
                         next_step_res = await db.execute(
@@ -137,6 +147,7 @@ async def process_drip_campaigns():
             except Exception as e:
                 logger.error(f"Error with account {account_id} client: {e}")
             finally:
-                await client.disconnect()
+                await client_pool.release(account_id, client)
         
+        await producer.publish_many(outgoing)
         await db.commit()
@@ -0,0 +1,36 @@
+import sys
+import os
+import pytest
+import pytest_asyncio
+
+# Add the parent directory to sys.path
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# Modules that open the database at import time get an in-memory SQLite engine
+os.environ.setdefault("DATABASE_URL", "sqlite+aiosqlite:///:memory:")
+
+@pytest_asyncio.fixture
+async def redis_client():
+    """An in-process Redis (fakeredis, with Lua) shared by every test that talks to Redis."""
+    fakeredis = pytest.importorskip("fakeredis")
+    client = fakeredis.FakeAsyncRedis(server=fakeredis.FakeServer())
+    yield client
+    await client.aclose()
+
+@pytest_asyncio.fixture
+async def session_factory():
+    """Sessions on a fresh in-memory SQLite database with every table created."""
+    from sqlalchemy.ext.asyncio import create_async_engine, AsyncSession
+    from sqlalchemy.orm import sessionmaker
+    from sqlalchemy.pool import StaticPool
+    from app.models import Base
+
+    engine = create_async_engine(
+        "sqlite+aiosqlite:///:memory:",
+        connect_args={"check_same_thread": False},
+        poolclass=StaticPool,
+    )
+    async with engine.begin() as conn:
+        await conn.run_sync(Base.metadata.create_all)
+    yield sessionmaker(engine, class_=AsyncSession, expire_on_commit=False)
+    await engine.dispose()
@@ -0,0 +1,45 @@
+import sys
+import os
+
+# Add the parent directory to sys.path
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app.events.account_selector import AccountSelector, AccountState, AccountStateView
+
+def make_view(**states):
+    view = AccountStateView()
+    view.states = {int(k[1:]): v for k, v in states.items()}
+    return view
+
+def test_unusable_accounts_are_skipped():
+    view = make_view(
+        a1=AccountState(health_status="banned"),
+        a2=AccountState(is_active=False),
+        a3=AccountState(health_status="alive"),
+    )
+    selector = AccountSelector(view, "random")
+    assert {selector.select({"account_ids": [1, 2, 3]}) for _ in range(20)} == {3}
+
+def test_no_accounts_returns_none():
+    selector = AccountSelector(make_view(), "random")
+    assert selector.select({"account_ids": []}) is None
+
+def test_least_loaded_picks_lowest_sent_today():
+    view = make_view(a1=AccountState(sent_today=10), a2=AccountState(sent_today=3))
+    selector = AccountSelector(view, "least_loaded")
+    assert selector.select({"account_ids": [1, 2]}) == 2
+    view.record_send(2)
+    assert view.pending_sends == {2: 1}
+
+def test_sticky_is_stable_per_recipient():
+    view = make_view(a1=AccountState(), a2=AccountState(), a3=AccountState())
+    selector = AccountSelector(view, "sticky")
+    task = {"account_ids": [1, 2, 3], "recipient": "@ann"}
+    chosen = selector.select(task)
+    assert all(selector.select(task) == chosen for _ in range(10))
+
+def test_weighted_health_prefers_healthy_accounts():
+    view = make_view(a1=AccountState(health_status="alive"), a2=AccountState(health_status="flood_wait"))
+    selector = AccountSelector(view, "weighted_health")
+    picks = [selector.select({"account_ids": [1, 2]}) for _ in range(500)]
+    assert picks.count(1) > picks.count(2)
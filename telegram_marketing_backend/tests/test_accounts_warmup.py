@@ -46,6 +46,8 @@ async def init_db():
     yield
     async with engine.begin() as conn:
         await conn.run_sync(Base.metadata.drop_all)
+    # Close the pooled aiosqlite connection, its worker thread keeps the interpreter alive
+    await engine.dispose()
 
 @pytest.mark.asyncio
 async def test_toggle_warmup(client, init_db):
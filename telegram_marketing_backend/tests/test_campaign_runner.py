@@ -0,0 +1,145 @@
+import sys
+import os
+import asyncio
+import time
+import pytest
+
+# Add the parent directory to sys.path
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app.models import Campaign, UserList, MessageTemplate
+from app.events.payloads import decode_event
+from app.events.producer import STREAM_KEY
+from app.services import campaign_state
+from app.services.campaign_state import inflight_key, fanout_key
+from app.services.scheduler_timers import SCHEDULER_CHANNEL
+from app.tasks import campaign_runner
+
+@pytest.fixture
+def feeder(redis_client, session_factory, monkeypatch):
+    """campaign_runner on fakeredis and SQLite, with publishes and status checks counted."""
+    monkeypatch.setattr(campaign_runner, "AsyncSessionLocal", session_factory)
+    monkeypatch.setattr(campaign_runner.producer, "redis", redis_client)
+    monkeypatch.setattr(campaign_runner.cooldowns, "redis", redis_client)
+    monkeypatch.setattr(campaign_runner.suppression_index, "redis", redis_client)
+    monkeypatch.setattr(campaign_runner, "completion", campaign_state.CompletionCounters(redis_client))
+    monkeypatch.setattr(campaign_runner, "FEED_INTERVAL", 0.01)
+    monkeypatch.setattr(campaign_runner, "FEED_STATUS_INTERVAL", 0.05)
+    monkeypatch.setattr(campaign_runner, "FEED_MIN_BATCH", 10)
+    monkeypatch.setattr(campaign_state, "CAMPAIGN_WINDOW_PER_ACCOUNT", 20)
+
+    calls = {"batches": [], "status_checks": 0}
+    publish_many = campaign_runner.producer.publish_many
+    is_running = campaign_runner._is_running
+
+    async def counting_publish_many(events, *args, **kwargs):
+        calls["batches"].append(len(events))
+        return await publish_many(events, *args, **kwargs)
+
+    async def counting_is_running(campaign_id):
+        calls["status_checks"] += 1
+        return await is_running(campaign_id)
+
+    monkeypatch.setattr(campaign_runner.producer, "publish_many", counting_publish_many)
+    monkeypatch.setattr(campaign_runner, "_is_running", counting_is_running)
+    return calls
+
+async def create_campaign(session_factory, recipients: int) -> int:
+    async with session_factory() as db:
+        user_list = UserList(name="list", users=[{"username": f"user{i}"} for i in range(recipients)])
+        db.add(user_list)
+        await db.flush()
+        campaign = Campaign(name="campaign", status="running", config={"list_id": user_list.id, "account_ids": [1, 2]})
+        db.add(campaign)
+        await db.commit()
+        return campaign.id
+
+@pytest.mark.asyncio
+async def test_feeder_tops_up_in_batches_as_credits_free(feeder, redis_client, session_factory):
+    campaign_id = await create_campaign(session_factory, 200)
+
+    async def worker():
+        # Finish one task at a time, the way a busy consumer returns credits
+        while True:
+            await redis_client.spop(inflight_key(campaign_id))
+            await asyncio.sleep(0.001)
+
+    workers = asyncio.create_task(worker())
+    started = time.monotonic()
+    try:
+        await asyncio.wait_for(campaign_runner._materialize(campaign_id, "lock"), 10)
+    finally:
+        workers.cancel()
+    elapsed = time.monotonic() - started
+
+    batches = feeder["batches"]
+    assert sum(batches) == 200
+    assert batches[0] == 40 # The whole window: 2 accounts x 20
+    assert all(size >= 10 for size in batches[:-1])
+    assert len(batches) <= 1 + 160 // 10
+    assert feeder["status_checks"] <= elapsed / 0.05 + 1
+    assert await redis_client.hget(fanout_key(campaign_id), "done") == b"1"
+
+@pytest.mark.asyncio
+async def test_feeder_waits_on_a_full_window_and_stops_when_paused(feeder, redis_client, session_factory):
+    campaign_id = await create_campaign(session_factory, 100)
+
+    feed = asyncio.create_task(campaign_runner._materialize(campaign_id, "lock"))
+    await asyncio.sleep(0.1)
+    # Nobody returned a credit: only the first window was published
+    assert feeder["batches"] == [40]
+
+    async with session_factory() as db:
+        campaign = await db.get(Campaign, campaign_id)
+        campaign.status = "paused"
+        await db.commit()
+    await asyncio.wait_for(feed, 1)
+
+    assert feeder["batches"] == [40]
+    assert await redis_client.hget(fanout_key(campaign_id), "cursor") == b"40"
+
+@pytest.mark.asyncio
+async def test_api_start_leaves_the_feeder_to_the_scheduler(redis_client, monkeypatch):
+    monkeypatch.setattr(campaign_runner.producer, "redis", redis_client)
+    pubsub = redis_client.pubsub()
+    await pubsub.subscribe(SCHEDULER_CHANNEL)
+    await pubsub.get_message(timeout=1) # Subscription confirmation
+
+    await campaign_runner.request_campaign_fanout(5)
+
+    assert 5 not in campaign_runner._running
+    assert await redis_client.hget(fanout_key(5), "cursor") == b"0"
+    message = await pubsub.get_message(timeout=1)
+    assert message["data"] == b"pending_campaigns:0"
+    await pubsub.aclose()
+
+@pytest.mark.asyncio
+async def test_feeder_picks_up_placeholders_added_mid_campaign(feeder, redis_client, session_factory):
+    async with session_factory() as db:
+        template = MessageTemplate(name="template", content="Hi {first_name}")
+        user_list = UserList(name="list", users=[{"username": f"user{i}", "first_name": "Ann", "city": "Oslo"} for i in range(100)])
+        db.add_all([template, user_list])
+        await db.flush()
+        campaign = Campaign(name="campaign", status="running", config={
+            "list_id": user_list.id, "account_ids": [1, 2], "template_id": template.id,
+        })
+        db.add(campaign)
+        await db.commit()
+        campaign_id, template_id = campaign.id, template.id
+
+    feed = asyncio.create_task(campaign_runner._materialize(campaign_id, "lock"))
+    await asyncio.sleep(0.02)
+    async with session_factory() as db:
+        template = await db.get(MessageTemplate, template_id)
+        template.content = "Hi {first_name} from {city}"
+        await db.commit()
+    await asyncio.sleep(0.1)
+    # Workers finish the first window, the rest is published after the status check
+    await redis_client.delete(inflight_key(campaign_id))
+    await asyncio.sleep(0.05)
+    await redis_client.delete(inflight_key(campaign_id))
+    await asyncio.wait_for(feed, 1)
+
+    variables = [decode_event(fields)[1]["variables"] for _, fields in await redis_client.xrange(STREAM_KEY)]
+    assert variables[0] == {"first_name": "Ann"}
+    assert variables[-1] == {"first_name": "Ann", "city": "Oslo"}
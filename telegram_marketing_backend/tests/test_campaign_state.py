@@ -0,0 +1,97 @@
+import sys
+import os
+import pytest
+
+# Add the parent directory to sys.path
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app.services.campaign_state import (
+    CompletionCounters, COMPLETED_KEY, CAMPAIGN_CHANNEL, fanout_key, inflight_key, set_halted, load_halted, parse_halted_update
+)
+from app.services.scheduler_timers import SCHEDULER_CHANNEL
+
+async def start_fanout(redis_client, campaign_id: int, indexes, windowed: bool = True):
+    """A fan-out record with the given tasks published and in flight."""
+    await redis_client.hset(fanout_key(campaign_id), mapping={"enqueued": len(indexes), "windowed": int(windowed)})
+    if windowed:
+        await redis_client.sadd(inflight_key(campaign_id), *indexes)
+
+@pytest.mark.asyncio
+async def test_finish_task_returns_credit_and_counts_once(redis_client):
+    counters = CompletionCounters(redis_client)
+    await start_fanout(redis_client, 7, [0, 1, 2])
+
+    await counters.finish_task({"campaign_id": 7, "index": 1})
+    # A redelivered entry of the same task is not counted again
+    await counters.finish_task({"campaign_id": 7, "index": 1})
+
+    assert await redis_client.smembers(inflight_key(7)) == {b"0", b"2"}
+    assert await redis_client.hget(fanout_key(7), "processed") == b"1"
+
+@pytest.mark.asyncio
+async def test_finish_task_ignores_drips_and_untracked_campaigns(redis_client):
+    counters = CompletionCounters(redis_client)
+
+    await counters.finish_task({"campaign_id": "drip_3_17", "index": 0})
+    await counters.finish_task({"campaign_id": 8, "index": 0})
+
+    assert not await redis_client.exists(fanout_key(8))
+    assert await redis_client.smembers(COMPLETED_KEY) == set()
+
+@pytest.mark.asyncio
+async def test_last_task_after_fanout_done_flags_completion(redis_client):
+    counters = CompletionCounters(redis_client)
+    await start_fanout(redis_client, 7, [0, 1])
+    pubsub = redis_client.pubsub()
+    await pubsub.subscribe(SCHEDULER_CHANNEL)
+    await pubsub.get_message(timeout=1) # Subscription confirmation
+
+    assert await counters.mark_fanout_done(7) is False
+    await counters.finish_task({"campaign_id": 7, "index": 0})
+    assert await redis_client.smembers(COMPLETED_KEY) == set()
+
+    await counters.finish_task({"campaign_id": 7, "index": 1})
+    assert await redis_client.smembers(COMPLETED_KEY) == {b"7"}
+    message = await pubsub.get_message(timeout=1)
+    assert message["data"] == b"completion:0"
+    await pubsub.aclose()
+
+@pytest.mark.asyncio
+async def test_fanout_done_after_last_task_flags_completion(redis_client):
+    counters = CompletionCounters(redis_client)
+    await start_fanout(redis_client, 7, [0, 1])
+
+    # Workers finished before the feeder wrote its final checkpoint
+    await counters.finish_task({"campaign_id": 7, "index": 0})
+    await counters.finish_task({"campaign_id": 7, "index": 1})
+    assert await redis_client.smembers(COMPLETED_KEY) == set()
+
+    assert await counters.mark_fanout_done(7) is True
+    assert await redis_client.smembers(COMPLETED_KEY) == {b"7"}
+    assert await redis_client.hget(fanout_key(7), "done") == b"1"
+
+@pytest.mark.asyncio
+async def test_unwindowed_fanout_counts_every_finish(redis_client):
+    counters = CompletionCounters(redis_client)
+    await start_fanout(redis_client, 9, [0, 1], windowed=False)
+    await counters.mark_fanout_done(9)
+
+    await counters.finish_task({"campaign_id": 9, "index": 0})
+    await counters.finish_task({"campaign_id": 9, "index": 1})
+
+    assert await redis_client.hget(fanout_key(9), "processed") == b"2"
+    assert await redis_client.smembers(COMPLETED_KEY) == {b"9"}
+
+@pytest.mark.asyncio
+async def test_set_halted_publishes_the_change(redis_client):
+    pubsub = redis_client.pubsub()
+    await pubsub.subscribe(CAMPAIGN_CHANNEL)
+    await pubsub.get_message(timeout=1) # Subscription confirmation
+
+    await set_halted(redis_client, 7, "paused")
+    await set_halted(redis_client, 7, None)
+
+    updates = [parse_halted_update((await pubsub.get_message(timeout=1))["data"]) for _ in range(2)]
+    assert updates == [(7, "paused"), (7, None)]
+    assert await load_halted(redis_client) == {}
+    await pubsub.aclose()
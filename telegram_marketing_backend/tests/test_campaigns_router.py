@@ -0,0 +1,84 @@
+import sys
+import os
+import msgpack
+import pytest
+import pytest_asyncio
+from httpx import AsyncClient, ASGITransport
+
+# Add the parent directory to sys.path
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app.main import app
+from app.database import get_db
+from app.events.payloads import encode_event
+from app.events.producer import producer
+from app.models import Campaign
+from app.routers import campaigns as campaigns_router
+from app.services.campaign_state import COMPLETED_KEY, CompletionCounters, fanout_key, inflight_key, parked_key, load_halted
+from app.services.scheduler_timers import SCHEDULER_CHANNEL
+
+@pytest_asyncio.fixture
+async def client(redis_client, session_factory, monkeypatch):
+    async def override_get_db():
+        async with session_factory() as session:
+            yield session
+
+    monkeypatch.setattr(producer, "redis", redis_client)
+    monkeypatch.setitem(app.dependency_overrides, get_db, override_get_db)
+    async with AsyncClient(transport=ASGITransport(app=app), base_url="http://test") as c:
+        yield c
+
+@pytest.mark.asyncio
+async def test_resume_wakes_completion_for_campaign_finished_while_paused(client, redis_client, session_factory):
+    async with session_factory() as db:
+        campaign = Campaign(name="campaign", status="paused", config={})
+        db.add(campaign)
+        await db.commit()
+        campaign_id = campaign.id
+    # Every task was processed while paused, so the completion check left the flag in place
+    await redis_client.hset(fanout_key(campaign_id), mapping={"cursor": 2, "enqueued": 2, "processed": 2, "done": 1})
+    await redis_client.sadd(COMPLETED_KEY, campaign_id)
+    pubsub = redis_client.pubsub()
+    await pubsub.subscribe(SCHEDULER_CHANNEL)
+    await pubsub.get_message(timeout=1) # Subscription confirmation
+
+    response = await client.post(f"/campaigns/resume/{campaign_id}")
+
+    assert response.status_code == 200
+    message = await pubsub.get_message(timeout=1)
+    assert message is not None and message["data"] == b"completion:0"
+    await pubsub.aclose()
+
+async def create_campaign(session_factory, status: str) -> int:
+    async with session_factory() as db:
+        campaign = Campaign(name="campaign", status=status, config={})
+        db.add(campaign)
+        await db.commit()
+        return campaign.id
+
+@pytest.mark.asyncio
+async def test_stop_counts_the_parked_tasks_it_discards(client, redis_client, session_factory, monkeypatch):
+    monkeypatch.setattr(campaigns_router, "completion", CompletionCounters(redis_client))
+    campaign_id = await create_campaign(session_factory, "paused")
+    await redis_client.hset(fanout_key(campaign_id), mapping={"cursor": 3, "enqueued": 3, "processed": 1, "done": 1, "windowed": 1})
+    await redis_client.sadd(inflight_key(campaign_id), 1, 2)
+    for index in (1, 2):
+        fields = encode_event("send_message", {"campaign_id": campaign_id, "index": index, "recipient": f"user{index}"})
+        await redis_client.rpush(parked_key(campaign_id), msgpack.packb(fields, use_bin_type=True))
+
+    response = await client.post(f"/campaigns/stop/{campaign_id}")
+
+    assert response.status_code == 200
+    assert await redis_client.exists(parked_key(campaign_id)) == 0
+    assert await redis_client.hget(fanout_key(campaign_id), "processed") == b"3"
+    # Nothing of it can still be queued, so the prune job can drop the halted entry
+    assert await load_halted(redis_client) == {campaign_id: "stopped"}
+
+@pytest.mark.asyncio
+async def test_cancelling_a_scheduled_campaign_does_not_halt_it(client, redis_client, session_factory):
+    campaign_id = await create_campaign(session_factory, "scheduled")
+
+    response = await client.delete(f"/scheduler/{campaign_id}")
+
+    assert response.status_code == 200
+    assert await load_halted(redis_client) == {}
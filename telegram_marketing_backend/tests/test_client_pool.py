@@ -0,0 +1,162 @@
+import sys
+import os
+import asyncio
+import pytest
+import pytest_asyncio
+
+# Add the parent directory to sys.path
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app.services.client_pool import TelegramClientPool, ClientUnavailable, CLIENT_CHANNEL
+
+class FakeClient:
+    """Stands in for a connected TelegramClient."""
+
+    def __init__(self, account_id: int):
+        self.account_id = account_id
+        self.connected = True
+        self.fail_connect = False
+
+    def is_connected(self):
+        return self.connected
+
+    async def connect(self):
+        if self.fail_connect:
+            raise ConnectionError("Telegram unreachable")
+        self.connected = True
+
+    async def disconnect(self):
+        self.connected = False
+
+@pytest_asyncio.fixture
+async def pool(redis_client):
+    """A pool on fakeredis whose connections are FakeClients, recorded in pool.connected."""
+    pool = TelegramClientPool(max_open=2, idle_timeout=60, redis_client=redis_client)
+    pool.connected = []
+
+    async def connect(account_id):
+        if account_id < 0:
+            raise ClientUnavailable(account_id, "not_found")
+        client = FakeClient(account_id)
+        pool.connected.append(client)
+        return client
+
+    pool._connect = connect
+    yield pool
+    await pool.close()
+
+@pytest.mark.asyncio
+async def test_session_change_published_by_another_process_drops_the_client(pool, redis_client):
+    async with pool.acquire(1) as client:
+        pass
+    await asyncio.sleep(0.01) # Let the listener subscribe
+
+    # The API process that signed the account in again
+    await redis_client.publish(CLIENT_CHANNEL, 1)
+    await asyncio.sleep(0.01)
+
+    assert not client.is_connected()
+    assert 1 not in pool.entries
+    async with pool.acquire(1) as fresh:
+        assert fresh is not client
+
+@pytest.mark.asyncio
+async def test_clients_are_shared_and_reference_counted(pool):
+    first = await pool.get(1)
+    second = await pool.get(1)
+
+    assert first is second
+    assert (pool.misses, pool.hits) == (1, 1)
+    assert pool.entries[1].refs == 2
+    await pool.release(1, first)
+    await pool.release(1, second)
+    assert pool.entries[1].refs == 0
+    # Released clients stay connected for the next caller
+    assert first.is_connected()
+
+@pytest.mark.asyncio
+async def test_unavailable_accounts_raise_and_take_no_slot(pool):
+    with pytest.raises(ClientUnavailable) as error:
+        await pool.get(-1)
+
+    assert error.value.reason == "not_found"
+    assert pool.entries == {}
+
+@pytest.mark.asyncio
+async def test_budget_evicts_the_least_recently_used_idle_client(pool):
+    async with pool.acquire(1) as first:
+        pass
+    async with pool.acquire(2):
+        pass
+    async with pool.acquire(3):
+        pass
+
+    assert list(pool.entries) == [2, 3]
+    assert not first.is_connected()
+    assert pool.evictions == 1
+
+@pytest.mark.asyncio
+async def test_budget_waits_while_every_client_is_busy(pool):
+    busy = [await pool.get(1), await pool.get(2)]
+
+    waiting = asyncio.create_task(pool.get(3))
+    await asyncio.sleep(0.01)
+    assert not waiting.done()
+
+    await pool.release(1, busy[0])
+    third = await asyncio.wait_for(waiting, 1)
+    assert third.account_id == 3
+    assert list(pool.entries) == [2, 3]
+    assert not busy[0].is_connected()
+
+@pytest.mark.asyncio
+async def test_idle_clients_are_disconnected(pool):
+    async with pool.acquire(1) as idle:
+        pass
+    busy = await pool.get(2)
+    pool.entries[2].last_used -= 120
+    pool.entries[1].last_used -= 120
+
+    await pool.evict_idle()
+
+    assert not idle.is_connected()
+    assert list(pool.entries) == [2]
+    assert busy.is_connected()
+
+@pytest.mark.asyncio
+async def test_dropped_connection_is_reconnected(pool):
+    async with pool.acquire(1) as client:
+        pass
+    client.connected = False
+
+    async with pool.acquire(1) as again:
+        assert again is client
+        assert again.is_connected()
+    assert pool.reconnects == 1
+
+@pytest.mark.asyncio
+async def test_failed_reconnect_replaces_the_client(pool):
+    async with pool.acquire(1) as client:
+        pass
+    client.connected = False
+    client.fail_connect = True
+
+    async with pool.acquire(1) as fresh:
+        assert fresh is not client
+    assert len(pool.connected) == 2
+
+@pytest.mark.asyncio
+async def test_invalidated_client_in_use_is_retired_until_released(pool):
+    old = await pool.get(1)
+
+    await pool.invalidate(1)
+    # Still sending with the old session; new callers get a new client
+    assert old.is_connected()
+    new = await pool.get(1)
+    assert new is not old
+    assert pool.stats()["open"] == 2
+
+    await pool.release(1, old)
+    assert not old.is_connected()
+    assert pool.retired == {}
+    await pool.release(1, new)
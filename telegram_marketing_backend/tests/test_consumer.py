@@ -0,0 +1,370 @@
+import sys
+import os
+import asyncio
+import pytest
+import pytest_asyncio
+from telethon import errors
+
+# Add the parent directory to sys.path
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app.events import consumer as consumer_module
+from app.events.consumer import EventConsumer, GROUP_NAME, LANE_QUEUE_SIZE, MAX_DELIVERIES, DEAD_LETTER_KEY, deliveries_key
+from app.events.deferred import DEFERRED_KEY
+from app.events.payloads import encode_event
+from app.events.producer import PRIORITY_STREAMS, STREAM_KEY
+from app.services.cooldowns import COOLDOWNS_KEY
+from app.services.campaign_state import set_halted, inflight_key, fanout_key, COMPLETED_KEY
+
+@pytest_asyncio.fixture
+async def consumer(redis_client):
+    """EventConsumer on fakeredis whose lanes record tasks instead of sending them.
+
+    A task whose account is in consumer.blocked waits until consumer.unblock is set.
+    """
+    consumer = EventConsumer(redis_client)
+    for stream in PRIORITY_STREAMS.values():
+        await redis_client.xgroup_create(stream, GROUP_NAME, id="0", mkstream=True)
+    consumer.handled = []
+    consumer.blocked = set()
+    consumer.unblock = asyncio.Event()
+
+    async def handle_lane_message(account_id, entry, data):
+        if account_id in consumer.blocked:
+            await consumer.unblock.wait()
+        consumer.handled.append((account_id, data["recipient"]))
+        await consumer.ack(entry)
+
+    consumer.handle_lane_message = handle_lane_message
+    consumer.select_account = lambda data: data["account_ids"][0]
+    yield consumer
+    consumer.stop()
+
+async def publish(redis_client, account_id: int, recipient: str, event_type: str = "send_message"):
+    data = {"campaign_id": 1, "index": 0, "recipient": recipient, "account_ids": [account_id]}
+    await redis_client.xadd(PRIORITY_STREAMS["bulk" if event_type == "send_message" else "high"], encode_event(event_type, data))
+
+async def read_and_dispatch(consumer):
+    for stream, message_id, message_data in await consumer.read_entries(100):
+        await consumer.dispatch((stream, message_id), message_data)
+
+@pytest.mark.asyncio
+async def test_saturated_lane_does_not_stall_other_accounts(consumer, redis_client):
+    consumer.blocked.add(1)
+    # One task in progress plus a full queue, and one more than fits
+    for i in range(LANE_QUEUE_SIZE + 2):
+        await publish(redis_client, 1, f"slow{i}")
+    await publish(redis_client, 2, "fast")
+
+    await asyncio.wait_for(read_and_dispatch(consumer), 1)
+    await asyncio.sleep(0.01)
+
+    assert consumer.handled == [(2, "fast")]
+    assert consumer.lane_full == 1
+    # The task that did not fit waits in the deferred queue and is no longer pending
+    assert await redis_client.zcard(DEFERRED_KEY) == 1
+    pending = await redis_client.xpending(STREAM_KEY, GROUP_NAME)
+    assert pending["pending"] == LANE_QUEUE_SIZE + 1
+
+    consumer.unblock.set()
+    await asyncio.sleep(0.05)
+    assert len(consumer.handled) == LANE_QUEUE_SIZE + 2
+    assert (await redis_client.xpending(STREAM_KEY, GROUP_NAME))["pending"] == 0
+
+@pytest.mark.asyncio
+async def test_lane_sends_high_priority_entries_first(consumer, redis_client):
+    consumer.blocked.add(1)
+    for i in range(3):
+        await publish(redis_client, 1, f"bulk{i}")
+    await read_and_dispatch(consumer)
+    await publish(redis_client, 1, "drip", event_type="send_drip")
+    await read_and_dispatch(consumer)
+
+    consumer.unblock.set()
+    await asyncio.sleep(0.05)
+    # bulk0 was already being sent when the drip arrived
+    assert [recipient for _, recipient in consumer.handled] == ["bulk0", "drip", "bulk1", "bulk2"]
+
+class FakeTemplate:
+    def render(self, variables):
+        return "Hello"
+
+class FakeClient:
+    def __init__(self):
+        self.release = asyncio.Event()
+        self.sent = []
+
+    async def send_message(self, entity, content):
+        await self.release.wait()
+        self.sent.append(entity)
+
+@pytest.mark.asyncio
+async def test_latency_is_measured_when_the_message_is_sent(redis_client, monkeypatch):
+    consumer = EventConsumer(redis_client)
+    for stream in PRIORITY_STREAMS.values():
+        await redis_client.xgroup_create(stream, GROUP_NAME, id="0", mkstream=True)
+    client = FakeClient()
+
+    async def get_template(template_id, db):
+        return FakeTemplate()
+
+    async def get_client(account_id):
+        return client
+
+    async def no_wait(account_id, delay):
+        pass
+
+    async def release(account_id, client):
+        pass
+
+    monkeypatch.setattr(consumer.templates, "get", get_template)
+    monkeypatch.setattr(consumer, "get_client", get_client)
+    monkeypatch.setattr(consumer, "wait_for_send_token", no_wait)
+    monkeypatch.setattr(consumer_module.client_pool, "release", release)
+    monkeypatch.setattr(consumer_module.entity_cache, "resolve", lambda *args: asyncio.sleep(0))
+
+    await publish(redis_client, 1, "+100")
+    [(stream, message_id, message_data)] = await consumer.read_entries(10)
+    await consumer.dispatch((stream, message_id), message_data)
+    await asyncio.sleep(0.05)
+    # Waiting in the lane (or for the send) is part of the latency
+    assert consumer.latency["bulk"][0] == 0
+
+    client.release.set()
+    await asyncio.sleep(0.01)
+    assert client.sent == ["+100"]
+    count, avg_ms, max_ms = consumer.latency["bulk"]
+    assert count == 1
+    assert avg_ms >= 50
+    consumer.stop()
+
+@pytest.mark.asyncio
+async def test_halted_campaigns_are_updated_one_at_a_time(consumer, redis_client):
+    await set_halted(redis_client, 5, "stopped")
+    listener = asyncio.create_task(consumer.invalidation_loop())
+    await asyncio.sleep(0.05)
+    assert consumer.halted == {5: "stopped"}
+
+    await set_halted(redis_client, 7, "paused")
+    await set_halted(redis_client, 5, None)
+    await asyncio.sleep(0.05)
+    listener.cancel()
+
+    assert consumer.halted == {7: "paused"}
+
+@pytest.mark.asyncio
+async def test_tasks_of_deleted_campaign_are_dropped(consumer, redis_client):
+    # Compact task (no account_ids) whose campaign context was deleted with the campaign
+    await redis_client.xadd(STREAM_KEY, encode_event("send_message", {"campaign_id": 3, "index": 0, "recipient": "alice"}))
+
+    await read_and_dispatch(consumer)
+
+    assert consumer.handled == []
+    assert consumer.dropped == 1
+    assert (await redis_client.xpending(STREAM_KEY, GROUP_NAME))["pending"] == 0
+
+async def leave_pending(redis_client, account_id: int, recipient: str, campaign_id: int = 1, index: int = 0):
+    """Publish a task and read it as a worker that then dies, leaving it pending."""
+    data = {"campaign_id": campaign_id, "index": index, "recipient": recipient, "account_ids": [account_id]}
+    await redis_client.xadd(STREAM_KEY, encode_event("send_message", data))
+    [[_, [(message_id, _)]]] = await redis_client.xreadgroup(GROUP_NAME, "dead-worker", {STREAM_KEY: ">"}, count=1)
+    return message_id
+
+@pytest.mark.asyncio
+async def test_reclaim_takes_over_entries_of_dead_workers(consumer, redis_client, monkeypatch):
+    monkeypatch.setattr(consumer_module, "CLAIM_IDLE_MS", 0)
+    message_id = await leave_pending(redis_client, 1, "alice")
+
+    await consumer.reclaim_pending()
+    await asyncio.sleep(0.01)
+
+    assert consumer.handled == [(1, "alice")]
+    assert (await redis_client.xpending(STREAM_KEY, GROUP_NAME))["pending"] == 0
+    # The delivery count of the reclaimed entry is cleaned up with its ack
+    assert not await redis_client.hexists(deliveries_key(STREAM_KEY), message_id)
+
+@pytest.mark.asyncio
+async def test_reclaim_dead_letters_entries_delivered_too_often(consumer, redis_client, monkeypatch):
+    monkeypatch.setattr(consumer_module, "CLAIM_IDLE_MS", 0)
+    message_id = await leave_pending(redis_client, 1, "poison", campaign_id=4, index=9)
+    # Reclaimed MAX_DELIVERIES - 1 times already, on top of its first delivery
+    await redis_client.hset(deliveries_key(STREAM_KEY), message_id, MAX_DELIVERIES - 1)
+    await redis_client.sadd(inflight_key(4), 9)
+    await redis_client.hset(fanout_key(4), mapping={"enqueued": 1, "done": 1, "windowed": 1, "processed": 0})
+
+    await consumer.reclaim_pending()
+
+    assert consumer.handled == []
+    [(_, dead)] = await redis_client.xrange(DEAD_LETTER_KEY)
+    assert dead[b"deliveries"] == str(MAX_DELIVERIES + 1).encode()
+    assert dead[b"stream"] == STREAM_KEY.encode()
+    assert (await redis_client.xpending(STREAM_KEY, GROUP_NAME))["pending"] == 0
+    # Its credit is returned so the campaign window does not shrink
+    assert await redis_client.smembers(inflight_key(4)) == set()
+    # It counts as processed and failed, so its campaign can still complete
+    assert await redis_client.hget(fanout_key(4), "processed") == b"1"
+    assert await redis_client.smembers(COMPLETED_KEY) == {b"4"}
+    assert [(row["recipient"], row["status"]) for row in consumer.log_writer.buffer] == [("poison", "failed")]
+
+@pytest.mark.asyncio
+async def test_undecodable_entry_is_dead_lettered(consumer, redis_client):
+    await redis_client.xadd(STREAM_KEY, {"type": "send_message", "v": 9, "p": b""})
+    await publish(redis_client, 1, "alice")
+
+    await read_and_dispatch(consumer)
+    await asyncio.sleep(0.01)
+
+    # The rest of the read is still dispatched
+    assert consumer.handled == [(1, "alice")]
+    assert consumer.held == {}
+    assert (await redis_client.xpending(STREAM_KEY, GROUP_NAME))["pending"] == 0
+    [(_, dead)] = await redis_client.xrange(DEAD_LETTER_KEY)
+    assert dead[b"v"] == b"9"
+    assert dead[b"error"].startswith(b"Cannot decode entry")
+
+@pytest.mark.asyncio
+async def test_entry_is_left_for_reclaim_when_its_context_cannot_be_read(consumer, redis_client, monkeypatch):
+    async def redis_down(data):
+        raise ConnectionError("Redis is down")
+
+    monkeypatch.setattr(consumer.contexts, "expand", redis_down)
+    await publish(redis_client, 1, "alice")
+
+    await read_and_dispatch(consumer)
+
+    # Not held, so the heartbeat stops refreshing it and reclaim delivers it again
+    assert consumer.held == {}
+    assert (await redis_client.xpending(STREAM_KEY, GROUP_NAME))["pending"] == 1
+    assert await redis_client.xlen(DEAD_LETTER_KEY) == 0
+
+@pytest.mark.asyncio
+async def test_entries_of_stopped_lanes_are_reclaimed_after_a_restart(consumer, redis_client, monkeypatch):
+    monkeypatch.setattr(consumer_module, "CLAIM_IDLE_MS", 0)
+    consumer.blocked.add(1)
+    await publish(redis_client, 1, "alice")
+    await read_and_dispatch(consumer)
+    assert len(consumer.held) == 1
+
+    # Lease lost: the lanes are cancelled with the entry still pending
+    consumer.stop()
+    assert consumer.held == {}
+
+    consumer.blocked.clear()
+    await consumer.reclaim_pending()
+    await asyncio.sleep(0.01)
+    assert consumer.handled == [(1, "alice")]
+    assert (await redis_client.xpending(STREAM_KEY, GROUP_NAME))["pending"] == 0
+
+@pytest.mark.asyncio
+async def test_single_entry_reads_take_turns_by_weight(consumer, redis_client, monkeypatch):
+    monkeypatch.setattr(consumer_module, "READ_WEIGHTS", {"high": 2, "bulk": 1})
+    for i in range(10):
+        await publish(redis_client, 1, f"bulk{i}")
+        await publish(redis_client, 1, f"drip{i}", event_type="send_drip")
+
+    streams = [(await consumer.read_entries(1))[0][0] for _ in range(9)]
+
+    # Sequential mode reads one entry at a time; bulk still gets its share
+    assert streams.count(PRIORITY_STREAMS["high"].encode()) == 6
+    assert streams.count(PRIORITY_STREAMS["bulk"].encode()) == 3
+
+@pytest.mark.asyncio
+async def test_single_entry_read_falls_back_to_an_idle_priority(consumer, redis_client):
+    for i in range(3):
+        await publish(redis_client, 1, f"bulk{i}")
+
+    streams = [(await consumer.read_entries(1))[0][0] for _ in range(3)]
+
+    assert streams == [PRIORITY_STREAMS["bulk"].encode()] * 3
+
+class FloodClient:
+    """Sends at once, or raises a FloodWait for accounts in flooded."""
+
+    def __init__(self, account_id: int, flooded: set, sent: list):
+        self.account_id = account_id
+        self.flooded = flooded
+        self.sent = sent
+
+    async def send_message(self, entity, content):
+        if self.account_id in self.flooded:
+            raise errors.FloodWaitError(request=None, capture=30)
+        self.sent.append((self.account_id, entity))
+
+@pytest_asyncio.fixture
+async def sender(redis_client, monkeypatch):
+    """EventConsumer that runs process_message for real against FloodClients.
+
+    Accounts in sender.flooded hit a FloodWait; sends land in sender.sent.
+    The first account of a task that is not parked is chosen.
+    """
+    consumer = EventConsumer(redis_client)
+    for stream in PRIORITY_STREAMS.values():
+        await redis_client.xgroup_create(stream, GROUP_NAME, id="0", mkstream=True)
+    consumer.flooded = set()
+    consumer.sent = []
+
+    async def get_template(template_id, db):
+        return FakeTemplate()
+
+    async def get_client(account_id):
+        return FloodClient(account_id, consumer.flooded, consumer.sent)
+
+    async def no_wait(account_id, delay):
+        pass
+
+    async def release(account_id, client):
+        pass
+
+    monkeypatch.setattr(consumer.templates, "get", get_template)
+    monkeypatch.setattr(consumer, "get_client", get_client)
+    monkeypatch.setattr(consumer, "wait_for_send_token", no_wait)
+    monkeypatch.setattr(consumer_module.client_pool, "release", release)
+    monkeypatch.setattr(consumer_module.entity_cache, "resolve", lambda *args: asyncio.sleep(0))
+    consumer.select_account = lambda data: consumer.cooldowns.available(data["account_ids"])[0]
+    yield consumer
+    consumer.stop()
+
+async def publish_task(redis_client, account_ids: list, recipient: str):
+    data = {"campaign_id": 1, "index": 0, "recipient": recipient, "account_ids": account_ids}
+    await redis_client.xadd(STREAM_KEY, encode_event("send_message", data))
+
+@pytest.mark.asyncio
+async def test_flood_wait_parks_only_that_account_and_reroutes_the_task(sender, redis_client):
+    sender.flooded.add(1)
+    await publish_task(redis_client, [1, 2], "+100")
+    await publish_task(redis_client, [3], "+200")
+
+    await read_and_dispatch(sender)
+    await asyncio.sleep(0.01)
+    # Account 1 is parked for everyone; account 3 was not held up by it
+    assert sender.cooldowns.is_parked(1)
+    assert await redis_client.hexists(COOLDOWNS_KEY, 1)
+    assert sender.sent == [(3, "+200")]
+
+    # The task went back to the stream and now goes to the free account
+    await read_and_dispatch(sender)
+    await asyncio.sleep(0.01)
+    assert sender.sent == [(3, "+200"), (2, "+100")]
+    assert not sender.cooldowns.is_parked(2)
+    # Only the sends are logged, the FloodWait is not a result
+    assert [row["status"] for row in sender.log_writer.buffer] == ["sent", "sent"]
+    assert (await redis_client.xpending(STREAM_KEY, GROUP_NAME))["pending"] == 0
+
+@pytest.mark.asyncio
+async def test_task_waits_in_the_deferred_queue_while_all_its_accounts_are_parked(sender, redis_client):
+    sender.flooded.add(1)
+    await publish_task(redis_client, [1], "+100")
+    await read_and_dispatch(sender)
+    await asyncio.sleep(0.01)
+
+    # Its only account hit a FloodWait: deferred until the account unblocks
+    [(_, due_at)] = await redis_client.zrange(DEFERRED_KEY, 0, -1, withscores=True)
+    assert due_at == pytest.approx(sender.cooldowns.next_unblock([1]))
+
+    # Tasks published meanwhile for parked accounts skip the lanes altogether
+    await publish_task(redis_client, [1], "+200")
+    await read_and_dispatch(sender)
+    assert await redis_client.zcard(DEFERRED_KEY) == 2
+    assert sender.lanes.keys() == {1}
+    assert sender.sent == []
+    assert (await redis_client.xpending(STREAM_KEY, GROUP_NAME))["pending"] == 0
@@ -0,0 +1,26 @@
+import sys
+import os
+import time
+import pytest
+
+# Add the parent directory to sys.path
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app.events.deferred import DeferredQueue
+from app.events.payloads import decode_event
+from app.events.producer import PRIORITY_STREAMS, stream_for
+
+@pytest.mark.asyncio
+async def test_promote_due_moves_only_due_events_to_their_stream(redis_client):
+    queue = DeferredQueue(redis_client, stream_for)
+    await queue.schedule("send_message", {"campaign_id": 1, "index": 4, "recipient": "alice"}, time.time() - 1)
+    await queue.schedule("send_drip", {"campaign_id": "drip_1_2", "recipient": "bob"}, time.time() - 1)
+    await queue.schedule("send_message", {"campaign_id": 1, "index": 5, "recipient": "carol"}, time.time() + 60)
+
+    assert await queue.promote_due() == 2
+    assert await queue.size() == 1
+
+    [(_, bulk)] = await redis_client.xrange(PRIORITY_STREAMS["bulk"])
+    [(_, high)] = await redis_client.xrange(PRIORITY_STREAMS["high"])
+    assert decode_event(bulk) == ("send_message", {"campaign_id": 1, "index": 4, "recipient": "alice"})
+    assert decode_event(high)[1]["recipient"] == "bob"
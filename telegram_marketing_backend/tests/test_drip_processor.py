@@ -0,0 +1,47 @@
+import sys
+import os
+from datetime import datetime, timedelta
+import pytest
+
+# Add the parent directory to sys.path
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app.models import DripCampaign, DripStep, DripProgress
+from app.services.client_pool import ClientUnavailable
+from app.tasks import drip_processor
+
+@pytest.fixture
+def published(monkeypatch):
+    events = []
+
+    async def publish_many(items):
+        events.extend(items)
+
+    monkeypatch.setattr(drip_processor.producer, "publish_many", publish_many)
+    return events
+
+@pytest.mark.asyncio
+async def test_steps_of_unavailable_account_are_postponed(session_factory, published, monkeypatch):
+    async def unavailable(account_id):
+        raise ClientUnavailable(account_id, "not_logged_in")
+
+    monkeypatch.setattr(drip_processor, "AsyncSessionLocal", session_factory)
+    monkeypatch.setattr(drip_processor.client_pool, "get", unavailable)
+
+    due = datetime.utcnow() - timedelta(minutes=5)
+    async with session_factory() as db:
+        campaign = DripCampaign(name="drip", account_id=1, status="active")
+        db.add(campaign)
+        await db.flush()
+        db.add(DripStep(drip_campaign_id=campaign.id, template_id=1, step_order=0))
+        db.add(DripProgress(drip_campaign_id=campaign.id, user_data={"username": "alice"}, next_execution_time=due))
+        await db.commit()
+
+    await drip_processor.process_drip_campaigns()
+
+    async with session_factory() as db:
+        progress = await db.get(DripProgress, 1)
+    assert progress.status == "pending"
+    assert progress.next_execution_time >= due + timedelta(seconds=drip_processor.DRIP_RETRY_DELAY)
+    assert progress.next_execution_time > datetime.utcnow()
+    assert published == []
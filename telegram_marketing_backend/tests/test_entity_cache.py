@@ -0,0 +1,80 @@
+import sys
+import os
+import time
+import pytest
+from telethon import errors
+from telethon.tl.types import User
+
+# Add the parent directory to sys.path
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app.services.entity_cache import EntityCache, ENTITY_NEGATIVE_TTL, ENTITY_KEY_PREFIX
+
+class LookupClient:
+    """Resolves usernames from a dict; anything else is unknown to Telegram."""
+
+    def __init__(self, entities: dict, error: Exception = None):
+        self.entities = entities
+        self.error = error
+        self.lookups = 0
+
+    async def get_entity(self, recipient):
+        self.lookups += 1
+        if self.error is not None:
+            raise self.error
+        if recipient not in self.entities:
+            raise ValueError(f'No user has "{recipient}" as username')
+        return self.entities[recipient]
+
+@pytest.mark.asyncio
+async def test_unknown_recipients_are_cached_negatively(redis_client):
+    cache = EntityCache(redis_client)
+    client = LookupClient({})
+
+    assert await cache.resolve(client, 1, "nobody") is None
+    assert await cache.resolve(client, 1, "nobody") is None
+
+    assert client.lookups == 1
+    assert cache.unresolved == 1 and cache.local_hits == 1
+    key = f"{ENTITY_KEY_PREFIX}:1:nobody"
+    assert await redis_client.get(key) == b""
+    assert 0 < await redis_client.ttl(key) <= ENTITY_NEGATIVE_TTL
+
+@pytest.mark.asyncio
+async def test_other_workers_reuse_the_entry_and_its_remaining_ttl(redis_client):
+    client = LookupClient({"alice": User(id=5, access_hash=99, bot=True)})
+    peer = await EntityCache(redis_client).resolve(client, 1, "alice")
+    assert (peer.peer_type, peer.peer_id, peer.access_hash, peer.bot) == ("user", 5, 99, True)
+    await redis_client.expire(f"{ENTITY_KEY_PREFIX}:1:alice", 100)
+
+    other_worker = EntityCache(redis_client)
+    shared = await other_worker.resolve(client, 1, "alice")
+
+    assert client.lookups == 1
+    assert other_worker.redis_hits == 1
+    assert (shared.peer_id, shared.access_hash, shared.bot) == (5, 99, True)
+    # Kept locally only as long as Redis keeps it
+    expires_at, _ = other_worker.local[(1, "alice")]
+    assert expires_at - time.monotonic() == pytest.approx(100, abs=2)
+
+@pytest.mark.asyncio
+async def test_entries_are_per_account(redis_client):
+    cache = EntityCache(redis_client)
+    client = LookupClient({"alice": User(id=5, access_hash=99)})
+
+    await cache.resolve(client, 1, "alice")
+    await cache.resolve(client, 2, "alice")
+
+    # The access hash is only valid for the account that resolved it
+    assert client.lookups == 2
+
+@pytest.mark.asyncio
+async def test_flood_wait_is_raised_and_not_cached(redis_client):
+    cache = EntityCache(redis_client)
+    client = LookupClient({}, error=errors.FloodWaitError(request=None, capture=30))
+
+    with pytest.raises(errors.FloodWaitError):
+        await cache.resolve(client, 1, "alice")
+
+    assert cache.local == {}
+    assert await redis_client.exists(f"{ENTITY_KEY_PREFIX}:1:alice") == 0
@@ -0,0 +1,48 @@
+import sys
+import os
+import asyncio
+import pytest
+
+# Add the parent directory to sys.path
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app.services.leader import LeaderLease, leader_key
+
+@pytest.mark.asyncio
+async def test_only_one_leader_and_fencing_token_increases(redis_client):
+    first = LeaderLease("scheduler", redis_client)
+    second = LeaderLease("scheduler", redis_client)
+
+    assert await first.try_acquire() == 1
+    assert await second.try_acquire() == 0
+    assert await first.try_acquire() == 1
+    assert await first.check_fence()
+
+    # The first leader stalls past its lease and the second takes over
+    await redis_client.delete(leader_key("scheduler"))
+    assert await second.try_acquire() == 2
+    assert await second.check_fence()
+    assert not await first.check_fence()
+
+@pytest.mark.asyncio
+async def test_run_starts_job_only_on_leader_and_releases_on_cancel(redis_client):
+    leader = LeaderLease("scheduler", redis_client, renew_interval=0.01)
+    follower = LeaderLease("scheduler", redis_client, renew_interval=0.01)
+    started = []
+
+    async def job(name):
+        started.append(name)
+        await asyncio.Event().wait()
+
+    leading = asyncio.create_task(leader.run(lambda: job("leader")))
+    await asyncio.sleep(0.05)
+    following = asyncio.create_task(follower.run(lambda: job("follower")))
+    await asyncio.sleep(0.05)
+    assert started == ["leader"]
+
+    leading.cancel()
+    await asyncio.gather(leading, return_exceptions=True)
+    await asyncio.sleep(0.05)
+    assert started == ["leader", "follower"]
+    following.cancel()
+    await asyncio.gather(following, return_exceptions=True)
@@ -0,0 +1,71 @@
+import sys
+import os
+import pytest
+from sqlalchemy import func
+from sqlalchemy.exc import OperationalError
+from sqlalchemy.future import select
+
+# Add the parent directory to sys.path
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app.events.log_writer import SendLogWriter
+from app.models import SendLog
+
+async def logged_recipients(session_factory):
+    async with session_factory() as db:
+        result = await db.execute(select(SendLog.recipient).order_by(SendLog.id))
+        return result.scalars().all()
+
+@pytest.mark.asyncio
+async def test_flush_writes_buffered_rows(session_factory):
+    writer = SendLogWriter(session_factory)
+    writer.add(1, 1, "alice", "sent")
+    writer.add("drip_3_17", 1, "bob", "failed", "PeerFlood")
+
+    assert await writer.flush() == 2
+    assert writer.buffer == []
+    assert await logged_recipients(session_factory) == ["alice", "bob"]
+
+    async with session_factory() as db:
+        drip_row = (await db.execute(select(SendLog).where(SendLog.recipient == "bob"))).scalars().one()
+    assert drip_row.campaign_id is None
+    assert drip_row.error_message == "PeerFlood"
+
+@pytest.mark.asyncio
+async def test_transient_failure_keeps_rows_for_next_flush(session_factory):
+    outage = {"left": 1}
+
+    def flaky_factory():
+        if outage["left"]:
+            outage["left"] -= 1
+            raise OperationalError("INSERT", {}, ConnectionRefusedError("database is down"))
+        return session_factory()
+
+    writer = SendLogWriter(flaky_factory)
+    writer.add(1, 1, "alice", "sent")
+    writer.add(1, 1, "bob", "sent")
+
+    assert await writer.flush() == 0
+    assert writer.failures == 1
+    assert [row["recipient"] for row in writer.buffer] == ["alice", "bob"]
+
+    assert await writer.flush() == 2
+    assert await logged_recipients(session_factory) == ["alice", "bob"]
+
+@pytest.mark.asyncio
+async def test_poison_row_is_dropped_and_the_rest_written(session_factory):
+    writer = SendLogWriter(session_factory)
+    for recipient in ["a", "b", "c", None, "e", "f", "g"]:
+        writer.add(1, 1, recipient, "sent")
+
+    assert await writer.flush() == 6
+    assert writer.buffer == []
+    assert writer.rows_rejected == 1
+    assert writer.failures == 0
+    assert await logged_recipients(session_factory) == ["a", "b", "c", "e", "f", "g"]
+
+    # The next batch is not held up by the rejected row
+    writer.add(1, 1, "h", "sent")
+    assert await writer.flush() == 1
+    async with session_factory() as db:
+        assert (await db.execute(select(func.count(SendLog.id)))).scalar() == 7
@@ -0,0 +1,28 @@
+import sys
+import os
+import asyncio
+import signal
+import pytest
+
+# Add the parent directory to sys.path
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app.__main__ import run_until_terminated
+
+@pytest.mark.asyncio
+@pytest.mark.skipif(sys.platform == "win32", reason="no loop signal handlers on Windows")
+async def test_sigterm_cancels_the_role_and_runs_its_cleanup():
+    cleaned_up = []
+
+    async def role():
+        try:
+            os.kill(os.getpid(), signal.SIGTERM)
+            await asyncio.sleep(10)
+        finally:
+            cleaned_up.append(True)
+
+    await asyncio.wait_for(run_until_terminated(role), 1)
+
+    assert cleaned_up == [True]
+    # The handler is removed again with the role
+    assert signal.getsignal(signal.SIGTERM) == signal.SIG_DFL
@@ -0,0 +1,49 @@
+import sys
+import os
+import json
+import pytest
+
+# Add the parent directory to sys.path
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import msgpack
+from app.events.payloads import encode_event, decode_event, task_variables, CampaignContextCache, campaign_ctx_key
+
+def stream_fields(fields: dict) -> dict:
+    # What XREADGROUP hands back: bytes keys and values
+    return {k.encode(): v if isinstance(v, bytes) else str(v).encode() for k, v in fields.items()}
+
+def test_compact_round_trip():
+    task = {"campaign_id": 7, "index": 3, "recipient": "@alice", "template_id": 2, "variables": {"name": "Alice"}}
+    event_type, data = decode_event(stream_fields(encode_event("send_message", task)))
+    assert event_type == "send_message"
+    assert data == task
+
+def test_legacy_json_entries_still_decode():
+    task = {"campaign_id": "drip_1_0", "recipient": "+100", "account_ids": [1]}
+    event_type, data = decode_event(stream_fields({"type": "send_message", "data": json.dumps(task)}))
+    assert event_type == "send_message"
+    assert data == task
+
+@pytest.mark.asyncio
+async def test_context_fields_are_merged_and_not_reencoded(redis_client):
+    await redis_client.set(campaign_ctx_key(7), msgpack.packb({"account_ids": [1, 2], "delay": 2.0, "ab_test_id": None}))
+    contexts = CampaignContextCache(redis_client)
+    data = await contexts.expand({"campaign_id": 7, "recipient": "@bob"})
+    assert data["account_ids"] == [1, 2] and data["delay"] == 2.0
+
+    _, requeued = decode_event(stream_fields(encode_event("send_message", {**data, "attempt": 1})))
+    assert requeued == {"campaign_id": 7, "recipient": "@bob", "attempt": 1}
+
+def test_task_variables_keep_only_placeholders():
+    user = {"phone": "+100", "first_name": "Ann", "notes": "x" * 1000}
+    assert task_variables(user, {"first_name", "missing"}) == {"first_name": "Ann"}
+    assert task_variables(user, None) is user
+
+def test_campaign_tasks_slice_keeps_absolute_indexes():
+    from app.events.payloads import campaign_tasks
+    from app.services.template_selector import TemplateSelector
+    users = [{"phone": f"+{i}"} if i != 3 else {"name": "no contact"} for i in range(6)]
+    tasks = [data for _, data in campaign_tasks(1, users, TemplateSelector(template_id=5), {}, 2, 5)]
+    assert [t["index"] for t in tasks] == [2, 4]
+    assert tasks[0]["recipient"] == "+2" and tasks[0]["template_id"] == 5
@@ -0,0 +1,42 @@
+import sys
+import os
+import pytest
+
+# Add the parent directory to sys.path
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app.events.producer import EventProducer, PRIORITY_STREAMS, STREAM_KEY
+from app.events.payloads import decode_event
+
+@pytest.fixture
+def producer(redis_client, monkeypatch):
+    producer = EventProducer()
+    producer.redis = redis_client
+    producer.pipelines = 0
+    pipeline = redis_client.pipeline
+
+    def counting_pipeline(*args, **kwargs):
+        assert kwargs.get("transaction") is False
+        producer.pipelines += 1
+        return pipeline(*args, **kwargs)
+
+    monkeypatch.setattr(redis_client, "pipeline", counting_pipeline)
+    return producer
+
+@pytest.mark.asyncio
+async def test_publish_many_batches_pipelines(producer, redis_client):
+    events = (("send_message", {"campaign_id": 1, "index": i}) for i in range(2500))
+
+    assert await producer.publish_many(events, batch_size=1000) == 2500
+    assert producer.pipelines == 3
+    entries = await redis_client.xrange(STREAM_KEY)
+    assert sorted(decode_event(fields)[1]["index"] for _, fields in entries) == list(range(2500))
+
+@pytest.mark.asyncio
+async def test_publish_many_routes_events_by_priority(producer, redis_client):
+    events = [("send_message", {"campaign_id": 1, "index": 0}), ("send_drip", {"campaign_id": "drip_1"})]
+
+    assert await producer.publish_many(events) == 2
+    assert await redis_client.xlen(STREAM_KEY) == 1
+    high = await redis_client.xrange(PRIORITY_STREAMS["high"])
+    assert decode_event(high[0][1]) == ("send_drip", {"campaign_id": "drip_1"})
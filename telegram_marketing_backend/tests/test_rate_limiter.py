@@ -0,0 +1,46 @@
+import sys
+import os
+import asyncio
+import pytest
+
+# Add the parent directory to sys.path
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app.events.rate_limiter import AccountRateLimiter
+
+@pytest.mark.asyncio
+async def test_bucket_allows_a_burst_then_throttles(redis_client):
+    limiter = AccountRateLimiter(redis_client, burst=2)
+
+    assert await limiter.try_acquire(1, rate=1) == 0
+    assert await limiter.try_acquire(1, rate=1) == 0
+    wait = await limiter.try_acquire(1, rate=1)
+    assert 0.9 < wait <= 1.0
+    assert limiter.throttled == 1
+
+@pytest.mark.asyncio
+async def test_bucket_refills_at_the_rate(redis_client):
+    limiter = AccountRateLimiter(redis_client, burst=1)
+
+    assert await limiter.try_acquire(1, rate=10) == 0
+    assert await limiter.try_acquire(1, rate=10) > 0
+    await asyncio.sleep(0.15)
+    assert await limiter.try_acquire(1, rate=10) == 0
+
+@pytest.mark.asyncio
+async def test_buckets_are_per_account_and_shared_by_workers(redis_client):
+    worker_a = AccountRateLimiter(redis_client, burst=1)
+    worker_b = AccountRateLimiter(redis_client, burst=1)
+
+    assert await worker_a.try_acquire(1, rate=1) == 0
+    # Same account from another worker: the token is already taken
+    assert await worker_b.try_acquire(1, rate=1) > 0
+    assert await worker_b.try_acquire(2, rate=1) == 0
+
+@pytest.mark.asyncio
+async def test_zero_rate_is_unlimited(redis_client):
+    limiter = AccountRateLimiter(redis_client, burst=1)
+
+    for _ in range(5):
+        assert await limiter.try_acquire(1, rate=0) == 0
+    assert await redis_client.keys("rate:*") == []
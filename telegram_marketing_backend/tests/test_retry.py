@@ -0,0 +1,32 @@
+import sys
+import os
+import asyncio
+
+# Add the parent directory to sys.path
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from telethon import errors
+from redis import exceptions as redis_errors
+from app.events.retry import RetryPolicy, classify_error
+
+def test_classify_transient_errors():
+    assert classify_error(ConnectionResetError()) == "network"
+    assert classify_error(asyncio.TimeoutError()) == "timeout"
+    assert classify_error(errors.ServerError(None, "INTERNAL")) == "server"
+    assert classify_error(errors.TimedOutError(None, "Timeout")) == "timeout"
+    # Raised while resolving a recipient through the entity cache
+    assert classify_error(redis_errors.ConnectionError("Connection refused")) == "network"
+    assert classify_error(redis_errors.TimeoutError("Timeout reading from socket")) == "timeout"
+
+def test_classify_permanent_errors():
+    assert classify_error(ValueError("bad recipient")) is None
+    assert classify_error(errors.BadRequestError(None, "PEER_ID_INVALID")) is None
+
+def test_policy_backoff_is_exponential_and_capped():
+    policy = RetryPolicy(base=5, factor=2, max_delay=30, jitter=0)
+    assert [policy.delay(a) for a in range(1, 6)] == [5, 10, 20, 30, 30]
+
+def test_policy_jitter_stays_in_bounds():
+    policy = RetryPolicy(base=10, jitter=0.2)
+    for _ in range(100):
+        assert 8 <= policy.delay(1) <= 12
@@ -0,0 +1,191 @@
+import sys
+import os
+import asyncio
+import json
+import time
+import msgpack
+import pytest
+
+# Add the parent directory to sys.path
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app import scheduler_service
+from app.scheduler_service import Scheduler, Job, JobStats, DRIP_MIN_INTERVAL, SCHEDULER_RETRY_DELAY, prune_halted_campaigns
+from app.services.scheduler_timers import SCHEDULER_JOBS_KEY, wake_scheduler
+from app.events.payloads import encode_event
+from app.services.campaign_state import CompletionCounters, fanout_key, inflight_key, parked_key, set_halted, load_halted
+from app.tasks.campaign_runner import fanout_lock_key
+
+@pytest.mark.asyncio
+async def test_drips_left_due_are_not_rerun_immediately(monkeypatch):
+    async def process():
+        pass
+
+    async def still_due():
+        return time.time() - 600
+
+    monkeypatch.setattr(scheduler_service, "process_drip_campaigns", process)
+    monkeypatch.setattr(scheduler_service, "next_drip_time", still_due)
+
+    before = time.time()
+    assert await Scheduler().run_drips() >= before + DRIP_MIN_INTERVAL
+
+@pytest.mark.asyncio
+async def test_drips_keep_a_future_due_time(monkeypatch):
+    due_at = time.time() + 3600
+
+    async def process():
+        pass
+
+    async def later():
+        return due_at
+
+    monkeypatch.setattr(scheduler_service, "process_drip_campaigns", process)
+    monkeypatch.setattr(scheduler_service, "next_drip_time", later)
+
+    assert await Scheduler().run_drips() == due_at
+
+@pytest.mark.asyncio
+async def test_prune_forgets_stopped_campaigns_once_drained(redis_client, monkeypatch):
+    monkeypatch.setattr(scheduler_service.producer, "redis", redis_client)
+    await redis_client.hset(fanout_key(1), mapping={"enqueued": 10, "processed": 10}) # Drained
+    await redis_client.hset(fanout_key(2), mapping={"enqueued": 10, "processed": 4}) # Tasks still queued
+    await redis_client.hset(fanout_key(3), mapping={"enqueued": 10, "processed": 10})
+    await redis_client.set(fanout_lock_key(3), "feeder") # Feeder may still publish
+    await redis_client.hset(fanout_key(4), mapping={"enqueued": 10, "processed": 10})
+    for campaign_id in (1, 2, 3):
+        await set_halted(redis_client, campaign_id, "stopped")
+    await set_halted(redis_client, 4, "paused")
+
+    await prune_halted_campaigns()
+
+    assert await load_halted(redis_client) == {2: "stopped", 3: "stopped", 4: "paused"}
+
+@pytest.mark.asyncio
+async def test_prune_counts_tasks_parked_after_the_stop(redis_client, monkeypatch):
+    monkeypatch.setattr(scheduler_service.producer, "redis", redis_client)
+    monkeypatch.setattr(scheduler_service, "completion", CompletionCounters(redis_client))
+    await redis_client.hset(fanout_key(1), mapping={"enqueued": 2, "processed": 1, "done": 1, "windowed": 1})
+    await redis_client.sadd(inflight_key(1), 7)
+    # A worker set the task aside before it saw the stop
+    fields = encode_event("send_message", {"campaign_id": 1, "index": 7, "recipient": "alice"})
+    await redis_client.rpush(parked_key(1), msgpack.packb(fields, use_bin_type=True))
+    await set_halted(redis_client, 1, "stopped")
+
+    await prune_halted_campaigns()
+
+    assert await redis_client.exists(parked_key(1)) == 0
+    assert await redis_client.hget(fanout_key(1), "processed") == b"2"
+    assert await load_halted(redis_client) == {}
+
+@pytest.fixture
+def scheduler(redis_client, monkeypatch):
+    """A Scheduler on fakeredis with its jobs replaced by set_jobs()."""
+    monkeypatch.setattr(scheduler_service.producer, "redis", redis_client)
+    scheduler = Scheduler()
+
+    def set_jobs(*jobs):
+        scheduler.jobs = {job.name: job for job in jobs}
+        scheduler.stats = {job.name: JobStats() for job in jobs}
+
+    scheduler.set_jobs = set_jobs
+    return scheduler
+
+async def run_for(scheduler, seconds: float):
+    task = asyncio.create_task(scheduler.run())
+    await asyncio.sleep(seconds)
+    task.cancel()
+    await asyncio.gather(task, return_exceptions=True)
+
+@pytest.mark.asyncio
+async def test_job_runs_again_at_the_time_it_returns(scheduler):
+    runs = []
+
+    async def job():
+        runs.append(time.time())
+        return time.time() + 0.1 if len(runs) < 3 else None
+
+    scheduler.set_jobs(Job("job", job, interval=60))
+    await run_for(scheduler, 0.35)
+
+    assert len(runs) == 3
+    assert runs[2] - runs[1] >= 0.09
+    # After returning None it waits for its interval
+    assert scheduler.timers.due["job"] >= runs[-1] + 59
+
+@pytest.mark.asyncio
+async def test_timed_out_job_is_cancelled_and_retried_later(scheduler, redis_client):
+    async def hangs():
+        await asyncio.sleep(10)
+
+    scheduler.set_jobs(Job("slow", hangs, interval=60, timeout=0.05))
+    before = time.time()
+    await run_for(scheduler, 0.15)
+
+    stats = scheduler.stats["slow"]
+    assert (stats.runs, stats.timeouts, stats.last_status) == (1, 1, "timeout")
+    assert scheduler.timers.due["slow"] >= before + SCHEDULER_RETRY_DELAY
+    published = json.loads(await redis_client.hget(SCHEDULER_JOBS_KEY, "slow"))
+    assert published["last_status"] == "timeout"
+
+@pytest.mark.asyncio
+async def test_overlap_policies(scheduler):
+    release = asyncio.Event()
+    runs = {"queued": 0, "skipped": 0}
+
+    def job(name):
+        async def run():
+            runs[name] += 1
+            await release.wait()
+        return run
+
+    scheduler.set_jobs(Job("queued", job("queued"), overlap="queue"), Job("skipped", job("skipped"), overlap="skip"))
+    for name in ("queued", "skipped"):
+        scheduler.start_job(name)
+    await asyncio.sleep(0.01)
+    for name in ("queued", "skipped"):
+        scheduler.start_job(name)
+    release.set()
+    await asyncio.sleep(0.01)
+
+    assert scheduler.stats["skipped"].skipped == 1
+    # The queued job was rescheduled to run again right away
+    assert "queued" in scheduler.timers.due and "skipped" not in scheduler.timers.due
+    assert runs == {"queued": 1, "skipped": 1}
+
+@pytest.mark.asyncio
+async def test_wakeup_runs_a_job_without_waiting(scheduler, redis_client):
+    runs = []
+
+    async def job():
+        runs.append(time.time())
+
+    scheduler.set_jobs(Job("completion", job))
+    task = asyncio.create_task(scheduler.run())
+    await asyncio.sleep(0.05)
+    runs.clear() # The catch-up run after subscribing
+
+    await wake_scheduler(redis_client, "completion")
+    await asyncio.sleep(0.05)
+    task.cancel()
+    await asyncio.gather(task, return_exceptions=True)
+
+    assert len(runs) == 1
+
+@pytest.mark.asyncio
+async def test_job_is_skipped_once_a_newer_leader_exists(scheduler):
+    class StaleLease:
+        async def check_fence(self):
+            return False
+
+    runs = []
+
+    async def job():
+        runs.append(1)
+
+    scheduler.lease = StaleLease()
+    scheduler.set_jobs(Job("job", job))
+    await scheduler.run_job("job")
+
+    assert runs == []
+    assert scheduler.stats["job"].skipped == 1
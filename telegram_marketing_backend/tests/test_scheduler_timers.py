@@ -0,0 +1,37 @@
+import sys
+import os
+from datetime import datetime
+
+# Add the parent directory to sys.path
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app.services.scheduler_timers import TimerHeap, parse_wakeup, wakeup_message, utc_timestamp
+
+def test_pop_due_returns_due_jobs_in_order():
+    timers = TimerHeap()
+    timers.push("drips", 30)
+    timers.push("warmup", 10)
+    timers.push("completion", 50)
+
+    assert timers.next_due() == 10
+    assert timers.pop_due(30) == ["warmup", "drips"]
+    assert timers.next_due() == 50
+    assert len(timers) == 1
+
+def test_push_keeps_earliest_due_time():
+    timers = TimerHeap()
+    timers.push("drips", 30)
+    timers.push("drips", 40)
+    timers.push("drips", 20)
+
+    assert timers.next_due() == 20
+    assert timers.pop_due(100) == ["drips"]
+    assert timers.next_due() is None
+
+def test_wakeup_message_round_trip():
+    assert parse_wakeup(wakeup_message("drips", 1700000000.5).encode()) == ("drips", 1700000000.5)
+    job, due_at = parse_wakeup(wakeup_message("completion"))
+    assert job == "completion" and due_at > 0
+
+def test_utc_timestamp_of_naive_datetime():
+    assert utc_timestamp(datetime(1970, 1, 1, 0, 1)) == 60
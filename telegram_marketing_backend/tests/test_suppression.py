@@ -0,0 +1,29 @@
+import sys
+import os
+import pytest
+
+# Add the parent directory to sys.path
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app.services.suppression import SuppressionIndex, normalize_recipient, seen_key
+
+def test_normalize_recipient():
+    assert normalize_recipient(" @Alice ") == "alice"
+    assert normalize_recipient("+1 (555) 010-99") == "+155501099"
+
+@pytest.mark.asyncio
+async def test_check_reports_reasons_and_duplicates(redis_client):
+    index = SuppressionIndex(redis_client)
+    await index.add("opted_out", ["@bob"])
+    batch = [(0, "alice"), (1, "Bob"), (2, "@ALICE"), (3, "+100")]
+
+    assert await index.check(1, batch) == [None, "opted_out", "duplicate", None]
+    assert await redis_client.hgetall(seen_key(1)) == {b"alice": b"0", b"+100": b"3"}
+
+@pytest.mark.asyncio
+async def test_recheck_after_resume_keeps_the_same_rows(redis_client):
+    index = SuppressionIndex(redis_client)
+    await index.check(1, [(0, "alice"), (1, "carol")])
+    # A resumed fan-out re-checks row 1 and meets a later duplicate of row 0
+    assert await index.check(1, [(1, "carol"), (2, "alice")]) == [None, "duplicate"]
+    assert await index.check(1, [(1, "carol")], reasons=()) == [None]
@@ -0,0 +1,27 @@
+import sys
+import os
+from collections import Counter
+
+# Add the parent directory to sys.path
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app.services.template_selector import TemplateSelector
+
+def test_rotation_follows_step_counts():
+    selector = TemplateSelector(rotation_steps=[{"template_id": 1, "count": 2}, {"template_id": 2, "count": 1}])
+    assert [selector.select(i) for i in range(7)] == [1, 1, 2, 1, 1, 2, 1]
+
+def test_ab_selection_is_deterministic_and_weighted():
+    selector = TemplateSelector(variants=[(1, 80), (2, 20)], seed=42)
+    picks = [selector.select(i) for i in range(10000)]
+    assert picks == [TemplateSelector(variants=[(1, 80), (2, 20)], seed=42).select(i) for i in range(10000)]
+    assert 0.77 < Counter(picks)[1] / len(picks) < 0.83
+
+def test_zero_weight_variant_is_never_chosen():
+    selector = TemplateSelector(variants=[(1, 0), (2, 10)], seed=7)
+    assert {selector.select(i) for i in range(1000)} == {2}
+
+def test_auto_rotation_and_fallback():
+    selector = TemplateSelector.from_config({"template_id": 9, "auto_rotation_config": {"template_ids": [3, 4], "rotate_every": 2}})
+    assert [selector.select(i) for i in range(6)] == [3, 3, 4, 4, 3, 3]
+    assert TemplateSelector.from_config({"template_id": 9}).select(123) == 9
@@ -0,0 +1,40 @@
+import sys
+import os
+import pytest
+
+# Add the parent directory to sys.path
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app.events.templates import CompiledTemplate, TemplateCache
+
+def test_render_substitutes_string_variables():
+    template = CompiledTemplate(1, "Hi {first_name}, meet {username}!")
+    assert template.keys == ["first_name", "username"]
+    assert template.render({"first_name": "Ann", "username": "@ann"}) == "Hi Ann, meet @ann!"
+
+def test_render_keeps_missing_and_non_string_placeholders():
+    template = CompiledTemplate(1, "{a}-{b}-{c}")
+    assert template.render({"a": "x", "b": 5}) == "x-{b}-{c}"
+
+def test_render_without_placeholders_returns_content():
+    template = CompiledTemplate(1, "Plain text")
+    assert template.placeholders == set()
+    assert template.render({"a": "x"}) == "Plain text"
+
+@pytest.mark.asyncio
+async def test_cache_evicts_least_recently_used():
+    cache = TemplateCache(max_size=2)
+    cache.put(1, "one")
+    cache.put(2, "two")
+    # Touch 1 so that 2 becomes the eviction candidate (hits never reach the db)
+    assert (await cache.get(1, db=None)).content == "one"
+    cache.put(3, "three")
+    assert list(cache.templates) == [1, 3]
+    assert cache.hits == 1
+
+def test_cache_invalidate():
+    cache = TemplateCache()
+    cache.put(1, "one")
+    cache.invalidate(1)
+    cache.invalidate(42)
+    assert cache.templates == {}
@@ -0,0 +1,20 @@
+import sys
+import os
+import json
+import time
+import pytest
+
+# Add the parent directory to sys.path
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app.services.worker_stats import WORKER_STATS_KEY, WORKER_STALE_AFTER, live_worker_stats
+
+@pytest.mark.asyncio
+async def test_only_workers_still_reporting_are_listed(redis_client):
+    now = time.time()
+    await redis_client.hset(WORKER_STATS_KEY, mapping={
+        "alive": json.dumps({"consumer": "alive", "updated_at": now}),
+        "gone": json.dumps({"consumer": "gone", "updated_at": now - WORKER_STALE_AFTER - 1}),
+    })
+
+    assert [stats["consumer"] for stats in await live_worker_stats(redis_client)] == ["alive"]